@@ -0,0 +1,386 @@
+"""
+Acquisition benchmark: datacollection loop, get_sensor_info and the hwmonitor
+sequence against the pty Modbus simulator (tools/K96Rpi_modbus_simulator.py).
+
+The services run in a scratch working directory holding a copy of settings.json
+with box.port pointing to the simulator, so local files, locks and settings
+writes stay out of the installation. Services are imported from the
+installation, which clears their stale lock files: run with the services stopped.
+
+Reported per scenario: cycle time, transactions per sample, bus frames per
+sample, p50/p95/p99 transaction latency, port open time, CPU time and data bytes
+written per hour, plus the lock wait/hold histograms of libs/local.py. Results
+are written as JSON to compare changes of libs/sensor_data_exchange.py over time.
+
+Usage:
+    python3 benchmarks/bench_acquisition.py [--duration 30] [--latency 0.002]
+        [--output benchmarks/results/acquisition.json]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'tools'))
+
+import libs.port_client as pc
+import libs.register_map as rm
+import libs.local as ll
+import libs.aggregator as agg
+import libs.sample_buffer as sb
+import libs.data_writer as dw
+import libs.sample_journal as sj
+import K96Rpi_modbus_simulator as simulator_module
+import datacollection_service.K96Rpi_datacollection as datacollection
+import sensorinfo_service.K96Rpi_sensor_info as sensor_info
+
+try:
+    import hwmonitor_service.K96Rpi_hwmonitor as hwmonitor
+except ImportError:
+    # RPi.GPIO is only available on the Raspberry Pi
+    hwmonitor = None
+
+#------------------------------------------------------------------------------
+def percentile(values, fraction):
+    """
+    Percentile of a list of values, by linear interpolation.
+
+    Args:
+        values (list): Measured values.
+        fraction (float): Percentile between 0 and 1.
+
+    Returns:
+        float or None: The percentile, None for an empty list.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def summarize(seconds):
+    """
+    Summary of durations in milliseconds.
+    """
+    if not seconds:
+        return {'count': 0}
+    return {
+        'count': len(seconds),
+        'mean': sum(seconds) / len(seconds) * 1000,
+        'p50': percentile(seconds, 0.50) * 1000,
+        'p95': percentile(seconds, 0.95) * 1000,
+        'p99': percentile(seconds, 0.99) * 1000,
+        'max': max(seconds) * 1000,
+    }
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def directory_size(path):
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(directory, name))
+    return total
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class Recorder:
+    """
+    Timing of every port connection transaction and port opening.
+
+    Wraps PortConnection.transact and port_client.open_port while installed,
+    services calling pc.open_port / pc.data_exchange are measured unchanged.
+    """
+
+    def __init__(self):
+        self.transactions = []
+        self.port_opens = []
+        self.failures = 0
+        self.original_transact = pc.PortConnection.transact
+        self.original_open_port = pc.open_port
+
+    def install(self):
+        recorder = self
+        original_transact = self.original_transact
+        original_open_port = self.original_open_port
+
+        def transact(connection, settings, request, priority=None):
+            start = time.perf_counter()
+            response = original_transact(connection, settings, request, priority)
+            recorder.transactions.append(time.perf_counter() - start)
+            if response is None:
+                recorder.failures += 1
+            return response
+
+        def open_port(settings, service, priority=pc.NORMAL):
+            start = time.perf_counter()
+            connection = original_open_port(settings, service, priority)
+            recorder.port_opens.append(time.perf_counter() - start)
+            return connection
+
+        pc.PortConnection.transact = transact
+        pc.open_port = open_port
+
+    def uninstall(self):
+        pc.PortConnection.transact = self.original_transact
+        pc.open_port = self.original_open_port
+
+    def reset(self):
+        self.transactions = []
+        self.port_opens = []
+        self.failures = 0
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def scenario_result(recorder, cycle_times, elapsed, cpu_time, written, frames):
+    cycles = len(cycle_times)
+    return {
+        'cycles': cycles,
+        'duration_s': elapsed,
+        'cycle_time_ms': summarize(cycle_times),
+        'transactions_per_cycle': len(recorder.transactions) / cycles if cycles else None,
+        'bus_frames_per_cycle': frames / cycles if cycles else None,
+        'failed_transactions': recorder.failures,
+        'transaction_latency_ms': summarize(recorder.transactions),
+        'port_open_ms': summarize(recorder.port_opens),
+        'cpu_time_s': cpu_time,
+        'cpu_ms_per_cycle': cpu_time / cycles * 1000 if cycles else None,
+        'bytes_written': written,
+        'bytes_per_hour': written / elapsed * 3600 if elapsed else None,
+    }
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def hold_lock(resource, seconds):
+    """
+    Hold a file lock from another process, like a slow reader of the data files.
+
+    Returns:
+        subprocess.Popen: The process holding the lock.
+    """
+    code = ("import fcntl, sys, time; f = open(sys.argv[1], 'a'); "
+            "fcntl.flock(f, fcntl.LOCK_EX); time.sleep(float(sys.argv[2]))")
+    return subprocess.Popen([sys.executable, '-c', code, os.path.join(ll.LOCK_DIR, f"{resource}.lock"), str(seconds)])
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def bench_datacollection(settings, recorder, simulator, duration, logger, lock_stall=0.0):
+    """
+    Run the datacollection main loop body for duration seconds.
+
+    With lock_stall, the rawdata lock is held by another process for that many
+    seconds in the middle of the run: cycle times show whether the disk side
+    delays the acquisition.
+    """
+    register_map = rm.RegisterMap(settings)
+    schedule = rm.SamplingSchedule(register_map)
+    timeframe = settings.get('box').get('user_data_data_step') * 60
+    sample_period = settings.get('raw_data').get('sample_period', 1)
+    aggregator = agg.WindowAggregator(register_map, timeframe, sample_period)
+    raw_data = settings.get('raw_data')
+    data_writer = dw.WriterThread("datacollection", logger, raw_data.get('writer_queue_size', dw.DEFAULT_QUEUE_SIZE))
+    data_writer.configure(raw_data.get('writer_overflow', dw.DEFAULT_OVERFLOW),
+                          raw_data.get('fsync_bytes', dw.DEFAULT_FSYNC_BYTES),
+                          raw_data.get('fsync_interval', dw.DEFAULT_FSYNC_INTERVAL))
+    data_writer.start()
+    journal = sj.SampleJournal(sj.JOURNAL_PATH, register_map, sb.window_capacity(timeframe, sample_period) * 2,
+                               raw_data.get('fsync_interval', dw.DEFAULT_FSYNC_INTERVAL))
+    cycle_times = []
+    staller = None
+
+    recorder.reset()
+    frames = simulator.requests
+    size = directory_size('data')
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        if lock_stall and staller is None and time.perf_counter() - start >= duration / 3:
+            staller = hold_lock("rawdata", lock_stall)
+        cycle_start = time.perf_counter()
+        comm_port = pc.open_port(settings, "datacollection", pc.BULK)
+        if comm_port is None:
+            raise RuntimeError("Simulator port cannot be opened")
+        window = datacollection.read_raw_data(settings, comm_port, schedule, aggregator, time.time(), journal, data_writer, logger)
+        comm_port.close()
+        if window is not None:
+            datacollection.write_user_data_to_file(settings, data_writer, window, logger)
+            datacollection.write_calc_data_to_file(settings, data_writer, window, logger)
+        cycle_times.append(time.perf_counter() - cycle_start)
+    if staller is not None:
+        staller.wait()
+    writer_stats = data_writer.report()
+    data_writer.close()
+    journal.close()
+    elapsed = time.perf_counter() - start
+    cpu_time = time.process_time() - cpu_start
+
+    result = scenario_result(recorder, cycle_times, elapsed, cpu_time,
+                             directory_size('data') - size, simulator.requests - frames)
+    result['samples_per_s'] = len(cycle_times) / elapsed
+    result['blocks_per_sample'] = len(register_map.raw_blocks)
+    result['registers_per_sample'] = len(register_map.raw_registers)
+    result['sample_buffer_bytes'] = aggregator.buffers.active.nbytes + aggregator.buffers.spare.nbytes
+    result['writer'] = writer_stats
+    return result
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def bench_runs(function, runs, recorder, simulator):
+    """
+    Run a one-shot service sequence several times.
+    """
+    cycle_times = []
+    recorder.reset()
+    frames = simulator.requests
+    size = directory_size('data')
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    for _ in range(runs):
+        cycle_start = time.perf_counter()
+        function()
+        cycle_times.append(time.perf_counter() - cycle_start)
+    elapsed = time.perf_counter() - start
+    cpu_time = time.process_time() - cpu_start
+
+    return scenario_result(recorder, cycle_times, elapsed, cpu_time,
+                           directory_size('data') - size, simulator.requests - frames)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def run_sensor_info(settings):
+    comm_port = pc.open_port(settings, "sensorinfo")
+    try:
+        sensor_info.get_sensor_info(settings, comm_port)
+    finally:
+        if comm_port is not None:
+            comm_port.close()
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def prepare_workdir(workdir, settings_path, port_name, flush_minutes):
+    """
+    Create the scratch working directory and its settings.json.
+
+    Returns:
+        dict: The benchmark settings.
+    """
+    with open(settings_path, 'r') as file:
+        settings = json.load(file)
+
+    settings['box']['port'] = port_name
+    # No broker socket in the scratch directory: services open the port directly
+    settings['box']['broker_socket'] = pc.DEFAULT_BROKER_SOCKET
+    settings['box']['user_data_data_step'] = flush_minutes
+    settings['last_known_date'] = int(datetime.datetime.now().strftime('%Y%m%d'))
+
+    for directory in ('locks', 'logs', 'data/raw_data', 'data/user_data'):
+        os.makedirs(os.path.join(workdir, directory), exist_ok=True)
+    with open(os.path.join(workdir, 'settings.json'), 'w') as file:
+        json.dump(settings, file, indent=4)
+    return settings
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def git_revision():
+    try:
+        return subprocess.check_output(['git', '-C', ROOT, 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Acquisition benchmark against the Modbus simulator")
+    parser.add_argument('--settings', default=os.path.join(ROOT, 'settings.json'), help="settings file to start from")
+    parser.add_argument('--duration', type=float, default=30, help="seconds of datacollection loop")
+    parser.add_argument('--sensor-info-runs', type=int, default=5, help="get_sensor_info runs")
+    parser.add_argument('--hwmonitor-runs', type=int, default=20, help="hwmonitor sequence runs")
+    parser.add_argument('--flush-minutes', type=float, default=0.1, help="user_data_data_step used for the raw data flushes")
+    parser.add_argument('--latency', type=float, default=0.0, help="simulator answer delay in seconds")
+    parser.add_argument('--crc-error-rate', type=float, default=0.0, help="simulator corrupted CRC probability")
+    parser.add_argument('--exception-rate', type=float, default=0.0, help="simulator exception answer probability")
+    parser.add_argument('--lock-stall', type=float, default=0.0, help="seconds the rawdata lock is held by another process during the datacollection run")
+    parser.add_argument('--output', default=None, help="JSON result file (default: stdout)")
+    args = parser.parse_args()
+
+    settings_path = os.path.abspath(args.settings)
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix='k96-bench-')
+    previous_directory = os.getcwd()
+
+    with open(settings_path, 'r') as file:
+        simulator = simulator_module.ModbusSimulator(json.load(file), args.latency, args.crc_error_rate,
+                                                     args.exception_rate, seed=1)
+    port_name = simulator.start()
+    recorder = Recorder()
+    try:
+        os.chdir(workdir)
+        settings = prepare_workdir(workdir, settings_path, port_name, args.flush_minutes)
+        logger = logging.getLogger('bench_acquisition')
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+        recorder.install()
+
+        scenarios = {}
+        scenarios['datacollection'] = bench_datacollection(settings, recorder, simulator, args.duration, logger,
+                                                          args.lock_stall)
+        scenarios['sensor_info'] = bench_runs(lambda: run_sensor_info(settings),
+                                              args.sensor_info_runs, recorder, simulator)
+        if hwmonitor is not None:
+            scenarios['hwmonitor'] = bench_runs(hwmonitor.main, args.hwmonitor_runs, recorder, simulator)
+        else:
+            scenarios['hwmonitor'] = {'skipped': 'RPi.GPIO not available'}
+
+        ll.flush_lock_stats()
+        lock_stats = {}
+        for name in sorted(os.listdir(ll.LOCK_STATS_DIR)) if os.path.isdir(ll.LOCK_STATS_DIR) else []:
+            # Skips the flush lock files and temporary copies next to the statistics
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(ll.LOCK_STATS_DIR, name), 'r') as file:
+                lock_stats[name[:-len('.json')]] = json.load(file)
+    finally:
+        recorder.uninstall()
+        simulator.stop()
+        os.chdir(previous_directory)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        'benchmark': 'acquisition',
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'simulator': {
+            'latency_s': args.latency,
+            'crc_error_rate': args.crc_error_rate,
+            'exception_rate': args.exception_rate,
+        },
+        'scenarios': scenarios,
+        'lock_stats': lock_stats,
+    }
+    text = json.dumps(results, indent=4)
+    if output:
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+#------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
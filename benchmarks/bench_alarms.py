@@ -0,0 +1,199 @@
+"""
+Alarm word benchmark: AlarmEngine (libs/alarms.py) against a per-sample loop
+over the alarm registers, on a day of simulated raw data.
+
+Samples are rows of the raw data map of settings.json (one per second by
+default). Status registers with an error_code are 0 except for bursts of random
+non-zero flags, and random registers are set to ERROR_VALUE to simulate read
+failures. Both methods must give the same sample and window alarm words.
+The engine reads the SampleBuffer of each window, which WindowAggregator
+fills in any case: its time is the alarm computation only, the time to fill
+the buffers is reported apart.
+
+Usage:
+    python3 benchmarks/bench_alarms.py [--samples 86400] [--window 900]
+        [--alarm-rate 0.001] [--failure-rate 0.0005] [--output benchmarks/results/alarms.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from array import array
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import libs.register_map as rm
+import libs.sample_buffer as sb
+from libs.alarms import AlarmEngine, READ_FAILURE_BIT
+
+# Samples an alarm burst lasts
+ALARM_BURST = 30
+
+#------------------------------------------------------------------------------
+def simulate_samples(register_map, count, alarm_rate, failure_rate, seed):
+    """
+    Raw data rows of a simulated acquisition.
+
+    Returns:
+        list: count lists of decoded values, in raw data column order.
+    """
+    generator = random.Random(seed)
+    registers = register_map.raw_registers
+    alarm_indexes = [index for index, register in enumerate(registers) if register.error_code]
+    base = [0 if register.error_code else generator.randrange(1 << (8 * register.byte_length))
+            for register in registers]
+    # Same range as the decoded values of signed registers
+    base = [value - (1 << (8 * register.byte_length)) if register.signed and value >> (8 * register.byte_length - 1) else value
+            for value, register in zip(base, registers)]
+
+    samples = []
+    bursts = {}
+    for _ in range(count):
+        values = list(base)
+        for index in alarm_indexes:
+            if index not in bursts and generator.random() < alarm_rate:
+                bursts[index] = [ALARM_BURST, generator.randrange(1, 0x100)]
+            if index in bursts:
+                values[index] = bursts[index][1]
+                bursts[index][0] -= 1
+                if bursts[index][0] == 0:
+                    del bursts[index]
+        if generator.random() < failure_rate:
+            values[generator.randrange(len(values))] = rm.ERROR_VALUE
+        samples.append(values)
+    return samples
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def loop_alarm_words(register_map, samples, window):
+    """
+    Reference: alarm word of each sample by a Python loop over the alarm registers.
+
+    Returns:
+        tuple: (list of window alarm words, list of sample alarm words).
+    """
+    masks = [(index, int(register.error_code)) for index, register in enumerate(register_map.raw_registers)
+             if register.error_code]
+    window_words = []
+    sample_words = []
+    window_word = 0
+    for position, values in enumerate(samples):
+        word = 0
+        for value in values:
+            if value == rm.ERROR_VALUE:
+                word |= 1 << READ_FAILURE_BIT
+                break
+        for index, bit in masks:
+            value = values[index]
+            if value != 0 and value != rm.ERROR_VALUE:
+                word |= 1 << bit
+        sample_words.append(word)
+        window_word |= word
+        if (position + 1) % window == 0:
+            window_words.append(window_word)
+            window_word = 0
+    if len(samples) % window:
+        window_words.append(window_word)
+    return window_words, sample_words
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def fill_buffers(register_map, samples, window):
+    """
+    One SampleBuffer per window, as WindowAggregator fills them.
+    """
+    buffers = []
+    for start in range(0, len(samples), window):
+        buffer = sb.SampleBuffer(register_map, window)
+        for values in samples[start:start + window]:
+            buffer.append(0.0, values)
+        buffers.append(buffer)
+    return buffers
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def engine_alarm_words(register_map, buffers):
+    """
+    AlarmEngine: words computed from the buffer of each window when it closes.
+
+    Returns:
+        tuple: (list of window alarm words, array of sample alarm words).
+    """
+    engine = AlarmEngine(register_map)
+    window_words = []
+    sample_words = array(engine.lane)
+    for buffer in buffers:
+        word, words = engine.evaluate(buffer)
+        window_words.append(word)
+        sample_words.extend(words)
+    return window_words, sample_words
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def timed(function, *args, repeat=3):
+    """
+    Best wall and CPU time of repeated calls.
+
+    Returns:
+        tuple: (result of the last call, best seconds, best CPU seconds).
+    """
+    best, best_cpu, result = None, None, None
+    for _ in range(repeat):
+        start, start_cpu = time.perf_counter(), time.process_time()
+        result = function(*args)
+        elapsed, cpu = time.perf_counter() - start, time.process_time() - start_cpu
+        best = elapsed if best is None else min(best, elapsed)
+        best_cpu = cpu if best_cpu is None else min(best_cpu, cpu)
+    return result, best, best_cpu
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Alarm word benchmark on simulated raw data")
+    parser.add_argument('--settings', default=os.path.join(ROOT, 'settings.json'), help="settings file of the register map")
+    parser.add_argument('--samples', type=int, default=86400, help="simulated samples (a day at 1 Hz)")
+    parser.add_argument('--window', type=int, default=900, help="samples per user_data window")
+    parser.add_argument('--alarm-rate', type=float, default=0.001, help="probability of an alarm burst start per sample and register")
+    parser.add_argument('--failure-rate', type=float, default=0.0005, help="probability of a read failure per sample")
+    parser.add_argument('--seed', type=int, default=1, help="random seed")
+    parser.add_argument('--output', default=None, help="JSON result file (default: stdout)")
+    args = parser.parse_args()
+
+    with open(args.settings, 'r') as file:
+        settings = json.load(file)
+    register_map = rm.RegisterMap(settings)
+    samples = simulate_samples(register_map, args.samples, args.alarm_rate, args.failure_rate, args.seed)
+
+    (loop_windows, loop_words), loop_time, loop_cpu = timed(loop_alarm_words, register_map, samples, args.window)
+    # The samples are stored in the window buffers by the aggregator whether alarms are computed or not
+    buffers, fill_time, _ = timed(fill_buffers, register_map, samples, args.window, repeat=1)
+    (engine_windows, engine_words), engine_time, engine_cpu = timed(engine_alarm_words, register_map, buffers)
+
+    result = {
+        'samples': args.samples,
+        'window': args.window,
+        'alarm_registers': len(AlarmEngine(register_map).masks),
+        'alarm_samples': len(loop_words) - loop_words.count(0),
+        'alarm_windows': sum(1 for word in loop_windows if word),
+        'identical': loop_windows == engine_windows and list(loop_words) == list(engine_words),
+        'loop': {'seconds': loop_time, 'cpu_seconds': loop_cpu, 'us_per_sample': loop_time / args.samples * 1e6},
+        'engine': {'seconds': engine_time, 'cpu_seconds': engine_cpu, 'us_per_sample': engine_time / args.samples * 1e6},
+        'speedup': loop_time / engine_time if engine_time else None,
+        'buffer_fill_us_per_sample': fill_time / args.samples * 1e6,
+    }
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    print(output)
+    if not result['identical']:
+        sys.exit(1)
+#------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Datapush benchmark: push cycles against the SFTP stand-in server
+(tools/K96Rpi_sftp_simulator.py), run in a subprocess behind a delay line
+with the latency and bandwidth of a cellular link.
+
+A scratch directory holds user_data files of past days and a growing file of
+today; between two cycles one user data window row is appended. Scenarios:
+
+- reconnect: a new session (TCP, SSH handshake, key exchange, authentication)
+  for every cycle, writes acknowledged one by one;
+- persistent: the session is kept between cycles, writes acknowledged one by one;
+- pipelined: the session is kept and writes are pipelined (datapush default);
+- gzip, lzma: pipelined, with the files compressed while they are uploaded.
+
+Each scenario starts with an empty server and manifest: the first cycle sends
+every file (cold), the next ones only the appended row. Reported per scenario:
+cold push time, p50/max cycle time and CPU time of a cycle on the client, and
+the bytes stored on the server by the cold push and by the other cycles. The
+server copies must decompress to the local files.
+
+Usage:
+    python3 benchmarks/bench_datapush.py [--cycles 20] [--latency 0.02] [--bandwidth 250000] [--files 30]
+        [--file-size 200000] [--seed 1] [--output benchmarks/results/datapush.json]
+"""
+import os
+import sys
+import gzip
+import lzma
+import json
+import time
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import libs.upload_manifest as um
+import datapush_service.K96Rpi_datapush as datapush
+
+# One user data window row, formatted with the time and the measurements
+WINDOW_ROW = "{:%Y-%m-%d %H:%M:%S},K96Rpi-benchmark,{:.1f},{:.1f},{:.1f},{:.1f},-999.99,0\r\n"
+
+# Time of the first row of the dataset
+START_TIME = datetime.datetime(2024, 9, 1)
+
+# Decompression of the server copies of each scenario
+DECOMPRESS = {'none': lambda data: data, 'gzip': gzip.decompress, 'lzma': lzma.decompress}
+
+#------------------------------------------------------------------------------
+def start_server(workdir, settings_path, latency, bandwidth, port=0):
+    """
+    SFTP simulator subprocess, on a free port when port is 0.
+
+    Returns:
+        tuple: (subprocess.Popen, port).
+    """
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'tools', 'K96Rpi_sftp_simulator.py'),
+                                '--root', os.path.join(workdir, 'server'), '--port', str(port),
+                                '--latency', str(latency), '--bandwidth', str(bandwidth),
+                                '--settings', settings_path],
+                               stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    port = int(line.split('127.0.0.1:')[1].split(',')[0])
+    return process, port
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def window_row(generator, row_time):
+    """
+    A user data row with slowly drifting measurements.
+    """
+    return WINDOW_ROW.format(row_time, 412.5 + generator.gauss(0, 3), abs(generator.gauss(0, 0.5)),
+                             1013.2 + generator.gauss(0, 0.4), 21.4 + generator.gauss(0, 0.2)).encode()
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def make_dataset(directory, files, file_size, generator):
+    """
+    user_data files of past days, the last one is the file of today.
+
+    Returns:
+        tuple: (paths, time of the next row).
+    """
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    row_time = START_TIME
+    paths = []
+    for index in range(files):
+        path = os.path.join(directory, f"NPC_K96Rpi-benchmark_BOX0_15_{row_time:%Y%m%d}000000_{index}.csv")
+        rows = []
+        size = 0
+        while size < file_size:
+            rows.append(window_row(generator, row_time))
+            size += len(rows[-1])
+            row_time += datetime.timedelta(minutes=1)
+        with open(path, 'wb') as file:
+            file.write(b''.join(rows))
+        paths.append(path)
+    return paths, row_time
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def server_bytes(directory):
+    return sum(os.path.getsize(os.path.join(path, name)) for path, _, names in os.walk(directory) for name in names)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def run_scenario(settings, workdir, args, persistent, pipelined, compression):
+    server_directory = os.path.join(workdir, 'server')
+    shutil.rmtree(server_directory, ignore_errors=True)
+    generator = random.Random(args.seed)
+    paths, row_time = make_dataset(os.path.join(workdir, 'data', 'user_data'), args.files, args.file_size, generator)
+    settings['server']['compression'] = compression
+    manifest_path = os.path.join(workdir, 'data', 'manifest.json')
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    manifest = um.UploadManifest(manifest_path)
+    datapush.PIPELINED_WRITES = pipelined
+
+    session = None
+    cycles = []
+    cpu_times = []
+    cold_bytes = 0
+    for cycle in range(args.cycles + 1):
+        if cycle:
+            with open(paths[-1], 'ab') as file:
+                file.write(window_row(generator, row_time))
+            row_time += datetime.timedelta(minutes=1)
+        start, start_cpu = time.perf_counter(), time.process_time()
+        session = datapush.open_session(settings, session)
+        ok = datapush.push_data(settings, manifest, session)
+        if not persistent:
+            session.close()
+            session = None
+        elapsed, cpu = time.perf_counter() - start, time.process_time() - start_cpu
+        if not ok:
+            raise RuntimeError("push failed, see logs")
+        cycles.append(elapsed)
+        cpu_times.append(cpu)
+        if not cycle:
+            cold_bytes = server_bytes(server_directory)
+    if session is not None:
+        session.close()
+
+    identical = True
+    suffix = '' if compression == 'none' else datapush.sc.COMPRESSIONS[compression]
+    for path in paths:
+        with open(path, 'rb') as file:
+            local = file.read()
+        with open(os.path.join(server_directory, 'bench', 'user_data', os.path.basename(path) + suffix), 'rb') as file:
+            identical = identical and DECOMPRESS[compression](file.read()) == local
+    local_bytes = sum(os.path.getsize(path) for path in paths)
+    total_bytes = server_bytes(server_directory)
+
+    warm = sorted(cycles[1:])
+    warm_cpu = sorted(cpu_times[1:])
+    return {
+        'cold_push_s': cycles[0],
+        'cycle_p50_ms': warm[len(warm) // 2] * 1000,
+        'cycle_max_ms': warm[-1] * 1000,
+        'cycle_cpu_p50_ms': warm_cpu[len(warm_cpu) // 2] * 1000,
+        'local_bytes': local_bytes,
+        'cold_bytes_sent': cold_bytes,
+        'cycle_bytes_sent': (total_bytes - cold_bytes) / max(args.cycles, 1),
+        'ratio': local_bytes / total_bytes,
+        'identical': identical,
+    }
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Datapush session benchmark against the SFTP simulator")
+    parser.add_argument('--cycles', type=int, default=20, help="push cycles after the cold push")
+    parser.add_argument('--latency', type=float, default=0.02, help="delay in seconds added in each direction")
+    parser.add_argument('--bandwidth', type=float, default=250000, help="bytes per second in each direction")
+    parser.add_argument('--files', type=int, default=30, help="user_data files")
+    parser.add_argument('--file-size', type=int, default=200000, help="bytes of a user_data file")
+    parser.add_argument('--seed', type=int, default=1, help="random seed of the measurements")
+    parser.add_argument('--output', default=None, help="JSON result file (default: stdout)")
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, 'settings.json'), 'r') as file:
+        settings = json.load(file)
+
+    workdir = tempfile.mkdtemp(prefix="k96-datapush-")
+    previous_directory = os.getcwd()
+    process = None
+    try:
+        settings_path = os.path.join(workdir, 'settings.json')
+        with open(settings_path, 'w') as file:
+            json.dump(settings, file)
+        process, port = start_server(workdir, settings_path, args.latency, args.bandwidth)
+        settings['server'].update({'host': '127.0.0.1', 'port': port, 'upload_all_data': 0,
+                                   'remote_directories': {'remote_user_data': '/bench'}})
+        settings['local_directories'] = {'user_data': 'data/user_data/'}
+        os.chdir(workdir)
+
+        result = {'cycles': args.cycles, 'latency_s': args.latency, 'bandwidth': args.bandwidth, 'files': args.files, 'file_size': args.file_size}
+        scenarios = (('reconnect', False, False, 'none'), ('persistent', True, False, 'none'),
+                     ('pipelined', True, True, 'none'), ('gzip', True, True, 'gzip'), ('lzma', True, True, 'lzma'))
+        for name, persistent, pipelined, compression in scenarios:
+            result[name] = run_scenario(settings, workdir, args, persistent, pipelined, compression)
+        result['identical'] = all(result[scenario[0]]['identical'] for scenario in scenarios)
+        result['cycle_speedup'] = result['reconnect']['cycle_p50_ms'] / result['pipelined']['cycle_p50_ms']
+        result['cycle_cpu_ratio'] = result['reconnect']['cycle_cpu_p50_ms'] / max(result['pipelined']['cycle_cpu_p50_ms'], 1e-6)
+        result['cold_speedup'] = result['persistent']['cold_push_s'] / result['pipelined']['cold_push_s']
+        result['gzip_cold_speedup'] = result['pipelined']['cold_push_s'] / result['gzip']['cold_push_s']
+    finally:
+        os.chdir(previous_directory)
+        if process is not None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir)
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    print(output)
+    if not result['identical']:
+        sys.exit(1)
+#------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
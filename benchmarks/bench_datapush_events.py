@@ -0,0 +1,247 @@
+"""
+Datapush scheduling benchmark: event-driven pushes against the 1 s polling loop.
+
+User data windows are closed at a fixed period by appending their row to a
+user_data file with DataFileWriter, as the datacollection writer thread
+does. The rows are pushed to the SFTP simulator (tools/K96Rpi_sftp_simulator.py)
+by one of:
+
+- polling: the former datapush loop, waking every second and pushing every
+  data_push_step (with the persistent session);
+- events: datapush main() itself, woken by inotify on the user_data directory.
+
+Reported per mode: the delay between a window row reaching its file and its
+arrival on the server, and the voluntary context switches (wakeups) and CPU
+time of the process per minute, without the threads of the benchmark (row
+writer, observer of the server directory), while windows are closed and
+during an idle time without windows after the session_idle delay.
+Windows are minutes apart on the device; session_idle is scaled down with
+the window period of the benchmark.
+
+Usage:
+    python3 benchmarks/bench_datapush_events.py [--window 20] [--windows 6] [--push-step 1] [--session-idle 5] [--idle 30]
+        [--output benchmarks/results/datapush_events.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import datetime
+import resource
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+
+import libs.data_writer as dw
+import libs.file_events as fe
+import libs.upload_manifest as um
+import datapush_service.K96Rpi_datapush as datapush
+import bench_datapush
+
+#------------------------------------------------------------------------------
+def polling_loop(settings, stop):
+    """
+    The datapush loop before file events: a wakeup every second, a push every data_push_step.
+    """
+    manifest = um.UploadManifest(um.MANIFEST_PATH)
+    session = None
+    start_time = time.monotonic()
+    while not stop.is_set():
+        current_time = time.monotonic()
+        if current_time - start_time >= settings['server']['data_push_step'] * 60:
+            session = datapush.open_session(settings, session)
+            datapush.push_data(settings, manifest, session)
+            start_time = current_time
+        time.sleep(1)
+    if session is not None:
+        session.close()
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def thread_wakeups(native_id):
+    """
+    Voluntary context switches of a thread of this process.
+    """
+    with open(f"/proc/self/task/{native_id}/status", 'r') as file:
+        for line in file:
+            if line.startswith('voluntary_ctxt_switches:'):
+                return int(line.split()[1])
+    return 0
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class ArrivalObserver(threading.Thread):
+    """
+    Times at which the server copy of a file reached given sizes.
+    """
+
+    def __init__(self, server_directory, remote_path):
+        super().__init__(daemon=True)
+        self.watcher = fe.DirectoryWatcher([server_directory])
+        self.remote_path = remote_path
+        self.expected = []
+        self.arrivals = []
+        self.lock = threading.Lock()
+        self.stop = False
+
+    def expect(self, size):
+        with self.lock:
+            self.expected.append((size, time.monotonic()))
+
+    def run(self):
+        while not self.stop:
+            self.watcher.wait(1.0)
+            try:
+                size = os.path.getsize(self.remote_path)
+            except OSError:
+                continue
+            now = time.monotonic()
+            with self.lock:
+                while self.expected and self.expected[0][0] <= size:
+                    self.arrivals.append(now - self.expected.pop(0)[1])
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def measure(benchmark_threads):
+    """
+    Wakeups of the process without the benchmark threads, CPU seconds and time.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return (usage.ru_nvcsw - sum(thread_wakeups(native_id) for native_id in benchmark_threads),
+            usage.ru_utime + usage.ru_stime, time.monotonic())
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def rates(start, end):
+    """
+    Wakeups and CPU seconds per minute between two measures.
+    """
+    minutes = (end[2] - start[2]) / 60
+    return (end[0] - start[0]) / minutes, (end[1] - start[1]) / minutes
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def run_mode(mode, settings, workdir, args):
+    server_directory = os.path.join(workdir, 'server')
+    shutil.rmtree(server_directory, ignore_errors=True)
+    os.makedirs(server_directory)
+    for path in (um.MANIFEST_PATH,):
+        if os.path.exists(path):
+            os.remove(path)
+    generator = random.Random(args.seed)
+    paths, row_time = bench_datapush.make_dataset(os.path.join(workdir, 'data', 'user_data'), 1, 2000, generator)
+    local_path = os.path.relpath(paths[0], workdir)
+    observer = ArrivalObserver(server_directory, os.path.join(server_directory, 'bench', 'user_data',
+                                                              os.path.basename(paths[0])))
+    observer.start()
+    writer = dw.DataFileWriter("userdata", "benchmark")
+    # As datacollection sets it: a window row is written when the window closes
+    writer.buffer_bytes = 0
+
+    stop = threading.Event()
+    if mode == 'polling':
+        thread = threading.Thread(target=polling_loop, args=(settings, stop), daemon=True)
+    else:
+        with open('settings.json', 'w') as file:
+            json.dump(settings, file)
+        thread = threading.Thread(target=datapush.main, daemon=True)
+
+    benchmark_threads = (threading.get_native_id(), observer.native_id)
+    start = measure(benchmark_threads)
+    thread.start()
+    for _ in range(args.windows):
+        time.sleep(args.window)
+        writer.write_rows(local_path, [bench_datapush.window_row(generator, row_time).decode().rstrip('\r\n').split(',')])
+        row_time += datetime.timedelta(minutes=15)
+        observer.expect(os.path.getsize(local_path))
+    # Last row: wait for it as long as a push step
+    deadline = time.monotonic() + settings['server']['data_push_step'] * 60 + 10
+    while observer.expected and time.monotonic() < deadline:
+        time.sleep(0.5)
+    end = measure(benchmark_threads)
+    time.sleep(args.session_idle + 1)
+    idle_start = measure(benchmark_threads)
+    time.sleep(args.idle)
+    idle_end = measure(benchmark_threads)
+    stop.set()
+    if mode == 'polling':
+        thread.join()
+    observer.stop = True
+    observer.join()
+    writer.close()
+
+    arrivals = sorted(observer.arrivals)
+    wakeups, cpu = rates(start, end)
+    idle_wakeups, idle_cpu = rates(idle_start, idle_end)
+    return {
+        'windows': args.windows,
+        'delivered': len(arrivals),
+        'delay_p50_s': arrivals[len(arrivals) // 2] if arrivals else None,
+        'delay_max_s': arrivals[-1] if arrivals else None,
+        'wakeups_per_min': wakeups,
+        'cpu_s_per_min': cpu,
+        'idle_wakeups_per_min': idle_wakeups,
+        'idle_cpu_s_per_min': idle_cpu,
+    }
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Datapush event-driven scheduling benchmark")
+    parser.add_argument('--window', type=float, default=20.0, help="seconds between two window rows")
+    parser.add_argument('--windows', type=int, default=6, help="window rows written per mode")
+    parser.add_argument('--push-step', type=float, default=1.0, help="data_push_step in minutes")
+    parser.add_argument('--session-idle', type=float, default=5.0, help="session_idle in seconds")
+    parser.add_argument('--idle', type=float, default=30.0, help="seconds of the idle measure")
+    parser.add_argument('--seed', type=int, default=1, help="random seed of the measurements")
+    parser.add_argument('--output', default=None, help="JSON result file (default: stdout)")
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, 'settings.json'), 'r') as file:
+        settings = json.load(file)
+
+    workdir = tempfile.mkdtemp(prefix="k96-events-")
+    previous_directory = os.getcwd()
+    process = None
+    try:
+        settings_path = os.path.join(workdir, 'settings.json')
+        with open(settings_path, 'w') as file:
+            json.dump(settings, file)
+        process, port = bench_datapush.start_server(workdir, settings_path, 0.02, 0)
+        settings['server'].update({'host': '127.0.0.1', 'port': port, 'upload_all_data': 0, 'compression': 'none',
+                                   'data_push_step': args.push_step, 'session_idle': args.session_idle,
+                                   'remote_directories': {'remote_user_data': '/bench'}})
+        settings['local_directories'] = {'user_data': 'data/user_data/'}
+        os.chdir(workdir)
+        os.makedirs('locks', exist_ok=True)
+
+        result = {'window_s': args.window, 'push_step_min': args.push_step, 'session_idle_s': args.session_idle}
+        # datapush main() never returns: the event mode runs last
+        for mode in ('polling', 'events'):
+            result[mode] = run_mode(mode, settings, workdir, args)
+        result['delivered'] = all(result[mode]['delivered'] == args.windows for mode in ('polling', 'events'))
+    finally:
+        os.chdir(previous_directory)
+        if process is not None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    print(output)
+    if not result['delivered']:
+        sys.exit(1)
+#------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
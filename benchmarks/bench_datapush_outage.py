@@ -0,0 +1,158 @@
+"""
+Datapush outage benchmark: a server lost in the middle of an upload, then back.
+
+A growing user_data file is pushed to the SFTP simulator
+(tools/K96Rpi_sftp_simulator.py) behind a slow link; the simulator is killed
+while the file is being sent and started again on the same port. The push is
+then retried, once with checkpoints (datapush default: every checkpoint_bytes
+confirmed and saved in the manifest) and once without (one confirmation per
+file, as before). Reported per mode: the offset the manifest held when the
+link was lost, the bytes sent again by the retry, the time of the retry and
+its upload rate, which must stay under max_upload_rate.
+
+The retry schedule of an outage of one hour is also counted: one attempt per
+second before, jittered exponential backoff now.
+
+Usage:
+    python3 benchmarks/bench_datapush_outage.py [--file-size 4000000] [--outage-after 6]
+        [--bandwidth 250000] [--max-upload-rate 131072] [--output benchmarks/results/datapush_outage.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+
+import libs.upload_manifest as um
+import libs.upload_pacing as up
+import datapush_service.K96Rpi_datapush as datapush
+import bench_datapush
+
+# Seconds of the outage whose retries are counted
+OUTAGE_SECONDS = 3600
+
+#------------------------------------------------------------------------------
+def retry_attempts(backoff, seconds):
+    """
+    Push attempts made by a backoff during an outage of seconds.
+    """
+    elapsed = 0.0
+    attempts = 0
+    while elapsed < seconds:
+        attempts += 1
+        elapsed += backoff.next_delay()
+    return attempts
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def run_mode(settings, workdir, args, checkpoint_bytes):
+    server_directory = os.path.join(workdir, 'server')
+    shutil.rmtree(server_directory, ignore_errors=True)
+    generator = random.Random(args.seed)
+    paths, _ = bench_datapush.make_dataset(os.path.join(workdir, 'data', 'user_data'), 1, args.file_size, generator)
+    manifest_path = os.path.join(workdir, 'data', 'manifest.json')
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    settings['server']['checkpoint_bytes'] = checkpoint_bytes
+    settings_path = os.path.join(workdir, 'settings.json')
+
+    process, port = bench_datapush.start_server(workdir, settings_path, args.latency, args.bandwidth)
+    settings['server']['port'] = port
+    manifest = um.UploadManifest(manifest_path)
+    session = datapush.open_session(settings, None)
+    push = threading.Thread(target=datapush.push_data, args=(settings, manifest, session))
+    push.start()
+    time.sleep(args.outage_after)
+    process.kill()
+    process.wait()
+    push.join()
+    session.close()
+    # Manifest keys are relative to the working directory, like the local directories of the settings
+    confirmed = um.UploadManifest(manifest_path).remote_offset(os.path.relpath(paths[0], workdir))
+
+    process, _ = bench_datapush.start_server(workdir, settings_path, args.latency, args.bandwidth, port)
+    try:
+        manifest = um.UploadManifest(manifest_path)
+        limiter = up.RateLimiter(args.max_upload_rate)
+        session = datapush.open_session(settings, None)
+        start = time.perf_counter()
+        ok = datapush.push_data(settings, manifest, session, limiter)
+        elapsed = time.perf_counter() - start
+        session.close()
+    finally:
+        process.terminate()
+        process.wait()
+
+    size = os.path.getsize(paths[0])
+    with open(paths[0], 'rb') as file, \
+            open(os.path.join(server_directory, 'bench', 'user_data', os.path.basename(paths[0])), 'rb') as remote:
+        identical = ok and file.read() == remote.read()
+    return {
+        'checkpoint_bytes': checkpoint_bytes,
+        'confirmed_at_outage': confirmed,
+        'resent_bytes': size - confirmed,
+        'retry_s': elapsed,
+        'retry_rate': (size - confirmed) / elapsed,
+        'identical': identical,
+    }
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Datapush outage and resume benchmark against the SFTP simulator")
+    parser.add_argument('--file-size', type=int, default=4000000, help="bytes of the user_data file")
+    parser.add_argument('--outage-after', type=float, default=6.0, help="seconds of upload before the server is killed")
+    parser.add_argument('--latency', type=float, default=0.02, help="delay in seconds added in each direction")
+    parser.add_argument('--bandwidth', type=float, default=250000, help="bytes per second in each direction")
+    parser.add_argument('--max-upload-rate', type=float, default=up.DEFAULT_MAX_UPLOAD_RATE, help="rate limit of the retry")
+    parser.add_argument('--seed', type=int, default=1, help="random seed of the measurements")
+    parser.add_argument('--output', default=None, help="JSON result file (default: stdout)")
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, 'settings.json'), 'r') as file:
+        settings = json.load(file)
+
+    workdir = tempfile.mkdtemp(prefix="k96-outage-")
+    previous_directory = os.getcwd()
+    try:
+        with open(os.path.join(workdir, 'settings.json'), 'w') as file:
+            json.dump(settings, file)
+        settings['server'].update({'host': '127.0.0.1', 'upload_all_data': 0, 'compression': 'none',
+                                   'remote_directories': {'remote_user_data': '/bench'}})
+        settings['local_directories'] = {'user_data': 'data/user_data/'}
+        os.chdir(workdir)
+
+        result = {'file_size': args.file_size, 'outage_after_s': args.outage_after, 'latency_s': args.latency,
+                  'bandwidth': args.bandwidth, 'max_upload_rate': args.max_upload_rate}
+        result['checkpoints'] = run_mode(settings, workdir, args, datapush.DEFAULT_CHECKPOINT_BYTES)
+        result['whole_file'] = run_mode(settings, workdir, args, 0)
+        result['identical'] = result['checkpoints']['identical'] and result['whole_file']['identical']
+        random.seed(args.seed)
+        result['attempts_per_hour_of_outage'] = {
+            'polling': OUTAGE_SECONDS,
+            'backoff': retry_attempts(up.Backoff(), OUTAGE_SECONDS),
+        }
+    finally:
+        os.chdir(previous_directory)
+        shutil.rmtree(workdir)
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    print(output)
+    if not result['identical']:
+        sys.exit(1)
+#------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
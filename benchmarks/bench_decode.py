@@ -0,0 +1,92 @@
+"""
+Micro-benchmark of raw data sample decoding.
+
+Compares the per-register decoding used before block reads (one response frame
+per register, hex strings built byte by byte) with the struct-based decode plan
+of libs/register_map.py, on random register contents.
+
+Usage:
+    python3 benchmarks/bench_decode.py [--samples N]
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import libs.sensor_data_exchange as sde
+import libs.register_map as rm
+
+#------------------------------------------------------------------------------
+def make_frame(slave, function, data):
+    frame = bytes([slave, function, len(data)]) + data
+    return frame + bytes(sde.calculate_crc(frame))
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def legacy_decode(frames, registers):
+    """
+    Decode one sample the way read_raw_data did with one request per register.
+    """
+    data_dict = {}
+    for (name, keep_in, data_type), raw_response in zip(registers, frames):
+        trunc_response = raw_response[3:-2]
+        if not trunc_response:
+            data_dict[name] = '-999.99'
+        elif keep_in == "hex":
+            hex_response = ''.join(format(byte, "02X") for byte in trunc_response)
+            data_dict[name] = f"0x{hex_response}"
+        elif data_type == "unsigned":
+            data_dict[name] = int.from_bytes(trunc_response, byteorder='big', signed=False)
+        else:
+            data_dict[name] = int.from_bytes(trunc_response, byteorder='big', signed=True)
+    return data_dict
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Raw data decode micro-benchmark")
+    parser.add_argument('--samples', type=int, default=20000, help="samples decoded per run")
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, 'settings.json'), 'r') as file:
+        settings = json.load(file)
+    register_map = rm.RegisterMap(settings)
+    decoder = register_map.sample_decoder
+
+    random.seed(1)
+    payloads = [bytes(random.getrandbits(8) for _ in range(block.length * (2 if block.request[1] in (3, 4) else 1)))
+                for block in register_map.raw_blocks]
+
+    # Per-register frames carrying the same bytes as the block responses
+    legacy_registers = []
+    legacy_frames = []
+    for block, data in zip(register_map.raw_blocks, payloads):
+        for register, offset, length in block.registers:
+            legacy_registers.append((register.name, register.keep_in, register.data_type))
+            legacy_frames.append(make_frame(block.request[0], block.request[1], data[offset:offset + length]))
+
+    legacy = legacy_decode(legacy_frames, legacy_registers)
+    decoded = dict(zip((register.name for register in register_map.raw_registers),
+                       decoder.format(decoder.decode(payloads))))
+    if any(legacy[name] != decoded[name] for name in legacy):
+        print("Decoded values differ from the legacy decoder")
+        sys.exit(1)
+
+    legacy_time = timeit.timeit(lambda: legacy_decode(legacy_frames, legacy_registers), number=args.samples)
+    plan_time = timeit.timeit(lambda: decoder.format(decoder.decode(payloads)), number=args.samples)
+    raw_time = timeit.timeit(lambda: decoder.decode(payloads), number=args.samples)
+
+    print(f"Registers per sample: {len(register_map.raw_registers)}, blocks: {len(register_map.raw_blocks)}")
+    print(f"Per-register decode: {legacy_time / args.samples * 1e6:8.2f} us/sample")
+    print(f"Decode plan + format: {plan_time / args.samples * 1e6:8.2f} us/sample")
+    print(f"Decode plan only:     {raw_time / args.samples * 1e6:8.2f} us/sample")
+    print(f"Speedup: {legacy_time / plan_time:.1f}x")
+#------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
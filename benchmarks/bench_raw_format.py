@@ -0,0 +1,170 @@
+"""
+Raw data file size benchmark: CSV rows against the binary format of
+libs/raw_binary.py, on a day of simulated samples.
+
+Measurement registers drift as a random walk with noise, status registers keep
+their value except for rare changes, and random registers are set to
+ERROR_VALUE to simulate read failures. The CSV export of the binary file must
+give the same text as the CSV written by datacollection.
+
+Usage:
+    python3 benchmarks/bench_raw_format.py [--samples 86400] [--block-records 300]
+        [--output benchmarks/results/raw_format.json]
+"""
+import io
+import os
+import sys
+import csv
+import gzip
+import json
+import time
+import random
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import libs.register_map as rm
+import libs.sample_buffer as sb
+import libs.raw_binary as rb
+
+# Location string of the simulated box
+LOCATION = "K96Rpi-benchmark"
+
+# Probability of a status register change per sample
+STATUS_CHANGE_RATE = 0.0005
+
+#------------------------------------------------------------------------------
+def simulate_samples(register_map, count, failure_rate, seed, start=1726524000.0):
+    """
+    Samples of a simulated acquisition at 1 Hz.
+
+    Returns:
+        list: count (sample time, decoded values) tuples.
+    """
+    generator = random.Random(seed)
+    registers = register_map.raw_registers
+    limits = []
+    for register in registers:
+        bits = 8 * register.byte_length
+        limits.append((-(1 << (bits - 1)), (1 << (bits - 1)) - 1) if register.signed else (0, (1 << bits) - 1))
+    # Measurements start mid-range of a few hundred counts, statuses at 0
+    levels = [float(generator.randrange(100, 1000)) if register.type == "meas" else 0 for register in registers]
+
+    samples = []
+    for position in range(count):
+        values = []
+        for index, register in enumerate(registers):
+            low, high = limits[index]
+            if register.type == "meas":
+                levels[index] += generator.gauss(0, 0.5)
+                value = round(levels[index] + generator.gauss(0, 2))
+            else:
+                if generator.random() < STATUS_CHANGE_RATE:
+                    levels[index] = generator.randrange(0, min(high, 0xFF) + 1)
+                value = levels[index]
+            values.append(min(high, max(low, value)))
+        if generator.random() < failure_rate:
+            values[generator.randrange(len(values))] = rm.ERROR_VALUE
+        samples.append((start + position, values))
+    return samples
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def csv_file(register_map, samples):
+    """
+    Raw data CSV as written by fsm (header) and datacollection (rows).
+    """
+    output = io.StringIO()
+    record_format = sb.record_format(register_map)
+    csv.writer(output, quoting=csv.QUOTE_NONE).writerow(record_format.csv_header())
+    writer = csv.writer(output)
+    decoder = register_map.sample_decoder
+    for sample_time, values in samples:
+        writer.writerow(sb.raw_row(decoder, sample_time, values, LOCATION))
+    return output.getvalue().encode()
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def binary_file(register_map, samples, block_records):
+    """
+    Binary raw data file as written by BinaryFileWriter.
+    """
+    record_format = sb.record_format(register_map)
+    blocks = [record_format.header()]
+    for start in range(0, len(samples), block_records):
+        chunk = samples[start:start + block_records]
+        records = b''.join(record_format.pack(sample_time, values) for sample_time, values in chunk)
+        blocks.append(rb.encode_block(records, len(chunk), record_format.size, LOCATION))
+    return b''.join(blocks)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def export_csv(data):
+    """
+    CSV text of a binary raw data file, as tools/K96Rpi_raw_export.py writes it.
+    """
+    output = io.StringIO()
+    reader = rb.BlockReader(io.BytesIO(data))
+    rows = reader.csv_rows()
+    csv.writer(output, quoting=csv.QUOTE_NONE).writerow(next(rows))
+    csv.writer(output).writerows(rows)
+    return output.getvalue().encode()
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Raw data CSV against binary format size benchmark")
+    parser.add_argument('--settings', default=os.path.join(ROOT, 'settings.json'), help="settings file of the register map")
+    parser.add_argument('--samples', type=int, default=86400, help="simulated samples (a day at 1 Hz)")
+    parser.add_argument('--block-records', type=int, default=rb.DEFAULT_BLOCK_RECORDS, help="records per block")
+    parser.add_argument('--failure-rate', type=float, default=0.0005, help="probability of a read failure per sample")
+    parser.add_argument('--seed', type=int, default=1, help="random seed")
+    parser.add_argument('--output', default=None, help="JSON result file (default: stdout)")
+    args = parser.parse_args()
+
+    with open(args.settings, 'r') as file:
+        settings = json.load(file)
+    register_map = rm.RegisterMap(settings)
+    samples = simulate_samples(register_map, args.samples, args.failure_rate, args.seed)
+
+    csv_data, csv_time = timed(csv_file, register_map, samples)
+    binary_data, binary_time = timed(binary_file, register_map, samples, args.block_records)
+    exported, export_time = timed(export_csv, binary_data)
+    csv_gzip = len(gzip.compress(csv_data, 6))
+
+    result = {
+        'samples': args.samples,
+        'registers': len(register_map.raw_registers),
+        'block_records': args.block_records,
+        'record_bytes': sb.record_format(register_map).size,
+        'csv_bytes': len(csv_data),
+        'csv_gzip_bytes': csv_gzip,
+        'binary_bytes': len(binary_data),
+        'csv_to_binary_ratio': len(csv_data) / len(binary_data),
+        'csv_gzip_to_binary_ratio': csv_gzip / len(binary_data),
+        'identical_export': exported == csv_data,
+        'csv_us_per_sample': csv_time / args.samples * 1e6,
+        'binary_us_per_sample': binary_time / args.samples * 1e6,
+        'export_us_per_sample': export_time / args.samples * 1e6,
+    }
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    print(output)
+    if not result['identical_export']:
+        sys.exit(1)
+#------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
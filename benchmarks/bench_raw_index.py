@@ -0,0 +1,204 @@
+"""
+Time-range query benchmark: sidecar index of libs/raw_index.py against a full
+scan of the daily raw data CSV files.
+
+The first day of simulated samples (1 Hz) is written by DataFileWriter with
+its index, in a scratch directory; the other days are copies of it with the
+dates of the rows and index entries shifted, which keeps the row and index
+layout of the writer. Random ranges are then extracted by
+tools/K96Rpi_raw_query.py with the index, with the same mmap reader without
+index, and by reading every line of the candidate files. All three must give
+the same rows. The page cache is warm for all methods.
+
+Usage:
+    python3 benchmarks/bench_raw_index.py [--days 30] [--queries 20] [--hours 1]
+        [--index-every 60] [--output benchmarks/results/raw_index.json]
+"""
+import os
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'benchmarks'))
+sys.path.append(os.path.join(ROOT, 'tools'))
+
+import libs.register_map as rm
+import libs.sample_buffer as sb
+import libs.data_writer as dw
+import libs.raw_index as ri
+import bench_raw_format
+import K96Rpi_raw_query as raw_query
+
+# Name of the simulated daily files, formatted with the date
+FILE_NAME = "{:%Y%m%d}_K96Rpi-benchmark_0_raw_data.csv"
+
+#------------------------------------------------------------------------------
+def write_first_day(register_map, directory, day, index_every):
+    """
+    One day of raw data rows written by DataFileWriter, with its index.
+
+    Returns:
+        str: Path of the file.
+    """
+    start = datetime.datetime.combine(day, datetime.time()).timestamp()
+    samples = bench_raw_format.simulate_samples(register_map, 86400, 0.0005, 1, start)
+    path = os.path.join(directory, FILE_NAME.format(day))
+    # Header row as written by fsm
+    with open(path, 'w', newline='') as file:
+        csv.writer(file, quoting=csv.QUOTE_NONE).writerow(sb.record_format(register_map).csv_header())
+    writer = dw.DataFileWriter("rawdata", "benchmark")
+    writer.index_every = index_every
+    decoder = register_map.sample_decoder
+    for position in range(0, len(samples), 1000):
+        writer.write_rows(path, [sb.raw_row(decoder, sample_time, values, bench_raw_format.LOCATION)
+                                 for sample_time, values in samples[position:position + 1000]])
+    writer.close()
+    return path
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def copy_day(path, day, new_day, directory):
+    """
+    Copy of a daily file and its index with the dates shifted to new_day.
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    new_path = os.path.join(directory, FILE_NAME.format(new_day))
+    with open(new_path, 'wb') as file:
+        file.write(data.replace(f"{day:%Y-%m-%d}T".encode(), f"{new_day:%Y-%m-%d}T".encode()))
+    shift = (int(f"{new_day:%Y%m%d}") - int(f"{day:%Y%m%d}")) * 1000000
+    keys, offsets = ri.read_index(path, len(data))
+    ri.write_index(new_path, [(key + shift, offset) for key, offset in zip(keys, offsets)], truncate=True)
+    return new_path
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def scan_range(paths, start, end):
+    """
+    Reference: every line of every file compared with the range.
+    """
+    rows = []
+    for path in paths:
+        with open(path, 'rb') as file:
+            for line in file:
+                timestamp = line[:19].decode(errors='replace')
+                if start <= timestamp <= end and timestamp[:4].isdigit():
+                    rows.append(line)
+    return rows
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def mmap_range(paths, start, end, use_index):
+    rows = []
+    for path in paths:
+        rows.extend(ri.file_range(path, start, end, use_index))
+    return rows
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def summary(times):
+    times = sorted(times)
+    return {'mean_ms': sum(times) / len(times) * 1000, 'p50_ms': times[len(times) // 2] * 1000,
+            'max_ms': times[-1] * 1000}
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Raw data time-range index benchmark")
+    parser.add_argument('--settings', default=os.path.join(ROOT, 'settings.json'), help="settings file of the register map")
+    parser.add_argument('--days', type=int, default=30, help="daily files of the dataset")
+    parser.add_argument('--queries', type=int, default=20, help="random ranges extracted")
+    parser.add_argument('--hours', type=float, default=1.0, help="length of a range")
+    parser.add_argument('--index-every', type=int, default=ri.DEFAULT_INDEX_EVERY, help="rows between two index entries")
+    parser.add_argument('--seed', type=int, default=1, help="random seed")
+    parser.add_argument('--directory', default=None, help="dataset directory (default: a temporary one, removed)")
+    parser.add_argument('--output', default=None, help="JSON result file (default: stdout)")
+    args = parser.parse_args()
+
+    with open(args.settings, 'r') as file:
+        settings = json.load(file)
+    register_map = rm.RegisterMap(settings)
+
+    workdir = tempfile.mkdtemp(prefix="k96-index-")
+    directory = args.directory or os.path.join(workdir, 'raw_data')
+    os.makedirs(directory, exist_ok=True)
+    previous_directory = os.getcwd()
+    try:
+        # DataFileWriter takes its file locks in the working directory
+        os.chdir(workdir)
+        os.makedirs('locks', exist_ok=True)
+        first_day = datetime.date(2024, 9, 1)
+        path, write_time = timed(write_first_day, register_map, directory, first_day, args.index_every)
+        paths = [path] + [copy_day(path, first_day, first_day + datetime.timedelta(days=day), directory)
+                          for day in range(1, args.days)]
+
+        generator = random.Random(args.seed)
+        span = datetime.timedelta(hours=args.hours)
+        results = {'index': [], 'mmap_scan': [], 'line_scan': []}
+        identical = True
+        rows = 0
+        for _ in range(args.queries):
+            start = datetime.datetime.combine(first_day, datetime.time()) + datetime.timedelta(
+                seconds=generator.randrange(int(args.days * 86400 - span.total_seconds())))
+            start, end = start.strftime("%Y-%m-%dT%H:%M:%S"), (start + span - datetime.timedelta(seconds=1)).strftime("%Y-%m-%dT%H:%M:%S")
+            # The same file selection for all methods: the daily files of the range
+            selected = raw_query.select_files(paths, start, end)
+            indexed, indexed_time = timed(mmap_range, selected, start, end, True)
+            scanned, scan_time = timed(mmap_range, selected, start, end, False)
+            lines, line_time = timed(scan_range, selected, start, end)
+            identical = identical and indexed == scanned == lines and len(indexed) == int(span.total_seconds())
+            rows += len(indexed)
+            results['index'].append(indexed_time)
+            results['mmap_scan'].append(scan_time)
+            results['line_scan'].append(line_time)
+
+        data_bytes = sum(os.path.getsize(path) for path in paths)
+        index_bytes = sum(os.path.getsize(ri.index_path(path)) for path in paths)
+    finally:
+        os.chdir(previous_directory)
+        if args.directory is None:
+            shutil.rmtree(workdir)
+
+    result = {
+        'days': args.days,
+        'queries': args.queries,
+        'hours_per_query': args.hours,
+        'index_every': args.index_every,
+        'rows_per_query': rows / args.queries,
+        'data_bytes': data_bytes,
+        'index_bytes': index_bytes,
+        'first_day_write_s': write_time,
+        'identical': identical,
+        'index': summary(results['index']),
+        'mmap_scan': summary(results['mmap_scan']),
+        'line_scan': summary(results['line_scan']),
+        'speedup_vs_line_scan': sum(results['line_scan']) / sum(results['index']),
+    }
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    print(output)
+    if not identical:
+        sys.exit(1)
+#------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -1,168 +1,182 @@
 import sys
 import os
 import signal
-import datetime
-import copy
-import csv
 
 os.chdir("/home/pi/K96Rpi")
 sys.path.append("/home/pi/K96Rpi")
 
-import libs.sensor_data_exchange as sde
+import libs.port_client as pc
+import libs.register_map as rm
+import libs.scheduler as sl
+import libs.aggregator as agg
+import libs.sample_buffer as sb
+import libs.data_writer as dw
+import libs.sample_journal as sj
+import libs.raw_binary as rb
+import libs.raw_index as ri
 import libs.local as ll
 
+# Seconds between two raw data samples when raw_data.sample_period is not set
+DEFAULT_SAMPLE_PERIOD = 1
+
+# Minutes of a user data window when box.user_data_data_step is not set
+DEFAULT_USER_DATA_STEP = 15
+
+# Raw data file formats of raw_data.format
+RAW_FORMATS = ("csv", "binary")
+
 logger_critical = ll.setup_logger("data_collection_fault.log")
 
 #------------------------------------------------------------------------------
 def sigterm_handler(signum, frame):
     logger_critical.critical(f'DATACOLLECTION SERVICE: Sigterm recieved:\n {signum}\n {frame}')
+    # The finally of main() writes the queued rows and the unfinished binary block
+    sys.exit(0)
 
 signal.signal(signal.SIGTERM, sigterm_handler)
 #------------------------------------------------------------------------------
 
-files = [f for f in os.listdir('locks') if f.endswith('-datacollection.lock')]
-for file in files:
-    file_path = os.path.join('locks', file)
-    os.remove(file_path)
-
 #------------------------------------------------------------------------------
-def write_calc_data_to_file(settings, calcullation_buffer, logger):
+def write_calc_data_to_file(settings, data_writer, window, logger):
     """
-    Write raw data from a data buffer to a CSV file.
+    Hand the statistics of a completed window to the writer thread for the calc data CSV file.
 
     """
     calc_data_filename = settings.get('local_files').get('calc_data')
     try:
-        ll.acquire_lock("calcdata", "datacollection")
-        with open(calc_data_filename, 'a', newline='') as csvfile:
-            csv_writer = csv.writer(csvfile)
-            for data_dict in calcullation_buffer:
-                csv_writer.writerow(data_dict.values())
+        data_writer.submit("calcdata", calc_data_filename, agg.calc_data_rows(window))
     except Exception as e:
         logger.error(f"RDC: Error writing calc data to file: {str(e)}")
-    finally:
-        ll.release_lock("calcdata", "datacollection")
 #------------------------------------------------------------------------------
 
 #------------------------------------------------------------------------------
-def write_data_to_file(settings, data_buffer, logger):
+def write_user_data_to_file(settings, data_writer, window, logger):
     """
-    Write raw data from a data buffer to a CSV file.
+    Hand the row of a completed window to the writer thread for the user data CSV file.
 
+    """
+    user_data_filename = settings.get('local_files').get('user_data')
+    if window.alarm:
+        logger.warning(f"RDC: Alarm word 0x{window.alarm:02X} in {window.alarm_samples}/{window.samples} samples")
+    try:
+        data_writer.submit("userdata", user_data_filename, [agg.user_data_row(settings, window)])
+    except Exception as e:
+        logger.error(f"RDC: Error writing user data to file: {str(e)}")
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def write_data_to_file(settings, data_writer, decoder, sample_time, values, logger):
+    """
+    Hand one sample to the writer thread for the raw data file.
+
+    The CSV format gets the formatted row, the binary format the sample time,
+    location and decoded values, packed by the writer thread.
     """
     raw_data_filename = settings.get('local_files').get('raw_data')
+    location = settings.get('sensor_info').get('Location_string_of_the_Integrated_box')
     try:
-        ll.acquire_lock("rawdata", "datacollection")
-        with open(raw_data_filename, 'a', newline='') as csvfile:
-            csv_writer = csv.writer(csvfile)
-            for data_dict in data_buffer:
-                csv_writer.writerow(data_dict.values())
+        if settings.get('raw_data').get('format') == "binary":
+            row = [sample_time, location] + values
+        else:
+            row = sb.raw_row(decoder, sample_time, values, location)
+        data_writer.submit("rawdata", raw_data_filename, [row])
     except Exception as e:
         logger.error(f"RDC: Error writing raw data to file: {str(e)}")
-    finally:
-        ll.release_lock("rawdata", "datacollection")
 #------------------------------------------------------------------------------
 
 #------------------------------------------------------------------------------
-def read_raw_data(settings, comm_port, data_buffer, accumulation_complete_flag, calculation_buffer, logger):
+def read_raw_data(settings, comm_port, schedule, aggregator, sample_time, journal, data_writer, logger):
     """
     Read and process raw data from a sensor and manage data accumulation.
 
+    The sample is timestamped with sample_time, the scheduled start of its tick,
+    added to the window aggregator and to the sample journal, and handed to the
+    writer thread for the raw data file.
+
+    Returns:
+        Window or None: The window completed by this sample.
     """
-    timeframe = settings.get('box').get('user_data_data_step')
-    if timeframe is None:
-        timeframe = 900
-    else:
-        timeframe = timeframe * 60
-    
-    registers = settings.get('raw_data').get('registers')
-    arduino_registers = settings.get('raw_data').get('arduino_registers')
-    sensor_address = settings.get('box').get('sensor_address')
-    arduino_address = settings.get('box').get('arduino_address')
-    function = settings.get('box').get('modbus_functions').get('READ_RAM')
-    last_known_date = settings.get('last_known_date')
-
-    if not registers:
+    register_map = schedule.register_map
+
+    if not register_map.raw_registers:
         logger.error("RDC: No registers specified in the settings")
-        return
+        return None
 
-    data_dict = {} 
+    # Registers with a sample_period are read only when due, the others on every sample
+    values = schedule.read(settings, comm_port, sample_time)
 
-    data_dict['Timestamp'] = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-    data_dict['Location'] = settings.get('sensor_info').get('Location_string_of_the_Integrated_box')
+    window = aggregator.add(sample_time, values)
+    if window is not None:
+        journal.start_window()
 
-    for RAM_status_name, value in registers.items():
-            address = value.get('address')
-            bytes_qty = value.get('data_length_bytes')
-            keep_in = value.get('keep_in')
-            data_type = value.get('data_type')
+    journal.append(sample_time, values)
+    write_data_to_file(settings, data_writer, register_map.sample_decoder, sample_time, values, logger)
+    return window
+#------------------------------------------------------------------------------
 
-            raw_response = sde.data_exchange(settings, comm_port, sensor_address, function, address, bytes_qty)
-    
-            if raw_response is not None:
-                trunc_response = raw_response[3:-2]
-                if not trunc_response:
-                    data_dict[RAM_status_name] = '-999.99'
-                else:
-                    if keep_in == "hex":
-                        # Convert the bytes to hex string representation
-                        hex_response = ''.join(format(byte, "02X") for byte in trunc_response)
-                        data_dict[RAM_status_name] = f"0x{hex_response}"  # Store as hex string
-                    elif keep_in == "decimal":
-                        if data_type == "unsigned":
-                            data_dict[RAM_status_name] = int.from_bytes(trunc_response, byteorder='big', signed=False)
-                        else:
-                            data_dict[RAM_status_name] = int.from_bytes(trunc_response, byteorder='big', signed=True)
-            else:
-                data_dict[RAM_status_name] = '-999.99'
-
-    for arduino_status_name, ar_value in arduino_registers.items():
-            address = ar_value.get('address')
-            bytes_qty = ar_value.get('data_length_bytes')
-            keep_in = ar_value.get('keep_in')
-            data_type = ar_value.get('data_type')
-            register_type = ar_value.get('register_type')
-            if register_type == 'IR':
-                function = settings.get('box').get('modbus_functions').get('READ_MULTIPLE_IR')
-            else:
-                function = settings.get('box').get('modbus_functions').get('READ_MULTIPLE_HR')
-
-            raw_response = sde.data_exchange(settings, comm_port, arduino_address, function, address, bytes_qty)
-    
-            if raw_response is not None:
-                trunc_response = raw_response[3:-2]
-                if not trunc_response:
-                    data_dict[arduino_status_name] = '-999.99'
-                else:
-                    if keep_in == "hex":
-                        # Convert the bytes to hex string representation
-                        hex_response = ''.join(format(byte, "02X") for byte in trunc_response)
-                        data_dict[arduino_status_name] = f"0x{hex_response}"  # Store as hex string
-                    elif keep_in == "decimal":
-                        if data_type == "unsigned":
-                            data_dict[arduino_status_name] = int.from_bytes(trunc_response, byteorder='big', signed=False)
-                        else:
-                            data_dict[arduino_status_name] = int.from_bytes(trunc_response, byteorder='big', signed=True)
-            else:
-                data_dict[arduino_status_name] = '-999.99'
-
-    data_buffer.append(data_dict)
-        
-    timestamp_str = data_buffer[0]['Timestamp']
-    timestamp_obj = datetime.datetime.strptime(timestamp_str, '%Y-%m-%dT%H:%M:%S')
-    current_time = datetime.datetime.now()
-    time_difference = current_time - timestamp_obj
-    time_difference_seconds = time_difference.total_seconds()
+#------------------------------------------------------------------------------
+def last_row_timestamp(csv_filename):
+    """
+    Timestamp field of the last data row of a CSV file, None without data rows.
 
-    if len(data_buffer) > 0 and (time_difference_seconds >= timeframe or int(current_time.strftime('%Y%m%d')) != last_known_date):
-        calculation_buffer = copy.deepcopy(data_buffer)
-        accumulation_complete_flag = True
-        write_data_to_file(settings, data_buffer, logger)
-        data_buffer.clear()
-        return accumulation_complete_flag, calculation_buffer, data_buffer
-    else:
-        return 0, 0, data_buffer
-    
+    """
+    try:
+        with open(csv_filename, 'rb') as file:
+            file.seek(0, os.SEEK_END)
+            file.seek(max(0, file.tell() - 4096))
+            lines = file.read().splitlines()
+    except FileNotFoundError:
+        return None
+    for line in reversed(lines):
+        field = line.split(b',', 1)[0].decode(errors='replace')
+        # Skips the header and a row cut by a power loss
+        if len(field) == 19 and field[:4].isdigit():
+            return field
+    return None
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def replay_journal(settings, journal, aggregator, decoder, data_writer, logger):
+    """
+    Recover the samples of the journal left by the previous run.
+
+    Samples newer than the last row of the raw data file are written to it,
+    the samples of the window in progress go back into the aggregator, so the
+    window completes as if the service had not stopped.
+    Runs before the writer thread starts, the raw rows are written directly.
+
+    """
+    if not journal.recovered:
+        return
+    raw_data_filename = settings.get('local_files').get('raw_data')
+    location = settings.get('sensor_info').get('Location_string_of_the_Integrated_box')
+
+    rows = []
+    try:
+        writer = data_writer.writer("rawdata")
+        if settings.get('raw_data').get('format') == "binary":
+            last_time = writer.last_sample_time(raw_data_filename)
+            rows = [[sample_time, location] + values for _, sample_time, values in journal.recovered
+                    if last_time is None or sample_time > last_time]
+        else:
+            last_timestamp = last_row_timestamp(raw_data_filename)
+            rows = [sb.raw_row(decoder, sample_time, values, location) for _, sample_time, values in journal.recovered]
+            # Timestamps are ISO formatted, they compare as strings
+            rows = [row for row in rows if last_timestamp is None or row[0] > last_timestamp]
+        writer.write_rows(raw_data_filename, rows)
+    except Exception as e:
+        logger.error(f"RDC: Error writing journal raw data to file: {str(e)}")
+
+    restored = 0
+    for sequence, sample_time, values in journal.recovered:
+        if sequence < journal.window_start:
+            continue
+        window = aggregator.add(sample_time, values)
+        if window is not None:
+            write_user_data_to_file(settings, data_writer, window, logger)
+            write_calc_data_to_file(settings, data_writer, window, logger)
+        restored += 1
+    logger.info(f"RDC: Journal replay: {len(rows)} raw data rows written, {restored} samples of the window restored")
 #------------------------------------------------------------------------------
 
 #------------------------------------------------------------------------------
@@ -180,9 +194,10 @@ def settings_was_modified(settings_path, last_settings_mtime):
 #------------------------------------------------------------------------------
 def main():
     comm_port = None
-    data_buffer = []
-    calculation_buffer = []
-    accumulation_complete_flag = False
+    scheduler = None
+    aggregator = None
+    journal = None
+    data_writer = None
 
     try:
         settings = ll.load_settings()
@@ -196,21 +211,75 @@ def main():
                     log_file = settings.get('local_files').get('logs')
                     log_file = log_file.split('/')[-1]
                     logger = ll.setup_logger(log_file)
+                    raw_data = settings.get('raw_data')
+                    if data_writer is None:
+                        data_writer = dw.WriterThread("datacollection", logger,
+                                                      raw_data.get('writer_queue_size', dw.DEFAULT_QUEUE_SIZE))
+                    data_writer.logger = logger
+                    data_writer.configure(raw_data.get('writer_overflow', dw.DEFAULT_OVERFLOW),
+                                          raw_data.get('fsync_bytes', dw.DEFAULT_FSYNC_BYTES),
+                                          raw_data.get('fsync_interval', dw.DEFAULT_FSYNC_INTERVAL))
+                    register_map = rm.RegisterMap(settings)
+                    raw_format = raw_data.get('format', "csv")
+                    if raw_format not in RAW_FORMATS:
+                        logger.error(f"RDC: Unknown raw data format {raw_format}, using csv")
+                        raw_data['format'] = raw_format = "csv"
+                    if raw_format == "binary":
+                        data_writer.set_format("rawdata", sb.record_format(register_map),
+                                               raw_data.get('block_records', rb.DEFAULT_BLOCK_RECORDS))
+                    else:
+                        data_writer.set_format("rawdata", None)
+                    data_writer.set_index("rawdata", raw_data.get('index_every', ri.DEFAULT_INDEX_EVERY))
+                    # A window row is written as soon as the window closes, datapush sends it from the file
+                    data_writer.set_buffer("userdata", 0)
+                    schedule = rm.SamplingSchedule(register_map)
+                    timeframe = (settings.get('box').get('user_data_data_step') or DEFAULT_USER_DATA_STEP) * 60
+                    sample_period = raw_data.get('sample_period', DEFAULT_SAMPLE_PERIOD)
+                    if aggregator is None:
+                        aggregator = agg.WindowAggregator(register_map, timeframe, sample_period)
+                    else:
+                        window = aggregator.configure(register_map, timeframe, sample_period)
+                        if window is not None:
+                            write_user_data_to_file(settings, data_writer, window, logger)
+                            write_calc_data_to_file(settings, data_writer, window, logger)
+                            if journal is not None:
+                                journal.start_window()
+                    if scheduler is None or scheduler.period != sample_period:
+                        scheduler = sl.TickScheduler(sample_period)
+                    # The ring keeps the window in progress and the previous one, and in the
+                    # binary format the samples of the unfinished block, written to the file with it
+                    window_capacity = sb.window_capacity(timeframe, sample_period)
+                    journal_capacity = window_capacity * 2
+                    if raw_format == "binary":
+                        journal_capacity = max(journal_capacity,
+                                               raw_data.get('block_records', rb.DEFAULT_BLOCK_RECORDS) + window_capacity)
+                    if journal is None or journal.layout != sb.buffer_layout(register_map) or journal.capacity != journal_capacity:
+                        if journal is not None:
+                            journal.close()
+                        journal = sj.SampleJournal(sj.JOURNAL_PATH, register_map, journal_capacity)
+                    journal.sync_interval = raw_data.get('fsync_interval', dw.DEFAULT_FSYNC_INTERVAL)
+                    if not data_writer.is_alive():
+                        # First start: rows spilled and samples journaled by the previous run come first
+                        data_writer.unspill(measure_lag=False)
+                        replay_journal(settings, journal, aggregator, register_map.sample_decoder, data_writer, logger)
+                        data_writer.start()
+
+                tick = scheduler.wait()
+                if tick.missed:
+                    logger.warning(f"RDC: {tick.missed} sample(s) missed, the previous sample overran the {scheduler.period} s period")
                 
-                ll.acquire_lock("port", "datacollection")
-                comm_port = sde.open_port(settings)
+                comm_port = pc.open_port(settings, "datacollection", pc.BULK)
                 if comm_port is not None:
-                    accumulation_complete_flag, calculation_buffer, data_buffer = read_raw_data(settings, comm_port, data_buffer, accumulation_complete_flag, calculation_buffer, logger)
+                    window = read_raw_data(settings, comm_port, schedule, aggregator, tick.time, journal, data_writer, logger)
                     comm_port.close()
                     comm_port = None
-                    ll.release_lock("port", "datacollection")
-                    if accumulation_complete_flag:
-                        write_calc_data_to_file(settings, calculation_buffer, logger)
-                        accumulation_complete_flag = False
-                        calculation_buffer.clear()
+                    if window is not None:
+                        write_user_data_to_file(settings, data_writer, window, logger)
+                        write_calc_data_to_file(settings, data_writer, window, logger)
+                        logger.info(f"RDC: Sampling statistics: {scheduler.report()}")
+                        logger.info(f"RDC: Writer statistics: {data_writer.report()}")
                 else:
                     logger.critical("RDC: Port is not oppened")
-                    ll.release_lock("port", "datacollection")
         else:
             logger.critical('RDC: Settings file corrupted.')
             sys.exit(1)
@@ -218,7 +287,13 @@ def main():
     except Exception as e:
         print(e)
     finally:
-        ll.release_lock("port", "datacollection")
+        if comm_port is not None:
+            comm_port.close()
+        # Queued rows are written and fsynced before exiting
+        if data_writer is not None:
+            data_writer.close()
+        if journal is not None:
+            journal.close()
 
 if __name__ == "__main__":
     main()
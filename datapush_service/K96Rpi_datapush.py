@@ -2,7 +2,8 @@ import time
 import os
 import sys
 import signal
-import subprocess
+import posixpath
+import paramiko
 from datetime import datetime
 
 os.chdir("/home/pi/K96Rpi")
@@ -10,6 +11,32 @@ sys.path.append("/home/pi/K96Rpi")
 
 import libs.sensor_data_exchange as sde
 import libs.local as ll
+import libs.upload_manifest as um
+import libs.sftp_session as ss
+import libs.stream_compression as sc
+import libs.upload_pacing as up
+import libs.file_events as fe
+
+# Bytes read from a local file and written to the server at once
+UPLOAD_CHUNK = 32768
+
+# Bytes of a file confirmed and recorded in the manifest at once, an interrupted upload resumes from there
+DEFAULT_CHECKPOINT_BYTES = 262144
+
+# Seconds between a change of the user data files and their push, the changes of these seconds go together
+DEFAULT_PUSH_DELAY = 2
+
+# Seconds without push after which the SFTP session is closed (paramiko polls its socket 10 times a second)
+DEFAULT_SESSION_IDLE = 90
+
+# Upload chunks sent without waiting for each acknowledgement
+PIPELINED_WRITES = True
+
+# Files uploaded up to their last complete line, a growing file is never cut mid-row
+TEXT_EXTENSIONS = ('.csv', '.log', '.txt')
+
+# Values of server.compression, text files are compressed on the fly with the others
+COMPRESSION_NONE = "none"
 
 def sigterm_handler(signum, frame):
     logger.critical(f'DATAPUSH: Sigterm recieved:\n {signum}\n {frame}')
@@ -20,11 +47,6 @@ current_date = datetime.now().strftime("%Y%m%d")
 logger = ll.setup_logger(f"{current_date}-datapush.log")
 #------------------------------------------------------------------------------
 
-files = [f for f in os.listdir('locks') if f.endswith('-datapush.lock')]
-for file in files:
-    file_path = os.path.join('locks', file)
-    os.remove(file_path)
-
 #------------------------------------------------------------------------------
 def check_required_settings(settings):
     """
@@ -47,53 +69,276 @@ def check_required_settings(settings):
 #------------------------------------------------------------------------------
 
 #------------------------------------------------------------------------------
-def push_files(local_dir, remote_dir, settings):
-    try:
-        # Get SSH server details from settings
-        server_settings = settings.get('server')
-        host = server_settings.get('host')
-        port = server_settings.get('port')
-        username = server_settings.get('username')
-        password = server_settings.get('password')
-
-        if not host or not port or not username or not password:
-            logger.error("DATAPUSH: Server settings cannot be empty. Please check settings.json.")
-            return False
+def open_session(settings, session):
+    """
+    SFTP session to the server of the settings, reusing session when it matches.
 
-        logger.info(f"DATAPUSH: Pushing files from {local_dir} to {remote_dir}")
-        # Form the SCP command - IMPORTANT! sshpass required - install with "sudo apt-get install -y sshpass"
-        scp_command = [
-                        'sshpass',
-                        '-p', password,
-                        'scp',
-                        '-o',
-                        'StrictHostKeyChecking=no',
-                        '-r',
-                        local_dir,
-                        f"{username}@{host}:{remote_dir}"
-                        ]
-        
-        # Run the SCP command with subprocess
-        subprocess.run(scp_command, check=True, timeout=30)
-        
-        return True
+    Args:
+        settings (dict): A dictionary containing application settings.
+        session (SFTPSession or None): Session of the previous push.
+
+    Returns:
+        SFTPSession or None: None when the server settings are incomplete.
+    """
+    server_settings = settings.get('server')
+    host = server_settings.get('host')
+    port = server_settings.get('port')
+    username = server_settings.get('username')
+    password = server_settings.get('password')
+
+    if not host or not port or not username or not password:
+        logger.error("DATAPUSH: Server settings cannot be empty. Please check settings.json.")
+        return None
+
+    if session is not None:
+        if session.matches(settings):
+            return session
+        session.close()
+    return ss.SFTPSession.from_settings(settings)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def complete_end(local_path, start, size):
+    """
+    End of the data of a file to upload: size, or the end of its last complete
+    line for text files.
+    """
+    if not local_path.endswith(TEXT_EXTENSIONS) or size <= start:
+        return size
+    with open(local_path, 'rb') as file:
+        position = size
+        while position > start:
+            length = min(UPLOAD_CHUNK, position - start)
+            file.seek(position - length)
+            newline = file.read(length).rfind(b'\n')
+            if newline >= 0:
+                return position - length + newline + 1
+            position -= length
+    return start
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def make_remote_dirs(sftp, remote_dir, created):
+    """
+    Create a remote directory and its parents if needed, as scp -r did.
 
+    Args:
+        created (set): Remote directories known to exist, updated.
+    """
+    if not remote_dir or remote_dir in created:
+        return
+    try:
+        sftp.stat(remote_dir)
     except IOError:
-        pass
-    except subprocess.TimeoutExpired:
-        logger.error("DATAPUSH: SCP operation timed out.")
-        return False
-    except subprocess.CalledProcessError as e:
-        logger.error(f"DATAPUSH: Error occurred while pushing files: {str(e)}")
-        logger.error("DATAPUSH: Server may not be reachable or the credentials are incorrect.")
-        return False
-    except Exception as e:
-        logger.error(f"DATAPUSH: An error occurred: {str(e)}")
-        return False
+        make_remote_dirs(sftp, posixpath.dirname(remote_dir.rstrip('/')), created)
+        sftp.mkdir(remote_dir)
+    created.add(remote_dir)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def read_chunks(local_path, start, end):
+    """
+    Bytes [start, end) of a local file, UPLOAD_CHUNK bytes at a time.
+
+    Raises:
+        IOError: The file is shorter than end.
+    """
+    with open(local_path, 'rb') as local_file:
+        local_file.seek(start)
+        remaining = end - start
+        while remaining:
+            chunk = local_file.read(min(UPLOAD_CHUNK, remaining))
+            if not chunk:
+                raise IOError(f"{local_path} ended {remaining} bytes before offset {end}")
+            remaining -= len(chunk)
+            yield chunk
 #------------------------------------------------------------------------------
 
 #------------------------------------------------------------------------------
-def push_data(settings):
+def upload_chunks(sftp, chunks, remote_path, remote_start, limiter=None):
+    """
+    Write chunks of data at offset remote_start of a remote file.
+
+    The remote file is truncated when remote_start is 0. Writes are pipelined:
+    the chunks are sent without waiting for each acknowledgement, which are all
+    collected when the file is closed. The upload is confirmed by the remote
+    size.
+
+    Args:
+        sftp (paramiko.SFTPClient): Session to the server.
+        chunks (iterable): bytes to write.
+        remote_path (str): Remote file.
+        remote_start (int): Offset of the first chunk.
+        limiter (RateLimiter): Upload rate limit, None for no limit.
+
+    Returns:
+        int: Size of the remote file confirmed by the server.
+
+    Raises:
+        IOError: The remote file does not have the expected size afterwards.
+    """
+    written = 0
+    with sftp.open(remote_path, 'r+' if remote_start else 'w') as remote_file:
+        remote_file.seek(remote_start)
+        remote_file.set_pipelined(PIPELINED_WRITES)
+        for chunk in chunks:
+            if limiter is not None:
+                limiter.consume(len(chunk))
+            remote_file.write(chunk)
+            written += len(chunk)
+    remote_size = sftp.stat(remote_path).st_size
+    if remote_size != remote_start + written:
+        raise IOError(f"{remote_path} has {remote_size} bytes on the server, {remote_start + written} expected")
+    return remote_size
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def push_files(local_dir, remote_dir, settings, sftp, manifest, totals, limiter=None):
+    """
+    Upload what the server does not hold yet of the files of a local directory.
+
+    The directory is mirrored under remote_dir like scp -r did. New files are
+    sent whole, grown files only from the remote offset of the manifest, files
+    unchanged since their last upload are skipped. The data is sent in
+    segments of server.checkpoint_bytes, each confirmed by the server and
+    saved in the manifest: an upload cut by a timeout or an outage resumes
+    from its last segment instead of the start of the file.
+
+    With server.compression set to gzip or lzma, text files are compressed
+    while they are uploaded and stored on the server with the .gz or .xz
+    suffix. The tail of a grown file is compressed alone and appended to the
+    server copy as a new gzip member or xz stream, which decompress together
+    to the whole file.
+
+    Args:
+        local_dir (str): Local directory.
+        remote_dir (str): Remote directory receiving local_dir.
+        settings (dict): A dictionary containing application settings.
+        sftp (paramiko.SFTPClient): Session to the server.
+        manifest (UploadManifest): Upload state of the local files.
+        totals (dict): Counters of the push cycle, updated: 'files', 'bytes'
+            (local bytes uploaded) and 'sent' (bytes stored on the server).
+        limiter (RateLimiter): Upload rate limit, None for no limit.
+
+    Returns:
+        bool: True if every file was uploaded or already up to date.
+    """
+    remote_root = posixpath.join(remote_dir, os.path.basename(os.path.normpath(local_dir)))
+    compression = settings.get('server').get('compression', COMPRESSION_NONE)
+    compression_level = settings.get('server').get('compression_level')
+    checkpoint_bytes = settings.get('server').get('checkpoint_bytes', DEFAULT_CHECKPOINT_BYTES)
+    created = set()
+    has_errors = False
+
+    for directory, _, filenames in os.walk(local_dir):
+        for filename in sorted(filenames):
+            local_path = os.path.join(directory, filename)
+            relative_path = os.path.relpath(local_path, local_dir)
+            remote_path = posixpath.join(remote_root, *relative_path.split(os.sep))
+            compressed = compression in sc.COMPRESSIONS and filename.endswith(TEXT_EXTENSIONS)
+            if compressed:
+                remote_path += sc.COMPRESSIONS[compression]
+            try:
+                pending = manifest.pending(local_path, remote_path)
+                if pending is None:
+                    continue
+                start, size = pending
+                remote_start = manifest.remote_size(local_path) if start else 0
+                if start:
+                    try:
+                        remote_size = sftp.stat(remote_path).st_size
+                    except IOError:
+                        remote_size = None
+                    if remote_size is not None and remote_size > remote_start:
+                        # Bytes of a segment cut by an outage, never confirmed: sent again from the checkpoint
+                        logger.info(f"DATAPUSH: Resuming {remote_path} at {start} bytes, dropping "
+                                    f"{remote_size - remote_start} bytes of an interrupted upload")
+                        sftp.truncate(remote_path, remote_start)
+                    elif remote_size != remote_start:
+                        # The server copy was removed or changed: send the file again
+                        logger.warning(f"DATAPUSH: {remote_path} does not match the manifest, sending it again")
+                        start = remote_start = 0
+                end = complete_end(local_path, start, size)
+                if end <= start:
+                    continue
+                make_remote_dirs(sftp, posixpath.dirname(remote_path), created)
+                while start < end:
+                    segment_end = min(end, start + checkpoint_bytes) if checkpoint_bytes else end
+                    if compressed:
+                        with sc.CompressedStream(local_path, start, segment_end, compression, compression_level,
+                                                 UPLOAD_CHUNK) as stream:
+                            remote_end = upload_chunks(sftp, stream, remote_path, remote_start, limiter)
+                    else:
+                        remote_end = upload_chunks(sftp, read_chunks(local_path, start, segment_end), remote_path,
+                                                   remote_start, limiter)
+                    manifest.confirm(local_path, remote_path, segment_end, remote_end)
+                    manifest.save()
+                    totals['bytes'] += segment_end - start
+                    totals['sent'] += remote_end - remote_start
+                    start, remote_start = segment_end, remote_end
+                totals['files'] += 1
+            except FileNotFoundError:
+                # Deleted by fsm since the directory was listed
+                continue
+            except (IOError, OSError, EOFError, paramiko.SSHException) as e:
+                # paramiko raises EOFError when the server closes the channel
+                logger.error(f"DATAPUSH: Error occurred while pushing {local_path}: {str(e) or type(e).__name__}")
+                has_errors = True
+                if not sftp.get_channel().get_transport().is_active():
+                    logger.error("DATAPUSH: Server may not be reachable or the credentials are incorrect.")
+                    return False
+
+    return not has_errors
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def push_directories(settings):
+    """
+    Local directories pushed and the remote directory of each.
+
+    Returns:
+        list: (local directory, remote directory) tuples, every directory with
+        server.upload_all_data set to 1, only the user data otherwise.
+    """
+    local_directories = settings.get('local_directories')
+    remote_directories = settings.get('server').get('remote_directories')
+
+    if settings['server']['upload_all_data'] == 1: 
+        return list(zip(local_directories.values(), remote_directories.values()))
+    return [(local_directories.get('user_data'), remote_directories.get('remote_user_data'))]
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def watch_user_data(settings):
+    """
+    Watcher of the user data directory, None when inotify is not available.
+
+    The raw data and logs change every second and are not watched, they go
+    with the data_push_step pushes.
+    """
+    try:
+        return fe.DirectoryWatcher([settings.get('local_directories').get('user_data')])
+    except OSError as e:
+        logger.warning(f"DATAPUSH: File events not available, pushing every data_push_step: {str(e)}")
+        return None
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def log_totals(settings, totals):
+    """
+    Log what a push cycle uploaded and, with compression, the bytes it saved.
+    """
+    message = f"DATAPUSH: Pushed {totals['bytes']} bytes of {totals['files']} file(s)"
+    compression = settings.get('server').get('compression', COMPRESSION_NONE)
+    if compression != COMPRESSION_NONE:
+        ratio = totals['bytes'] / totals['sent'] if totals['sent'] else 0.0
+        message += (f", {totals['sent']} bytes sent with {compression} (ratio {ratio:.1f}, "
+                    f"{totals['bytes'] - totals['sent']} bytes saved)")
+    logger.info(message)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def push_data(settings, manifest, session, limiter=None):
     """
     Push files from local directories to remote directories based on the settings.
 
@@ -104,6 +349,9 @@ def push_data(settings):
 
     Args:
         settings (dict): A dictionary containing application settings.
+        manifest (UploadManifest): Upload state of the local files.
+        session (SFTPSession): Session to the server, kept open between pushes.
+        limiter (RateLimiter): Upload rate limit, None for no limit.
 
     Returns:
         bool: True if the file transfer operation is successful for all directories,
@@ -116,27 +364,34 @@ def push_data(settings):
         if not check_required_settings(settings):
             return False
 
-        # Get local and remote directories from settings
-        local_directories = settings.get('local_directories')
-        remote_directories = settings.get('server').get('remote_directories')
+        manifest.forget_missing()
+        directories = push_directories(settings)
 
-        if settings['server']['upload_all_data'] == 1: 
-            for local_dir, remote_dir in zip(local_directories.values(), remote_directories.values()):
-                if not push_files(local_dir, remote_dir, settings):
-                    has_errors = True
-        else:
-            user_data_local = local_directories.get('user_data')
-            user_data_local = {"user_data": user_data_local}
-            user_data_remote = remote_directories.get('remote_user_data')
-            user_data_remote = {"remote_user_data": user_data_remote}
-            for local_dir, remote_dir in zip(user_data_local.values(), user_data_remote.values()):
-                if not push_files(local_dir, remote_dir, settings):
+        totals = {'files': 0, 'bytes': 0, 'sent': 0}
+
+        # A session dropped by the server while idle is reopened and the push retried once
+        for attempt in range(2):
+            try:
+                sftp = session.client()
+            except (OSError, EOFError, paramiko.SSHException) as e:
+                logger.error(f"DATAPUSH: Cannot open an SFTP session: {str(e) or type(e).__name__}")
+                logger.error("DATAPUSH: Server may not be reachable or the credentials are incorrect.")
+                has_errors = True
+                break
+            has_errors = False
+            for local_dir, remote_dir in directories:
+                if not push_files(local_dir, remote_dir, settings, sftp, manifest, totals, limiter):
                     has_errors = True
+            if not has_errors or session.active:
+                break
+
+        if totals['files']:
+            log_totals(settings, totals)
     
     except (OSError):
         pass
-    except Exception:
-        logger.error("DATAPUSH: failed to transfer")
+    except Exception as e:
+        logger.error(f"DATAPUSH: failed to transfer: {str(e)}")
         has_errors = True
     finally:
         if has_errors:
@@ -147,6 +402,8 @@ def push_data(settings):
 
 #------------------------------------------------------------------------------
 def main():
+    session = None
+    watcher = None
     try:
         settings = ll.load_settings()
         if settings is None:
@@ -155,24 +412,89 @@ def main():
         
         host = settings.get('server').get('host')
         data_push_step = settings.get('server').get('data_push_step')
-        start_time = time.time()
+        compression = settings.get('server').get('compression', COMPRESSION_NONE)
+        if compression != COMPRESSION_NONE and compression not in sc.COMPRESSIONS:
+            logger.error(f"DATAPUSH: Unknown compression {compression}, files are sent uncompressed")
+            settings['server']['compression'] = COMPRESSION_NONE
+        manifest = um.UploadManifest(um.MANIFEST_PATH)
+        if manifest.load_error is not None:
+            logger.error(f"DATAPUSH: Upload manifest unreadable, files will be sent again: {manifest.load_error}")
+        backoff = up.Backoff(settings.get('server').get('retry_initial', up.DEFAULT_RETRY_INITIAL),
+                             settings.get('server').get('retry_max', up.DEFAULT_RETRY_MAX))
+        limiter = up.RateLimiter(settings.get('server').get('max_upload_rate', up.DEFAULT_MAX_UPLOAD_RATE))
+        # A closed user data window is pushed push_delay seconds after it reached its file
+        push_delay = settings.get('server').get('push_delay', DEFAULT_PUSH_DELAY)
+        trigger_directory = os.path.normpath(settings.get('local_directories').get('user_data'))
+        session_idle = settings.get('server').get('session_idle', DEFAULT_SESSION_IDLE)
+        watcher = watch_user_data(settings)
+        # Without changes of the pushed files, the data_push_step push can be skipped
+        skip_unchanged = watcher is not None and settings['server']['upload_all_data'] != 1
+        # Changes not pushed yet; the first push sends what is pending since the last run
+        changed = True
+        # Monotonic time: timesync may step the clock
+        next_push = time.monotonic() + data_push_step * 60
+        triggered_push = None
+        last_push = time.monotonic()
         
         while (1):
-            current_time = time.time()
-            elapsed_time = current_time - start_time
-                    
-            if elapsed_time >= (data_push_step * 60):
-                serverIsAlive = ll.check_server_response(host)
-                if serverIsAlive:
-                    if not (push_data(settings)):
-                        logger.warning("DATAPUSH: Cannot transfer files")
-                    start_time = current_time
-                else:
-                    logger.warning("DATAPUSH: Server not answering")
-            time.sleep(1)
+            current_time = time.monotonic()
+            if session is not None and session.active and current_time >= last_push + session_idle:
+                session.close()
+            due = next_push if triggered_push is None else min(next_push, triggered_push)
+
+            if current_time < due:
+                # Sleep until the next push, a file change or the end of an idle session, no periodic wakeup
+                wake = due
+                if session is not None and session.active:
+                    wake = min(wake, last_push + session_idle)
+                if watcher is None:
+                    time.sleep(wake - current_time)
+                    continue
+                for directory in watcher.wait(wake - current_time):
+                    changed = True
+                    # Pushes wait for the backoff while the server is away
+                    if directory == trigger_directory and triggered_push is None and not backoff.failures:
+                        triggered_push = time.monotonic() + push_delay
+                continue
+
+            triggered_push = None
+            if skip_unchanged and not changed:
+                # Nothing new since the last push: the data_push_step push is skipped
+                next_push = current_time + data_push_step * 60
+                continue
+
+            # Changes seen from now on are pushed next time
+            changed = False
+            serverIsAlive = ll.check_server_response(host)
+            pushed = False
+            if serverIsAlive:
+                if backoff.failures:
+                    logger.info(f"DATAPUSH: Server answering again after {backoff.failures} failed attempt(s), "
+                                "sending the backlog")
+                session = open_session(settings, session)
+                pushed = session is not None and push_data(settings, manifest, session, limiter)
+                last_push = time.monotonic()
+                if not pushed:
+                    logger.warning("DATAPUSH: Cannot transfer files")
+            else:
+                logger.warning("DATAPUSH: Server not answering")
+            if pushed:
+                backoff.reset()
+                next_push = current_time + data_push_step * 60
+            else:
+                changed = True
+                # Files left behind stay pending in the manifest and are resumed by the next attempt
+                delay = backoff.next_delay()
+                logger.info(f"DATAPUSH: Next attempt in {delay:.0f} s")
+                next_push = current_time + delay
             
     except Exception as e:
         logger.critical(f'DATAPUSH: Unknown error. {e}')
+    finally:
+        if session is not None:
+            session.close()
+        if watcher is not None:
+            watcher.close()
 #------------------------------------------------------------------------------
 
 if __name__ == "__main__":
@@ -17,24 +17,13 @@ import libs.local as ll
 current_date = datetime.now().strftime("%Y%m%d")
 logger = ll.setup_logger(f"{current_date}-fsm.log")
 
-#------------------------------------------------------------------------------
-def clean_locks():
-    files = [f for f in os.listdir('locks') if f.endswith('-fsm.lock')]
-    for file in files:
-        file_path = os.path.join('locks', file)
-        os.remove(file_path)
-#------------------------------------------------------------------------------
-
 #------------------------------------------------------------------------------
 def sigterm_handler(signum, frame):
     logger.critical(f'FSM SERVICE: Sigterm recieved:\n {signum}\n {frame}')
-    clean_locks()
 #------------------------------------------------------------------------------
 
 signal.signal(signal.SIGTERM, sigterm_handler)
 
-clean_locks()
-
 #------------------------------------------------------------------------------
 def check_disk_space(directory):
     """
@@ -349,7 +338,10 @@ def run_fsm(settings):
     settings['box']['last_user_data_file_id'] = new_user_data_file_id
     
     log_file = os.path.join(logs_dir, f"{current_date}_{loc_string}_{sensor_id}_event.log")
-    raw_data_file = os.path.join(raw_data_dir, f"{current_date}_{loc_string}_{sensor_id}_raw_data.csv")
+    # The binary raw data format gets its header from the datacollection writer
+    binary_raw_data = settings.get('raw_data').get('format') == "binary"
+    raw_data_extension = "bin" if binary_raw_data else "csv"
+    raw_data_file = os.path.join(raw_data_dir, f"{current_date}_{loc_string}_{sensor_id}_raw_data.{raw_data_extension}")
     user_data_file = os.path.join(user_data_dir, f"NPC_{loc_string}_BOX{sensor_id}_{user_data_data_step}_{current_date}{current_time}_{new_user_data_file_id}.csv")
     sensor_data_file = os.path.join(raw_data_dir, f"{current_date}_{loc_string}_{sensor_id}_sensor_data.txt")
 
@@ -371,7 +363,8 @@ def run_fsm(settings):
         if not registers or not arduino_registers:
             logger.critical("FSM: No raw data registers specified in the settings")
 
-        write_header_to_raw_data_csv(raw_data_file, registers, arduino_registers)
+        if not binary_raw_data:
+            write_header_to_raw_data_csv(raw_data_file, registers, arduino_registers)
         write_header_to_user_data_csv(settings, user_data_file, registers)
         
     except Exception as e:
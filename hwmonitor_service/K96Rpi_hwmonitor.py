@@ -8,7 +8,7 @@ from datetime import datetime
 os.chdir("/home/pi/K96Rpi")
 sys.path.append("/home/pi/K96Rpi")
 
-import libs.sensor_data_exchange as sde
+import libs.port_client as pc
 import libs.local as ll
 
 #------------------------------------------------------------------------------
@@ -18,11 +18,6 @@ def sigterm_handler(signum, frame):
 signal.signal(signal.SIGTERM, sigterm_handler)
 #------------------------------------------------------------------------------
 
-files = [f for f in os.listdir('locks') if f.endswith('-hwm.lock')]
-for file in files:
-    file_path = os.path.join('locks', file)
-    os.remove(file_path)
-
 current_date = datetime.now().strftime("%Y%m%d")
 logger = ll.setup_logger(f"{current_date}-hw_monitor.log")
 
@@ -80,13 +75,11 @@ def check_temperature(settings):
     comm_port = None
     
     # Read raw temperature data from the sensor box
-    ll.acquire_lock("port", "hwm")
-    comm_port = sde.open_port(settings)
+    comm_port = pc.open_port(settings, "hwm")
     if comm_port is not None:
-        raw_temperature = sde.data_exchange(settings, comm_port, address, function, register, 1)
+        raw_temperature = pc.data_exchange(settings, comm_port, address, function, register, 1)
         comm_port.close()
         comm_port = None
-        ll.release_lock("port", "hwm")
         # Convert raw temperature data to a meaningful temperature value
         if raw_temperature is not None:
             temp_temperature = raw_temperature[3:-2]
@@ -101,7 +94,6 @@ def check_temperature(settings):
             return 0
     else:
         logger.error("HW_MONITOR: Temperature cannot be measured, comm port not opened")
-        ll.release_lock("port", "hwm")
         return 0
 #------------------------------------------------------------------------------
 
@@ -111,16 +103,15 @@ def main():
     if settings is None:
         logger.critical('HW_MONITOR: Settings file corrupted.')
         sys.exit(1)
+    comm_port = None
     try:
-        ll.acquire_lock("port", "hwm")
-        comm_port = sde.open_port(settings)
+        comm_port = pc.open_port(settings, "hwm")
         if comm_port is not None:
-            sde.data_exchange(settings, comm_port, settings['box']['arduino_address'], settings['box']['modbus_functions']['WRITE_SINGLE_HR'], settings['pid1_setpoint_address'], 2, settings['pid1_base_value']) 
+            pc.data_exchange(settings, comm_port, settings['box']['arduino_address'], settings['box']['modbus_functions']['WRITE_SINGLE_HR'], settings['pid1_setpoint_address'], 2, settings['pid1_base_value'], priority=pc.URGENT) 
             comm_port.close()
             comm_port = None
         else:
             logger.warning("HW_MONITOR: Unable to write base value for PID setpoint. Port not opened")
-        ll.release_lock("port", "hwm")
 
         overheat = check_temperature(settings)
         if (overheat == 1):
@@ -141,13 +132,11 @@ def main():
         heater_ref_address = settings.get("heater_ref_address")
         function = settings.get('box').get('modbus_functions').get('READ_RAM')
         
-        ll.acquire_lock("port", "hwm")
-        comm_port = sde.open_port(settings)
+        comm_port = pc.open_port(settings, "hwm")
         if comm_port is not None:
-            raw_response = sde.data_exchange(settings, comm_port, sensor_address, function, heater_ref_address, 2)
+            raw_response = pc.data_exchange(settings, comm_port, sensor_address, function, heater_ref_address, 2)
             comm_port.close()
             comm_port = None
-            ll.release_lock("port", "hwm")
 
             if raw_response is not None:
                 trunc_response = raw_response[3:-2]
@@ -159,7 +148,6 @@ def main():
             else:
                 logger.info("HW_MONITOR: Sensor not answering")
         else:
-            ll.release_lock("port", "hwm")
             logger.warning("HW_MONITOR: Unable to read Heater0 values. Port not opened")
             
         #getting pid value from Arduino        
@@ -167,13 +155,11 @@ def main():
     
         function = settings.get('box').get('modbus_functions').get('READ_MULTIPLE_IR')
         
-        ll.acquire_lock("port", "hwm")
-        comm_port = sde.open_port(settings)
+        comm_port = pc.open_port(settings, "hwm")
         if comm_port is not None:
-            raw_response = sde.data_exchange(settings, comm_port, arduino_address, function, pid1_output_address, 1)
+            raw_response = pc.data_exchange(settings, comm_port, arduino_address, function, pid1_output_address, 1)
             comm_port.close()
             comm_port = None
-            ll.release_lock("port", "hwm")
         
             if raw_response is not None:
                 trunc_response = raw_response[3:-2]
@@ -185,37 +171,32 @@ def main():
             else:
                 logger.info("HW_MONITOR: Sensor not answering")
         else:
-            ll.release_lock("port", "hwm")
             logger.warning("HW_MONITOR: Unable to read PID values. Port not opened")
                     
                     
         if (pid1_value > 252):
             logger.critical("HW_MONITOR: Pump is overloaded")
-            ll.acquire_lock("port", "hwm")
-            comm_port = sde.open_port(settings)
+            comm_port = pc.open_port(settings, "hwm")
             if comm_port is not None:
-                sde.data_exchange(settings, comm_port, settings['box']['sensor_address'], settings['box']['modbus_functions']['WRITE_RAM'], settings['heater_ctl_address'], 2, "0x0")
-                sde.data_exchange(settings, comm_port, settings['box']['arduino_address'], settings['box']['modbus_functions']['WRITE_SINGLE_HR'], settings['pid1_setpoint_address'], 2, "0x0FA0")
+                pc.data_exchange(settings, comm_port, settings['box']['sensor_address'], settings['box']['modbus_functions']['WRITE_RAM'], settings['heater_ctl_address'], 2, "0x0", priority=pc.URGENT)
+                pc.data_exchange(settings, comm_port, settings['box']['arduino_address'], settings['box']['modbus_functions']['WRITE_SINGLE_HR'], settings['pid1_setpoint_address'], 2, "0x0FA0", priority=pc.URGENT)
                 comm_port.close()
             else:
                 logger.warning("HW_MONITOR: Unable turn off pump and heater. Port not opened")
-            ll.release_lock("port", "hwm")
             comm_port = None
             settings["occlusion_detected"] = True
             ll.save_settings(settings)
         
         if (pid1_value == 0):
             logger.critical("HW_MONITOR: Pump is OFF, attempt to restart")
-            ll.acquire_lock("port", "hwm")
-            comm_port = sde.open_port(settings)
+            comm_port = pc.open_port(settings, "hwm")
             if comm_port is not None:
-                sde.data_exchange(settings, comm_port, settings['box']['arduino_address'], settings['box']['modbus_functions']['WRITE_SINGLE_HR'], settings['pid1_setpoint_address'], 2, settings['pid1_base_value'])
-                sde.data_exchange(settings, comm_port, settings['box']['sensor_address'], settings['box']['modbus_functions']['WRITE_RAM'], settings['heater_ctl_address'], 2, settings['heater_base_value']) 
-                sde.data_exchange(settings, comm_port, settings['box']['sensor_address'], settings['box']['modbus_functions']['WRITE_RAM'], "0x60", 1, "0xFF")
+                pc.data_exchange(settings, comm_port, settings['box']['arduino_address'], settings['box']['modbus_functions']['WRITE_SINGLE_HR'], settings['pid1_setpoint_address'], 2, settings['pid1_base_value'], priority=pc.URGENT)
+                pc.data_exchange(settings, comm_port, settings['box']['sensor_address'], settings['box']['modbus_functions']['WRITE_RAM'], settings['heater_ctl_address'], 2, settings['heater_base_value'], priority=pc.URGENT) 
+                pc.data_exchange(settings, comm_port, settings['box']['sensor_address'], settings['box']['modbus_functions']['WRITE_RAM'], "0x60", 1, "0xFF", priority=pc.URGENT)
                 comm_port.close()
             else:
                 logger.warning("HW_MONITOR: Unable ыефке pump and heater. Port not opened")
-            ll.release_lock("port", "hwm")
             comm_port = None
             settings["occlusion_detected"] = False
             ll.save_settings(settings)
@@ -223,7 +204,8 @@ def main():
     except Exception as e:
         logger.critical(f"HW MONITOR: {e}")
     finally:
-        ll.release_lock("port", "hwm")
+        if comm_port is not None:
+            comm_port.close()
 #------------------------------------------------------------------------------
 
 if __name__ == "__main__":
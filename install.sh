@@ -30,6 +30,16 @@ sudo systemctl stop systemd-timesyncd.service
 sudo systemctl disable systemd-timesyncd.service
 sudo systemctl daemon-reload
 
+#install serial port broker service
+echo -e "\033[1;33mInstalling K96Rpi serial port broker service...\033[0m"
+sudo systemctl stop K96Rpi_portbroker.service
+sudo systemctl disable K96Rpi_portbroker.service
+sudo rm -f /etc/systemd/system/K96Rpi_portbroker.*
+sudo cp -f portbroker_service/K96Rpi_portbroker.service /etc/systemd/system/
+sudo systemctl daemon-reload
+sudo systemctl enable --now K96Rpi_portbroker.service
+echo -e "\033[1;32mK96Rpi serial port broker service installed and enabled.\033[0m"
+
 #install sensor info service
 echo -e "\033[1;33mInstalling K96Rpi sensor info service...\033[0m"
 sudo systemctl stop K96Rpi_sensor_info.timer
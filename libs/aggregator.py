@@ -0,0 +1,197 @@
+import math
+import datetime
+
+import libs.sample_buffer as sb
+from libs.register_map import ERROR_VALUE
+from libs.alarms import AlarmEngine
+
+#------------------------------------------------------------------------------
+class RunningStats:
+    """
+    Count, mean, standard deviation, min and max of a stream of values
+    (Welford's online algorithm, constant memory).
+    """
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def stddev(self):
+        # Sample standard deviation, 0 for less than two values
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class Window:
+    """
+    Statistics of one completed aggregation window.
+
+    Attributes:
+        start (float): Unix time of the window start (multiple of the timeframe).
+        names (list): Register names of the user_data columns.
+        stats (list): RunningStats of each column, values already multiplied.
+        samples (int): Samples received during the window.
+        alarm (int): Alarm word of the window, OR of the alarm words of its samples.
+        alarm_samples (int): Samples with a non-zero alarm word.
+    """
+    __slots__ = ('start', 'names', 'stats', 'samples', 'alarm', 'alarm_samples')
+
+    def __init__(self, start, names):
+        self.start = start
+        self.names = names
+        self.stats = [RunningStats() for _ in names]
+        self.samples = 0
+        self.alarm = 0
+        self.alarm_samples = 0
+
+    def means(self, digits=4):
+        """
+        Column means rounded to digits, ERROR_VALUE for columns without any valid value.
+        """
+        return [round(stats.mean, digits) if stats.count else ERROR_VALUE for stats in self.stats]
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class WindowAggregator:
+    """
+    Streaming aggregation of the user_data registers over fixed time windows.
+
+    The user_data columns are the registers of raw_data.registers with
+    "type": "meas", in settings order (the columns of the fsm user_data header).
+    Each sample updates running statistics of the values multiplied by the
+    register multiplier, and is stored in the typed columns of the active
+    buffer of a DoubleBuffer (libs/sample_buffer.py). Windows are aligned to
+    multiples of the timeframe (floor(time / timeframe)), the first sample of
+    a new window completes the previous one and swaps the buffers. The alarm
+    words of a window are computed by an AlarmEngine from its buffer.
+
+    Args:
+        register_map (RegisterMap): Compiled registers of the raw data row.
+        timeframe (float): Window length in seconds (box.user_data_data_step * 60).
+        sample_period (float): Seconds between two samples, sizes the buffers.
+    """
+
+    def __init__(self, register_map, timeframe, sample_period=1):
+        self.timeframe = timeframe
+        self.window = None
+        self.alarms = None
+        self.buffers = None
+        self.configure(register_map, timeframe, sample_period)
+
+    def configure(self, register_map, timeframe, sample_period=1):
+        """
+        Take a new register map, timeframe and sample period, e.g. after a settings reload.
+
+        The current window goes on if the columns, the alarm registers, the
+        raw data layout and the timeframe are unchanged, otherwise it is
+        completed early.
+
+        Returns:
+            Window or None: The window completed by the change.
+        """
+        registers = [(index, register) for index, register in enumerate(register_map.raw_registers)
+                     if register.name in register_map.user_data_names]
+        names = [register.name for _, register in registers]
+        self.indexes = [index for index, _ in registers]
+        self.multipliers = [register.multiplier or 1 for _, register in registers]
+
+        alarms = AlarmEngine(register_map)
+        layout = sb.buffer_layout(register_map)
+
+        completed = None
+        if self.window is not None and (names != self.window.names or timeframe != self.timeframe
+                                        or alarms.masks != self.alarms.masks or layout != self.buffers.layout):
+            completed = self.close()
+        if self.window is None:
+            # The buffers keep the samples of a window which goes on
+            self.alarms = alarms
+            if (self.buffers is None or self.buffers.layout != layout
+                    or self.buffers.capacity != sb.window_capacity(timeframe, sample_period)):
+                self.buffers = sb.DoubleBuffer(register_map, timeframe, sample_period)
+        self.names = names
+        self.timeframe = timeframe
+        return completed
+
+    def add(self, sample_time, values):
+        """
+        Add one sample.
+
+        Args:
+            sample_time (float): Unix time of the sample.
+            values (list): Decoded values of the raw data row, as SampleDecoder.decode.
+
+        Returns:
+            Window or None: The previous window if this sample starts a new one.
+        """
+        start = sample_time // self.timeframe * self.timeframe
+        completed = None
+        if self.window is not None and self.window.start != start:
+            completed = self.close()
+        if self.window is None:
+            self.window = Window(start, self.names)
+
+        window = self.window
+        window.samples += 1
+        for stats, index, multiplier in zip(window.stats, self.indexes, self.multipliers):
+            value = values[index]
+            if value != ERROR_VALUE:
+                stats.add(value * multiplier)
+        self.buffers.active.append(sample_time, values)
+        return completed
+
+    def close(self):
+        """
+        Complete the current window, compute its alarm words and swap the buffers.
+
+        Returns:
+            Window or None: The completed window.
+        """
+        window = self.window
+        self.window = None
+        if window is not None:
+            window.alarm, words = self.alarms.evaluate(self.buffers.swap())
+            window.alarm_samples = len(words) - words.count(0)
+        return window
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def user_data_row(settings, window):
+    """
+    Row of the user_data CSV for a completed window: Datetime, Location, the
+    column means and Alarme (the window alarm word, see AlarmEngine).
+    """
+    timestamp = datetime.datetime.fromtimestamp(window.start).strftime("%Y-%m-%dT%H:%M:%S")
+    location = settings.get('sensor_info').get('Location_string_of_the_Integrated_box')
+    return [timestamp, location] + window.means() + [window.alarm]
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def calc_data_rows(window):
+    """
+    Rows of the calc_data CSV for a completed window, one per column:
+    window start, register, count, mean, stddev, min, max.
+    """
+    timestamp = datetime.datetime.fromtimestamp(window.start).strftime("%Y-%m-%dT%H:%M:%S")
+    rows = []
+    for name, stats in zip(window.names, window.stats):
+        if stats.count:
+            rows.append([timestamp, name, stats.count, stats.mean, stats.stddev, stats.min, stats.max])
+        else:
+            rows.append([timestamp, name, 0, ERROR_VALUE, ERROR_VALUE, ERROR_VALUE, ERROR_VALUE])
+    return rows
+#------------------------------------------------------------------------------
@@ -0,0 +1,96 @@
+import sys
+from array import array
+
+# Bit of the alarm word set when a register of the sample could not be read
+READ_FAILURE_BIT = 0
+
+# Array type codes of the alarm word lanes, by the number of bits they hold
+LANE_TYPES = ((8, 'B'), (16, 'H'), (32, 'I'), (64, 'Q'))
+
+# bytes.translate table: 1 for a non-zero byte
+NONZERO = bytes([0]) + bytes([1]) * 255
+
+#------------------------------------------------------------------------------
+class AlarmEngine:
+    """
+    Alarm words of the user_data "Alarme" column.
+
+    Bit N of the alarm word is set when a register with "error_code": N is not
+    zero, bit 0 when a register of the sample could not be read. The mask table
+    (raw data column, bit) is built once from the register map.
+
+    The words of a window are computed from its SampleBuffer when it closes.
+    The bytes of every alarm column are turned into 0/1 flags by
+    bytes.translate, then into one big integer holding one lane per sample,
+    shifted to its bit and OR-ed with the other columns: the alarm words of
+    all samples come out of a few C level operations per column instead of a
+    Python loop per sample and field. The samples with unread registers come
+    from the validity bitmap of the buffer; unread registers are stored as 0
+    and raise no bit of their own.
+
+    Args:
+        register_map (RegisterMap): Compiled registers of the raw data row.
+    """
+
+    def __init__(self, register_map):
+        self.masks = tuple((index, int(register.error_code)) for index, register in enumerate(register_map.raw_registers)
+                           if register.error_code)
+        highest = max([bit for _, bit in self.masks] + [READ_FAILURE_BIT])
+        self.lane = next(code for size, code in LANE_TYPES if highest < size)
+        self.lane_bytes = array(self.lane).itemsize
+
+    def lanes(self, flags):
+        """
+        One integer holding flag i (0 or 1) in the lowest bit of lane i.
+        """
+        if self.lane_bytes == 1:
+            return int.from_bytes(flags, 'little')
+        data = bytearray(len(flags) * self.lane_bytes)
+        data[::self.lane_bytes] = flags
+        return int.from_bytes(data, 'little')
+
+    @staticmethod
+    def nonzero(column, count):
+        """
+        One byte per sample of the first count values of an integer column, 1 where the value is not 0.
+        """
+        size = column.itemsize
+        flags = memoryview(column).cast('B')[:count * size].tobytes().translate(NONZERO)
+        if size == 1:
+            return flags
+        # A value is not 0 when one of its bytes is not
+        merged = 0
+        for offset in range(size):
+            merged |= int.from_bytes(flags[offset::size], 'little')
+        return merged.to_bytes(count, 'little')
+
+    def evaluate(self, buffer):
+        """
+        Compute the alarm words of the samples of a window.
+
+        Args:
+            buffer (SampleBuffer): Samples of the window.
+
+        Returns:
+            tuple: (window alarm word, array of the alarm word of each sample).
+        """
+        count = len(buffer)
+        sample_words = array(self.lane)
+        if count == 0:
+            return 0, sample_words
+
+        lane_bits = self.lane_bytes * 8
+        failures = sum(1 << (sample * lane_bits) for sample in buffer.invalid_samples())
+        words = failures << READ_FAILURE_BIT
+        window_word = (1 << READ_FAILURE_BIT) if failures else 0
+        for index, bit in self.masks:
+            flags = self.lanes(self.nonzero(buffer.columns[index], count))
+            if flags:
+                words |= flags << bit
+                window_word |= 1 << bit
+
+        sample_words.frombytes(words.to_bytes(count * self.lane_bytes, 'little'))
+        if sys.byteorder == 'big':
+            sample_words.byteswap()
+        return window_word, sample_words
+#------------------------------------------------------------------------------
@@ -0,0 +1,597 @@
+import io
+import os
+import csv
+import json
+import zlib
+import time
+import queue
+import threading
+
+import libs.local as ll
+import libs.raw_binary as rb
+import libs.raw_index as ri
+
+# Bytes written since the last fsync which force a new one
+DEFAULT_FSYNC_BYTES = 65536
+
+# Seconds after which written rows are fsynced even if fsync_bytes is not reached
+DEFAULT_FSYNC_INTERVAL = 10.0
+
+# Rows are formatted in memory and written to the file once this many bytes are pending
+DEFAULT_BUFFER_BYTES = 8192
+
+# Jobs waiting for the writer thread
+DEFAULT_QUEUE_SIZE = 256
+
+# What the writer thread does with a job when its queue is full
+OVERFLOW_POLICIES = ("block", "drop_oldest", "spill")
+DEFAULT_OVERFLOW = "spill"
+
+# Journal of the jobs which did not fit in the writer queue
+SPILL_PATH = "data/writer_spill.jsonl"
+
+# Queue item asking the writer thread to write the spill journal back
+UNSPILL = "unspill"
+
+#------------------------------------------------------------------------------
+class DataFileWriter:
+    """
+    Long-lived CSV writer of a data file (raw data, calc data).
+
+    The file stays open between writes. Rows are formatted into a memory buffer
+    and written to the file as whole rows under the resource lock, so readers
+    never see half a row. Written bytes are fsynced when fsync_bytes have been
+    written or fsync_interval seconds have passed since the last fsync, which
+    bounds the data lost on a power cut. The file is reopened when its path
+    changes (fsm rotates the file names at midnight) or when it was deleted or
+    replaced behind the writer. A non-empty header is written first to an
+    empty file.
+
+    With index_every set, the timestamp and byte offset of one row every
+    index_every rows are appended to the sidecar index of the file
+    (libs/raw_index.py) once the rows are written. Rows must then start with
+    their timestamp, as raw data rows do.
+
+    Args:
+        resource (str): Lock resource of the file, e.g. "rawdata".
+        service (str): Name of the service writing the file.
+        fsync_bytes (int): Bytes written between two fsyncs.
+        fsync_interval (float): Longest time in seconds between two fsyncs.
+        buffer_bytes (int): Bytes of formatted rows kept in memory before writing.
+    """
+
+    header = b''
+
+    def __init__(self, resource, service, fsync_bytes=DEFAULT_FSYNC_BYTES,
+                 fsync_interval=DEFAULT_FSYNC_INTERVAL, buffer_bytes=DEFAULT_BUFFER_BYTES):
+        self.resource = resource
+        self.service = service
+        self.fsync_bytes = fsync_bytes
+        self.fsync_interval = fsync_interval
+        self.buffer_bytes = buffer_bytes
+        self.path = None
+        self.file = None
+        self.inode = None
+        self.buffer = io.StringIO()
+        self.csv_writer = csv.writer(self.buffer)
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.index_every = 0
+        self.index_pending = []
+        self.unindexed = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.rows = 0
+        self.bytes = 0
+        self.fsync_times = []
+        self.stats_start = time.monotonic()
+
+    def write_rows(self, path, rows):
+        """
+        Append rows to the file at path.
+
+        Args:
+            path (str): Current file name (local_files entry).
+            rows (iterable): CSV rows.
+        """
+        if path != self.path:
+            self.open(path)
+        for row in rows:
+            if self.index_every and self.unindexed == 0:
+                self.index_pending.append((ri.time_key(row[0]), self.buffer.tell()))
+            self.csv_writer.writerow(row)
+            self.rows += 1
+            if self.index_every:
+                self.unindexed = (self.unindexed + 1) % self.index_every
+        if self.pending() >= self.buffer_bytes:
+            self.flush()
+        if (self.unsynced + self.pending() >= self.fsync_bytes
+                or time.monotonic() - self.last_sync >= self.fsync_interval):
+            self.sync()
+
+    def write_row(self, path, row):
+        self.write_rows(path, (row,))
+
+    def open(self, path):
+        # Rows of the previous file are completed there before switching
+        self.close()
+        self.path = path
+        self.file = open(path, 'ab', buffering=0)
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        # The first row written to a file is always indexed
+        self.unindexed = 0
+
+    def reopen_if_replaced(self):
+        try:
+            replaced = os.stat(self.path).st_ino != self.inode
+        except FileNotFoundError:
+            replaced = True
+        if replaced:
+            self.file.close()
+            self.file = open(self.path, 'ab', buffering=0)
+            self.inode = os.fstat(self.file.fileno()).st_ino
+
+    def pending(self):
+        """
+        Bytes buffered and not written to the file yet.
+        """
+        return self.buffer.tell()
+
+    def take(self):
+        """
+        Buffered bytes to write, the buffer is emptied.
+        """
+        text = self.buffer.getvalue()
+        data = text.encode()
+        if len(data) != len(text):
+            # Index positions are counted in characters of the buffer
+            self.index_pending = [(key, len(text[:position].encode())) for key, position in self.index_pending]
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+    def flush(self):
+        """
+        Write the buffered rows to the file (without fsync).
+        """
+        if self.file is None or self.pending() == 0:
+            return
+        data = self.take()
+        index, self.index_pending = self.index_pending, []
+        ll.acquire_lock(self.resource, self.service)
+        try:
+            self.reopen_if_replaced()
+            start = os.fstat(self.file.fileno()).st_size
+            offset = start
+            if self.header and start == 0:
+                data = self.header + data
+                offset = len(self.header)
+            view = memoryview(data)
+            while view:
+                view = view[self.file.write(view):]
+            if index:
+                try:
+                    ri.write_index(self.path, [(key, offset + position) for key, position in index], truncate=start == 0)
+                except OSError:
+                    # The index only speeds up queries, rows are never lost for it
+                    pass
+        finally:
+            ll.release_lock(self.resource, self.service)
+        self.unsynced += len(data)
+        self.bytes += len(data)
+
+    def sync(self):
+        """
+        Write the buffered rows and fsync the file.
+        """
+        self.flush()
+        if self.file is not None and self.unsynced:
+            start = time.perf_counter()
+            os.fsync(self.file.fileno())
+            self.fsync_times.append(time.perf_counter() - start)
+            self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.file is None:
+            return
+        try:
+            self.sync()
+        finally:
+            self.file.close()
+            self.file = None
+            self.path = None
+
+    def report(self):
+        """
+        Statistics of the writes since the last report.
+
+        Returns:
+            dict: 'rows', 'rows_per_s', 'bytes', 'fsyncs', and 'fsync_p50',
+            'fsync_p99', 'fsync_max' in ms.
+        """
+        elapsed = time.monotonic() - self.stats_start
+        fsync_times = sorted(self.fsync_times)
+        stats = {'rows': self.rows, 'rows_per_s': self.rows / elapsed if elapsed > 0 else 0.0,
+                 'bytes': self.bytes, 'fsyncs': len(fsync_times)}
+        if fsync_times:
+            stats['fsync_p50'] = fsync_times[len(fsync_times) // 2] * 1000
+            stats['fsync_p99'] = fsync_times[min(len(fsync_times) - 1, int(len(fsync_times) * 0.99))] * 1000
+            stats['fsync_max'] = fsync_times[-1] * 1000
+        self.reset_stats()
+        return stats
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class BinaryFileWriter(DataFileWriter):
+    """
+    Long-lived writer of a binary raw data file (libs/raw_binary.py).
+
+    Rows are [sample time, location, value...] with the decoded values, packed
+    into fixed-width records. Every block_records records (or when the location
+    changes) the records are compressed into a block with its CRC32 and written
+    like the rows of a CSV file. The records of an unfinished block stay in
+    memory until the writer is closed: a crash loses them from the file but not
+    from the sample journal, which datacollection sizes for block_records
+    samples and a window and replays at the next start.
+
+    A file holding records of another register layout is not appended to, the
+    rows go to a file named after the CRC of the new header next to it.
+    Index entries (index_every set) point to the blocks.
+
+    Args:
+        resource (str): Lock resource of the file, e.g. "rawdata".
+        service (str): Name of the service writing the file.
+        record_format (RecordFormat): Format of the records.
+        block_records (int): Records of a block.
+        fsync_bytes (int): Bytes written between two fsyncs.
+        fsync_interval (float): Longest time in seconds between two fsyncs.
+    """
+
+    def __init__(self, resource, service, record_format, block_records=rb.DEFAULT_BLOCK_RECORDS,
+                 fsync_bytes=DEFAULT_FSYNC_BYTES, fsync_interval=DEFAULT_FSYNC_INTERVAL):
+        super().__init__(resource, service, fsync_bytes, fsync_interval)
+        self.record_format = record_format
+        self.block_records = block_records
+        self.header = record_format.header()
+        self.records = bytearray()
+        self.count = 0
+        self.location = None
+        self.blocks = []
+        self.requested_path = None
+
+    def file_path(self, path):
+        """
+        File the records of path go to: path itself unless it holds another layout.
+        """
+        try:
+            if rb.file_format(path) in (None, self.record_format):
+                return path
+        except ValueError:
+            pass
+        root, extension = os.path.splitext(path)
+        return f"{root}_{zlib.crc32(self.header):08x}{extension}"
+
+    def write_rows(self, path, rows):
+        """
+        Append samples to the file at path.
+
+        Args:
+            path (str): Current file name (local_files entry).
+            rows (iterable): [sample time, location, value...] lists.
+        """
+        if path != self.requested_path:
+            self.open(path)
+        for row in rows:
+            location = row[1]
+            if location != self.location and self.count:
+                self.close_block()
+            self.location = location
+            self.records += self.record_format.pack(row[0], row[2:])
+            self.count += 1
+            self.rows += 1
+            if self.count >= self.block_records:
+                self.close_block()
+        if self.blocks:
+            self.flush()
+        if (self.unsynced >= self.fsync_bytes
+                or time.monotonic() - self.last_sync >= self.fsync_interval):
+            self.sync()
+
+    def open(self, path):
+        super().open(self.file_path(path))
+        self.requested_path = path
+
+    def close_block(self):
+        if self.index_every:
+            sample_time, utc_offset = self.record_format.struct.unpack_from(self.records)[:2]
+            self.index_pending.append((ri.time_key(self.record_format.local_time(sample_time, utc_offset)), self.pending()))
+        self.blocks.append(rb.encode_block(self.records, self.count, self.record_format.size, self.location))
+        self.records = bytearray()
+        self.count = 0
+
+    def pending(self):
+        return sum(len(block) for block in self.blocks)
+
+    def take(self):
+        data = b''.join(self.blocks)
+        self.blocks = []
+        return data
+
+    def close(self):
+        if self.count:
+            self.close_block()
+        super().close()
+        self.requested_path = None
+
+    def last_sample_time(self, path):
+        """
+        Unix time of the last sample written for path, None without samples.
+
+        The index of the file gives the last block, so a restart does not
+        decompress the whole day.
+        """
+        path = self.file_path(path)
+        return rb.last_sample_time(path, ri.last_offset(path))
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class WriterThread(threading.Thread):
+    """
+    Thread writing data file rows handed over by the acquisition loop.
+
+    Jobs (resource, path, rows) go through a bounded queue, so a slow SD card
+    or a contended file lock delays the files, not the next sample. Each
+    resource is written by its own DataFileWriter, or BinaryFileWriter for the
+    resources given a record format. When the queue is full the
+    overflow policy decides:
+
+    - "block": wait for room in the queue (acquisition is delayed).
+    - "drop_oldest": discard the oldest queued job.
+    - "spill": append the job to a JSON lines journal on disk. Jobs keep
+      going to the journal until the thread has caught up with the queue and
+      written the journal back, so rows stay in order. A journal left by a
+      previous run is written first.
+
+    Args:
+        service (str): Name of the service, used for the file locks.
+        logger (logging.Logger): Logger of the write errors.
+        queue_size (int): Jobs the queue holds.
+        overflow (str): Overflow policy, one of OVERFLOW_POLICIES.
+        spill_path (str): Journal of the "spill" policy.
+    """
+
+    def __init__(self, service, logger, queue_size=DEFAULT_QUEUE_SIZE, overflow=DEFAULT_OVERFLOW,
+                 spill_path=SPILL_PATH):
+        super().__init__(name=f"{service}-writer", daemon=True)
+        self.service = service
+        self.logger = logger
+        self.queue = queue.Queue(queue_size)
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self.fsync_bytes = DEFAULT_FSYNC_BYTES
+        self.fsync_interval = DEFAULT_FSYNC_INTERVAL
+        self.writers = {}
+        self.formats = {}
+        self.index_every = {}
+        self.buffer_bytes = {}
+        self.spill_lock = threading.Lock()
+        try:
+            with open(spill_path, 'r') as file:
+                self.spill_pending = sum(1 for _ in file)
+        except FileNotFoundError:
+            self.spill_pending = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.max_depth = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.blocked = 0.0
+        self.lags = []
+
+    def configure(self, overflow, fsync_bytes, fsync_interval):
+        """
+        Take the overflow policy and fsync policy of a settings reload.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            self.logger.error(f"Unknown writer overflow policy {overflow}, using {DEFAULT_OVERFLOW}")
+            overflow = DEFAULT_OVERFLOW
+        self.overflow = overflow
+        self.fsync_bytes = fsync_bytes
+        self.fsync_interval = fsync_interval
+        for writer in list(self.writers.values()):
+            writer.fsync_bytes = fsync_bytes
+            writer.fsync_interval = fsync_interval
+
+    def set_format(self, resource, record_format, block_records=rb.DEFAULT_BLOCK_RECORDS):
+        """
+        Write a resource in the binary raw data format, or as CSV with record_format None.
+
+        The writer of the resource is replaced by the thread before its next rows.
+        """
+        if record_format is None:
+            self.formats.pop(resource, None)
+        else:
+            self.formats[resource] = (record_format, block_records)
+
+    def set_index(self, resource, index_every):
+        """
+        Index one row every index_every rows of a resource, 0 for no index.
+        """
+        self.index_every[resource] = index_every
+
+    def set_buffer(self, resource, buffer_bytes):
+        """
+        Bytes of rows of a resource buffered before writing, 0 to write every job at once.
+        """
+        self.buffer_bytes[resource] = buffer_bytes
+
+    def submit(self, resource, path, rows):
+        """
+        Queue rows to be appended to a data file.
+
+        Args:
+            resource (str): Lock resource of the file ("rawdata", "calcdata", "userdata").
+            path (str): File name.
+            rows (list): CSV rows, or [sample time, location, value...] lists
+                for a resource with a record format.
+        """
+        job = (resource, path, rows, time.monotonic())
+        with self.spill_lock:
+            if self.spill_pending:
+                # Rows stay behind the ones already in the journal
+                self.spill(job)
+                return
+            try:
+                self.queue.put_nowait(job)
+                self.max_depth = max(self.max_depth, self.queue.qsize())
+                return
+            except queue.Full:
+                if self.overflow == "spill":
+                    self.spill(job)
+                    return
+                if self.overflow == "drop_oldest":
+                    while True:
+                        try:
+                            self.queue.get_nowait()
+                            self.dropped += 1
+                        except queue.Empty:
+                            pass
+                        try:
+                            self.queue.put_nowait(job)
+                            return
+                        except queue.Full:
+                            continue
+        # "block": wait outside of spill_lock, the thread may need it to go on
+        start = time.monotonic()
+        self.queue.put(job)
+        self.blocked += time.monotonic() - start
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def spill(self, job):
+        # Called with spill_lock held
+        try:
+            with open(self.spill_path, 'a') as file:
+                file.write(json.dumps(job) + '\n')
+        except (OSError, TypeError, ValueError) as e:
+            self.logger.error(f"Writer spill journal {self.spill_path} cannot be written: {str(e)}")
+            self.dropped += 1
+            return
+        self.spill_pending += 1
+        self.spilled += 1
+        if self.queue.empty():
+            # The thread may be waiting for a job: wake it up to read the journal back
+            self.queue.put_nowait(UNSPILL)
+
+    def unspill(self, measure_lag=True):
+        """
+        Write the jobs of the spill journal, oldest first.
+
+        Args:
+            measure_lag (bool): False for a journal of a previous run, whose
+                monotonic queue times mean nothing now.
+        """
+        if not self.spill_pending:
+            return
+        with self.spill_lock:
+            if not self.spill_pending:
+                return
+            try:
+                with open(self.spill_path, 'r') as file:
+                    jobs = [json.loads(line) for line in file if line.strip()]
+            except (OSError, ValueError) as e:
+                self.logger.error(f"Writer spill journal {self.spill_path} cannot be read: {str(e)}")
+                jobs = []
+            if os.path.exists(self.spill_path):
+                os.remove(self.spill_path)
+            self.spill_pending = 0
+        for job in jobs:
+            self.write(job, measure_lag)
+
+    def writer(self, resource):
+        writer = self.writers.get(resource)
+        record_format, block_records = self.formats.get(resource, (None, None))
+        if writer is not None and getattr(writer, 'record_format', None) != record_format:
+            writer.close()
+            writer = None
+        if writer is None:
+            if record_format is None:
+                writer = DataFileWriter(resource, self.service, self.fsync_bytes, self.fsync_interval)
+            else:
+                writer = BinaryFileWriter(resource, self.service, record_format, block_records,
+                                          self.fsync_bytes, self.fsync_interval)
+            self.writers[resource] = writer
+        elif record_format is not None:
+            writer.block_records = block_records
+        writer.index_every = self.index_every.get(resource, 0)
+        writer.buffer_bytes = self.buffer_bytes.get(resource, DEFAULT_BUFFER_BYTES)
+        return writer
+
+    def write(self, job, measure_lag=True):
+        resource, path, rows, queued = job
+        try:
+            self.writer(resource).write_rows(path, rows)
+        except Exception as e:
+            self.logger.error(f"Error writing {resource} to {path}: {str(e)}")
+        if measure_lag:
+            self.lags.append(time.monotonic() - queued)
+
+    def run(self):
+        self.unspill(measure_lag=False)
+        while True:
+            try:
+                job = self.queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                # Idle: fsync what was written since the last rows
+                for writer in list(self.writers.values()):
+                    try:
+                        writer.sync()
+                    except OSError as e:
+                        self.logger.error(f"Error syncing {writer.path}: {str(e)}")
+                self.unspill()
+                continue
+            if job is None:
+                break
+            if job is not UNSPILL:
+                self.write(job)
+            if self.queue.empty():
+                self.unspill()
+
+        self.unspill()
+        for writer in self.writers.values():
+            try:
+                writer.close()
+            except OSError as e:
+                self.logger.error(f"Error closing {writer.path}: {str(e)}")
+
+    def close(self, timeout=None):
+        """
+        Write the queued jobs, close the files and stop the thread.
+        """
+        if self.is_alive():
+            self.queue.put(None)
+            self.join(timeout)
+
+    def report(self):
+        """
+        Queue and writer statistics since the last report.
+
+        Returns:
+            dict: 'queue_depth', 'max_queue_depth', 'dropped', 'spilled',
+            'spill_pending', 'blocked_s', 'lag_p50', 'lag_p99', 'lag_max' in ms,
+            and the DataFileWriter report of each resource.
+        """
+        lags = sorted(self.lags)
+        stats = {'queue_depth': self.queue.qsize(), 'max_queue_depth': self.max_depth, 'dropped': self.dropped,
+                 'spilled': self.spilled, 'spill_pending': self.spill_pending, 'blocked_s': self.blocked}
+        if lags:
+            stats['lag_p50'] = lags[len(lags) // 2] * 1000
+            stats['lag_p99'] = lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000
+            stats['lag_max'] = lags[-1] * 1000
+        for resource, writer in list(self.writers.items()):
+            stats[resource] = writer.report()
+        self.reset_stats()
+        return stats
+#------------------------------------------------------------------------------
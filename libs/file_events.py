@@ -0,0 +1,135 @@
+import os
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# inotify event bits (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# inotify_init1 flags, the values of O_NONBLOCK and O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, 'O_CLOEXEC', 0o2000000)
+
+# Events of a data directory: rows appended to a file kept open by its writer
+# (IN_MODIFY), a file closed after writing, and files created or moved in
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# struct inotify_event without its name: wd, mask, cookie, len
+EVENT_HEADER = struct.Struct('iIII')
+
+# Bytes read from the inotify descriptor at once
+READ_BYTES = 65536
+
+#------------------------------------------------------------------------------
+class DirectoryWatcher:
+    """
+    Changes of files under directories, from Linux inotify through ctypes.
+
+    Every directory is watched with its subdirectories, and the directories
+    created later are added as they appear. wait() sleeps in select() until an
+    event comes or the timeout ends, so a process waiting for data costs no
+    wakeups in between.
+
+    Args:
+        directories (list): Directories to watch.
+        mask (int): inotify events of a file which count as a change.
+
+    Raises:
+        OSError: inotify is not available (not Linux, no watches left).
+    """
+
+    def __init__(self, directories, mask=WATCH_MASK):
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        try:
+            self.libc = ctypes.CDLL(libc_name, use_errno=True)
+            self.libc.inotify_init1
+        except (OSError, AttributeError) as e:
+            raise OSError(errno.ENOSYS, f"inotify is not available: {e}")
+        self.mask = mask
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        # Watch descriptor -> (watched directory, directory given to the constructor)
+        self.watches = {}
+        self.roots = [os.path.normpath(directory) for directory in directories]
+        try:
+            for root in self.roots:
+                self.add_tree(root, root)
+        except OSError:
+            self.close()
+            raise
+
+    def add(self, directory, root):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.mask | IN_CREATE | IN_MOVED_TO)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, f"{directory}: {os.strerror(code)}")
+        self.watches[wd] = (directory, root)
+
+    def add_tree(self, directory, root):
+        os.makedirs(directory, exist_ok=True)
+        for path, _, _ in os.walk(directory):
+            self.add(path, root)
+
+    def wait(self, timeout=None):
+        """
+        Wait for changes.
+
+        Args:
+            timeout (float): Longest wait in seconds, None to wait for an event.
+
+        Returns:
+            set: Directories given to the constructor with a change below them,
+            all of them when the kernel event queue overflowed, empty on timeout.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, READ_BYTES)
+            except BlockingIOError:
+                return changed
+            position = 0
+            while position < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, position)
+                name = data[position + EVENT_HEADER.size:position + EVENT_HEADER.size + length].rstrip(b'\0')
+                position += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    changed.update(self.roots)
+                    continue
+                watch = self.watches.get(wd)
+                if watch is None:
+                    continue
+                directory, root = watch
+                if mask & IN_IGNORED:
+                    # The directory was removed
+                    del self.watches[wd]
+                    continue
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        try:
+                            self.add_tree(os.path.join(directory, os.fsdecode(name)), root)
+                        except OSError:
+                            pass
+                        changed.add(root)
+                    continue
+                if mask & self.mask:
+                    changed.add(root)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        self.watches = {}
+#------------------------------------------------------------------------------
@@ -2,10 +2,38 @@ import logging
 import os
 import json
 import time
+import fcntl
+import atexit
+import signal
+import threading
 from ping3 import ping, verbose_ping
 
 os.chdir("/home/pi/K96Rpi")
 
+# Directory of the resource lock files, relative to the K96Rpi directory
+LOCK_DIR = "locks"
+
+# Seconds between two tries when waiting for a lock with a timeout outside the main thread
+LOCK_POLL_INTERVAL = 0.01
+
+# Directory of the lock wait/hold statistics, one JSON file per resource and service
+LOCK_STATS_DIR = "logs/lock_stats"
+
+# Seconds between two merges of the lock statistics into their files
+LOCK_STATS_FLUSH_INTERVAL = 60
+
+# Resources held by this process: resource -> (fd, service, monotonic time of acquisition, owner thread id, depth)
+_held_locks = {}
+_held_locks_guard = threading.Lock()
+
+# Per resource thread lock taken before the flock: flock does not exclude the threads of one process
+_thread_locks = {}
+
+# Statistics collected since the last flush: (resource, service) -> stats dict
+_lock_stats = {}
+_lock_stats_guard = threading.Lock()
+_last_stats_flush = time.monotonic()
+
 #------------------------------------------------------------------------------
 def check_server_response(host):
     """
@@ -106,20 +134,267 @@ def load_settings():
 #------------------------------------------------------------------------------
 
 #------------------------------------------------------------------------------
-def acquire_lock(res_lock_file, service):
-    lock_file_pattern = f"locks/{res_lock_file}"
-    lock_file_path = f"locks/{res_lock_file}-{service}.lock"
+class _LockTimeout(Exception):
+    pass
+
+def _alarm_handler(signum, frame):
+    raise _LockTimeout()
+#------------------------------------------------------------------------------
 
-    while True:
-        files = [f for f in os.listdir('locks') if f.startswith(res_lock_file) and f.endswith('.lock')]
-        if not files:
-            open(lock_file_path, 'w').close()
-            break
-        time.sleep(0.1)
+#------------------------------------------------------------------------------
+def _flock(fd, timeout):
+    """
+    Take the exclusive flock of an open lock file.
+
+    Args:
+        fd (int): File descriptor of the lock file.
+        timeout (float): Seconds to wait for the lock, None to wait forever.
+
+    Returns:
+        bool: True if the lock is taken, False if the timeout expired.
+    """
+    if timeout is None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return True
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        if timeout <= 0:
+            return False
+
+    if threading.current_thread() is threading.main_thread():
+        # Blocking wait, interrupted by SIGALRM when the timeout expires
+        previous_handler = signal.signal(signal.SIGALRM, _alarm_handler)
+        try:
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+            return True
+        except _LockTimeout:
+            return False
+        finally:
+            signal.signal(signal.SIGALRM, previous_handler)
+
+    # Signals are delivered to the main thread only, other threads poll
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            pass
+    return False
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def acquire_lock(res_lock_file, service, timeout=None):
+    """
+    Take the exclusive lock of a shared resource (serial port, data files, settings).
+
+    The lock is a kernel flock on locks/<resource>.lock. A waiter sleeps in the
+    kernel and wakes up as soon as the holder releases the lock, and the lock is
+    dropped automatically when the holder process dies. The holder PID and
+    service name are written into the lock file (see lock_holder).
+
+    A lock is owned by the thread which took it. Other threads of the process
+    wait on a per-resource threading.Lock before the flock. The owner taking
+    it again gets it at once and must release it as many times as it took it.
+
+    Args:
+        res_lock_file (str): Resource name, e.g. "port" or "rawdata".
+        service (str): Name of the calling service.
+        timeout (float): Seconds to wait for the lock, None to wait forever.
+
+    Returns:
+        bool: True if the lock is held, False if the timeout expired.
+    """
+    owner = threading.get_ident()
+    with _held_locks_guard:
+        held = _held_locks.get(res_lock_file)
+        if held is not None and held[3] == owner:
+            _held_locks[res_lock_file] = held[:4] + (held[4] + 1,)
+            return True
+        thread_lock = _thread_locks.setdefault(res_lock_file, threading.Lock())
+
+    start = time.monotonic()
+    if not thread_lock.acquire(timeout=-1 if timeout is None else max(timeout, 0)):
+        _record_lock_time(res_lock_file, service, 'wait', time.monotonic() - start, timed_out=True)
+        return False
+    fd = None
+    try:
+        os.makedirs(LOCK_DIR, exist_ok=True)
+        fd = os.open(f"{LOCK_DIR}/{res_lock_file}.lock", os.O_RDWR | os.O_CREAT, 0o664)
+        locked = _flock(fd, None if timeout is None else max(0, timeout - (time.monotonic() - start)))
+    except BaseException:
+        if fd is not None:
+            os.close(fd)
+        thread_lock.release()
+        raise
+    acquired = time.monotonic()
+    _record_lock_time(res_lock_file, service, 'wait', acquired - start, timed_out=not locked)
+    if not locked:
+        os.close(fd)
+        thread_lock.release()
+        return False
+
+    os.ftruncate(fd, 0)
+    os.pwrite(fd, f"{os.getpid()} {service}\n".encode(), 0)
+    with _held_locks_guard:
+        _held_locks[res_lock_file] = (fd, service, acquired, owner, 1)
+    return True
 #------------------------------------------------------------------------------
 
 #------------------------------------------------------------------------------
 def release_lock(res_lock_file, service):
-    if os.path.exists(f"locks/{res_lock_file}-{service}.lock"):
-        os.remove(f"locks/{res_lock_file}-{service}.lock")
+    """
+    Release the lock of a shared resource. A lock taken several times by a
+    thread is freed by its last release. Releasing a lock which is not held
+    by the calling thread does nothing.
+
+    Args:
+        res_lock_file (str): Resource name, e.g. "port" or "rawdata".
+        service (str): Name of the calling service.
+
+    Returns:
+        None
+    """
+    with _held_locks_guard:
+        held = _held_locks.get(res_lock_file)
+        if held is None or held[3] != threading.get_ident():
+            return
+        if held[4] > 1:
+            _held_locks[res_lock_file] = held[:4] + (held[4] - 1,)
+            return
+        del _held_locks[res_lock_file]
+    fd, holder_service, acquired, _, _ = held
+    try:
+        os.ftruncate(fd, 0)
+    finally:
+        # The lock file is kept: removing it would let a new waiter lock another inode
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        finally:
+            _thread_locks[res_lock_file].release()
+
+    _record_lock_time(res_lock_file, holder_service, 'hold', time.monotonic() - acquired)
+    if time.monotonic() - _last_stats_flush >= LOCK_STATS_FLUSH_INTERVAL:
+        flush_lock_stats()
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def lock_holder(res_lock_file):
+    """
+    Describe the current holder of a resource lock.
+
+    Args:
+        res_lock_file (str): Resource name, e.g. "port" or "rawdata".
+
+    Returns:
+        str or None: "<pid> <service>" of the holder, or None if the lock is free.
+    """
+    try:
+        fd = os.open(f"{LOCK_DIR}/{res_lock_file}.lock", os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return os.pread(fd, 256, 0).decode(errors='replace').strip() or "unknown"
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        return None
+    finally:
+        os.close(fd)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def _new_histogram():
+    # buckets: upper bound in ms (power of 2) -> count, e.g. "4" counts 2 ms <= t < 4 ms
+    return {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'buckets': {}}
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def _record_lock_time(res_lock_file, service, kind, seconds, timed_out=False):
+    """
+    Add one wait or hold duration to the statistics of a resource and service.
+    """
+    milliseconds = seconds * 1000
+    with _lock_stats_guard:
+        stats = _lock_stats.get((res_lock_file, service))
+        if stats is None:
+            stats = {'wait': _new_histogram(), 'hold': _new_histogram(), 'timeouts': 0}
+            _lock_stats[(res_lock_file, service)] = stats
+        histogram = stats[kind]
+        histogram['count'] += 1
+        histogram['total_ms'] += milliseconds
+        histogram['max_ms'] = max(histogram['max_ms'], milliseconds)
+        bound = str(1 << int(milliseconds).bit_length())
+        histogram['buckets'][bound] = histogram['buckets'].get(bound, 0) + 1
+        if timed_out:
+            stats['timeouts'] += 1
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def flush_lock_stats():
+    """
+    Merge the lock statistics collected since the last flush into
+    logs/lock_stats/<resource>-<service>.json.
+
+    Called from release_lock every LOCK_STATS_FLUSH_INTERVAL seconds and at exit.
+    The read-merge-replace of a file runs under a flock on <file>.lock, so
+    services flushing the same statistics at once do not lose each other's
+    counts. Statistics never make a lock operation fail: write errors are ignored.
+
+    Returns:
+        None
+    """
+    global _last_stats_flush
+    with _lock_stats_guard:
+        _last_stats_flush = time.monotonic()
+        collected = dict(_lock_stats)
+        _lock_stats.clear()
+
+    for (res_lock_file, service), stats in collected.items():
+        path = f"{LOCK_STATS_DIR}/{res_lock_file}-{service}.json"
+        fd = None
+        try:
+            os.makedirs(LOCK_STATS_DIR, exist_ok=True)
+            # Locked beside the statistics file, whose inode is swapped by os.replace
+            fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o664)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                with open(path, 'r') as stats_file:
+                    merged = json.load(stats_file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                merged = {'resource': res_lock_file, 'service': service,
+                          'wait': _new_histogram(), 'hold': _new_histogram(), 'timeouts': 0}
+
+            for kind in ('wait', 'hold'):
+                histogram = merged[kind]
+                histogram['count'] += stats[kind]['count']
+                histogram['total_ms'] += stats[kind]['total_ms']
+                histogram['max_ms'] = max(histogram['max_ms'], stats[kind]['max_ms'])
+                for bound, count in stats[kind]['buckets'].items():
+                    histogram['buckets'][bound] = histogram['buckets'].get(bound, 0) + count
+            merged['timeouts'] += stats['timeouts']
+            merged['updated'] = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+            # Written aside and renamed so readers never see a partial file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as stats_file:
+                json.dump(merged, stats_file, indent=4)
+            os.replace(tmp_path, path)
+        except (OSError, ValueError, KeyError):
+            pass
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+atexit.register(flush_lock_stats)
 #------------------------------------------------------------------------------
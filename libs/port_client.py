@@ -0,0 +1,256 @@
+import socket
+import struct
+
+import libs.sensor_data_exchange as sde
+import libs.local as ll
+
+# Frames on the broker socket are prefixed with their length
+FRAME_HEADER = struct.Struct('>H')
+
+# Requests to the broker are prefixed with their length and priority class
+REQUEST_HEADER = struct.Struct('>HB')
+
+# Priority classes of the broker queue: lower values are served first.
+# URGENT is for safety writes (hwmonitor, RTC time), BULK for the raw data loop.
+URGENT = 0
+NORMAL = 1
+BULK = 2
+PRIORITY_NAMES = {URGENT: "urgent", NORMAL: "normal", BULK: "bulk"}
+
+# Default path of the port broker socket, relative to the K96Rpi directory
+DEFAULT_BROKER_SOCKET = "locks/port_broker.sock"
+
+# Seconds to wait for the broker to answer one request
+BROKER_TIMEOUT = 30
+
+#------------------------------------------------------------------------------
+def recv_exact(sock, size):
+    """
+    Receive exactly size bytes from a stream socket.
+
+    Args:
+        sock (socket.socket): Connected stream socket.
+        size (int): Number of bytes to receive.
+
+    Returns:
+        bytes or None: The received bytes, or None if the peer closed the connection.
+    """
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def send_frame(sock, payload):
+    """
+    Send one length-prefixed frame over a stream socket.
+
+    Args:
+        sock (socket.socket): Connected stream socket.
+        payload (bytes or bytearray): Frame payload.
+
+    Returns:
+        None
+    """
+    sock.sendall(FRAME_HEADER.pack(len(payload)) + bytes(payload))
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def recv_frame(sock):
+    """
+    Receive one length-prefixed frame from a stream socket.
+
+    Args:
+        sock (socket.socket): Connected stream socket.
+
+    Returns:
+        bytes or None: The frame payload, or None if the peer closed the connection.
+    """
+    header = recv_exact(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    (length,) = FRAME_HEADER.unpack(header)
+    return recv_exact(sock, length)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def send_request(sock, request, priority):
+    """
+    Send one Modbus request with its priority class to the broker.
+
+    Args:
+        sock (socket.socket): Connected stream socket.
+        request (bytes or bytearray): Complete Modbus request frame including CRC.
+        priority (int): URGENT, NORMAL or BULK.
+
+    Returns:
+        None
+    """
+    sock.sendall(REQUEST_HEADER.pack(len(request), priority) + bytes(request))
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def recv_request(sock):
+    """
+    Receive one Modbus request with its priority class, sent by send_request.
+
+    Args:
+        sock (socket.socket): Connected stream socket.
+
+    Returns:
+        tuple or None: (priority, request), or None if the peer closed the connection.
+    """
+    header = recv_exact(sock, REQUEST_HEADER.size)
+    if header is None:
+        return None
+    length, priority = REQUEST_HEADER.unpack(header)
+    request = recv_exact(sock, length)
+    if request is None:
+        return None
+    return priority, request
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class PortConnection:
+    """
+    Access to the sensor box serial port for one service.
+
+    The connection goes through the port broker socket when the broker is running.
+    Otherwise the serial port is opened directly under the "port" lock, the lock
+    is held until the connection is closed.
+
+    Requests go to the broker queue with the priority class of the connection,
+    unless a transaction asks for another one. The broker serves the waiting
+    URGENT requests first at the next transaction boundary.
+    """
+
+    def __init__(self, service, sock=None, serial_port=None, priority=NORMAL):
+        self.service = service
+        self.sock = sock
+        self.serial_port = serial_port
+        self.priority = priority
+
+    def transact(self, settings, request, priority=None):
+        """
+        Send a prepared Modbus request frame and return the validated response.
+
+        Args:
+            settings (dict): A dictionary containing configuration settings.
+            request (bytes or bytearray): Complete Modbus request frame including CRC.
+            priority (int): Priority class of this request, None for the connection class.
+
+        Returns:
+            bytes or None: The response frame if successful, or None if unsuccessful.
+        """
+        if self.serial_port is not None:
+            return sde.transact(settings, self.serial_port, request)
+        if self.sock is None:
+            return None
+
+        try:
+            send_request(self.sock, request, self.priority if priority is None else priority)
+            response = recv_frame(self.sock)
+        except OSError:
+            response = None
+
+        if response is None:
+            # Broker went away, the connection cannot be used anymore
+            self.sock.close()
+            self.sock = None
+            return None
+        # An empty frame means the broker got no valid answer from the device
+        return response or None
+
+    def close(self):
+        """
+        Close the broker connection or the serial port and release the port lock.
+        """
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.serial_port is not None:
+            self.serial_port.close()
+            self.serial_port = None
+            ll.release_lock("port", self.service)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def open_port(settings, service, priority=NORMAL):
+    """
+    Open access to the sensor box serial port.
+
+    Connects to the port broker socket (box.broker_socket in settings). If the
+    broker is not running, the "port" lock is taken and the serial port is opened
+    directly, as the services did before the broker existed.
+
+    Args:
+        settings (dict): The settings dictionary containing configuration information.
+        service (str): Name of the calling service, used for the port lock.
+        priority (int): Broker priority class of the connection requests.
+
+    Returns:
+        PortConnection or None: The connection, or None if the serial port cannot be opened.
+    """
+    socket_path = settings.get('box').get('broker_socket', DEFAULT_BROKER_SOCKET)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(BROKER_TIMEOUT)
+    try:
+        sock.connect(socket_path)
+        return PortConnection(service, sock=sock, priority=priority)
+    except OSError:
+        sock.close()
+
+    ll.acquire_lock("port", service)
+    serial_port = sde.open_port(settings)
+    if serial_port is None:
+        ll.release_lock("port", service)
+        return None
+    return PortConnection(service, serial_port=serial_port, priority=priority)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def transact(settings, connection, request, priority=None):
+    """
+    Send a prepared Modbus request frame over a port connection.
+
+    Args:
+        settings (dict): A dictionary containing configuration settings.
+        connection (PortConnection): Connection returned by open_port.
+        request (bytes or bytearray): Complete Modbus request frame including CRC.
+        priority (int): Priority class of this request, None for the connection class.
+
+    Returns:
+        bytes or None: The response frame if successful, or None if unsuccessful.
+    """
+    return connection.transact(settings, request, priority)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def data_exchange(settings, connection, address, function_code, register_address, registers_qty, data_to_write=None, priority=None):
+    """
+    Exchange data with the sensor box over a port connection.
+
+    Same arguments and result as sensor_data_exchange.data_exchange, with the
+    PortConnection returned by open_port instead of a serial port object.
+
+    Args:
+        settings (dict): A dictionary containing configuration settings.
+        connection (PortConnection): Connection returned by open_port.
+        address (str): The address of the device or sensor.
+        function_code (str): The Modbus function code (e.g., '03' for read operation).
+        register_address (str): The address of the Modbus register to read or write.
+        registers_qty (int): The quantity of registers to read or write.
+        data_to_write (str): Value to write (hex string) for write functions.
+        priority (int): Priority class of this request, None for the connection class.
+
+    Returns:
+        bytes or None: The response data from the device if successful, or None if unsuccessful.
+    """
+    request = sde.generate_modbus_request(address, function_code, register_address, registers_qty, data_to_write)
+    return connection.transact(settings, request, priority)
+#------------------------------------------------------------------------------
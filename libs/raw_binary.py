@@ -0,0 +1,357 @@
+import os
+import json
+import zlib
+import time
+import struct
+import datetime
+
+# Signature of a binary raw data file
+FILE_MAGIC = b'K96RAW01'
+
+# magic, bytes of the JSON description of the records
+FILE_HEADER = struct.Struct('<8sI')
+
+# Signature of a block
+BLOCK_MAGIC = b'BLK1'
+
+# magic, records, location bytes, compressed payload bytes
+BLOCK_HEADER = struct.Struct('<4sIHI')
+
+CRC = struct.Struct('<I')
+
+# Records of a block when raw_data.block_records is not set
+DEFAULT_BLOCK_RECORDS = 300
+
+# zlib level of the block payloads
+COMPRESSION_LEVEL = 6
+
+# Bytes read at once when looking for the next block after a corrupted one
+SCAN_CHUNK = 65536
+
+#------------------------------------------------------------------------------
+def shuffle(data, size):
+    """
+    Byte planes of fixed-width records: byte 0 of every record, then byte 1...
+
+    Consecutive samples differ in a few low bytes only, the planes of the
+    other bytes are long runs which zlib compresses to almost nothing.
+    """
+    return b''.join(data[offset::size] for offset in range(size))
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def unshuffle(data, size):
+    """
+    Inverse of shuffle.
+    """
+    count = len(data) // size
+    records = bytearray(len(data))
+    for offset in range(size):
+        records[offset::size] = data[offset * count:(offset + 1) * count]
+    return bytes(records)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def split_validity(values, row_bytes, all_valid, error_value):
+    """
+    Validity bitmap of a decoded row, and its values with the unread registers set to 0.
+
+    Args:
+        values (list): Decoded values of the raw data row, as SampleDecoder.decode.
+        row_bytes (int): Bytes of the bitmap.
+        all_valid (bytes): Bitmap of a row without read errors.
+        error_value (float): Value of the registers which could not be read.
+
+    Returns:
+        tuple: (bitmap bytes, values).
+    """
+    if error_value not in values:
+        return all_valid, values
+    valid = [value != error_value for value in values]
+    bitmap = sum(1 << bit for bit, ok in enumerate(valid) if ok).to_bytes(row_bytes, 'little')
+    return bitmap, [value if ok else 0 for value, ok in zip(values, valid)]
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def join_validity(values, bitmap, all_valid, error_value):
+    """
+    Inverse of split_validity: error_value back for the registers not read.
+    """
+    if bitmap == all_valid:
+        return values
+    bits = int.from_bytes(bitmap, 'little')
+    return [value if bits >> bit & 1 else error_value for bit, value in enumerate(values)]
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class RecordFormat:
+    """
+    Fixed-width record of one raw data sample.
+
+    A record holds the Unix time of the sample, the UTC offset of the box at
+    that time in minutes (the CSV timestamps are local time), a validity bitmap
+    (one bit per register, cleared for registers which could not be read) and
+    the decoded values packed with the array type codes of buffer_layout.
+    The description of the columns (names, measurements, types, hex widths) is
+    stored in the file header, so files can be read without the settings.
+
+    Args:
+        columns (list): One dict per raw data column: 'name', 'measurement',
+            'type' (array type code) and 'hex_width' (digits, 0 for decimal).
+        error_value (float): Value of the registers which could not be read.
+    """
+
+    def __init__(self, columns, error_value):
+        self.columns = columns
+        self.error_value = error_value
+        self.width = len(columns)
+        self.row_bytes = (self.width + 7) // 8
+        self.all_valid = ((1 << self.width) - 1).to_bytes(self.row_bytes, 'little')
+        self.struct = struct.Struct('<dh' + f'{self.row_bytes}s' + ''.join(column['type'] for column in columns))
+        self.size = self.struct.size
+        self.formatters = [(index, f"0x{{:0{column['hex_width']}X}}".format)
+                           for index, column in enumerate(columns) if column['hex_width']]
+
+    def __eq__(self, other):
+        return isinstance(other, RecordFormat) and (self.columns, self.error_value) == (other.columns, other.error_value)
+
+    def header(self):
+        """
+        File header: signature, JSON description of the records and CRC32.
+        """
+        description = json.dumps({'version': 1, 'error_value': self.error_value, 'columns': self.columns}).encode()
+        data = FILE_HEADER.pack(FILE_MAGIC, len(description)) + description
+        return data + CRC.pack(zlib.crc32(data))
+
+    @classmethod
+    def read_header(cls, file):
+        """
+        Read the header of a binary raw data file.
+
+        Args:
+            file (file): Binary file positioned at its start.
+
+        Returns:
+            RecordFormat: Format of the records of the file.
+
+        Raises:
+            ValueError: The file does not start with a valid header.
+        """
+        data = file.read(FILE_HEADER.size)
+        if len(data) < FILE_HEADER.size:
+            raise ValueError("truncated header")
+        magic, length = FILE_HEADER.unpack(data)
+        if magic != FILE_MAGIC:
+            raise ValueError("not a binary raw data file")
+        description = file.read(length)
+        crc = file.read(CRC.size)
+        if len(crc) < CRC.size or CRC.unpack(crc)[0] != zlib.crc32(data + description):
+            raise ValueError("corrupted header")
+        description = json.loads(description)
+        return cls(description['columns'], description['error_value'])
+
+    def pack(self, sample_time, values):
+        """
+        Record of one sample.
+
+        Args:
+            sample_time (float): Unix time of the sample.
+            values (list): Decoded values of the raw data row, as SampleDecoder.decode.
+        """
+        bitmap, values = split_validity(values, self.row_bytes, self.all_valid, self.error_value)
+        utc_offset = time.localtime(sample_time).tm_gmtoff // 60
+        return self.struct.pack(sample_time, utc_offset, bitmap, *values)
+
+    def unpack(self, records):
+        """
+        Samples of consecutive records.
+
+        Yields:
+            tuple: (sample time, UTC offset in minutes, values with the error value
+            for the registers not read).
+        """
+        for fields in self.struct.iter_unpack(records):
+            sample_time, utc_offset, bitmap = fields[:3]
+            yield sample_time, utc_offset, join_validity(list(fields[3:]), bitmap, self.all_valid, self.error_value)
+
+    def csv_header(self):
+        """
+        Header row of the raw data CSV (as written by fsm).
+        """
+        return ["Timestamp", "Location"] + [column['measurement'] for column in self.columns]
+
+    def local_time(self, sample_time, utc_offset):
+        """
+        Timestamp of the raw data CSV, in the local time of the box.
+        """
+        local_time = datetime.datetime.fromtimestamp(sample_time + utc_offset * 60, datetime.timezone.utc)
+        return local_time.strftime("%Y-%m-%dT%H:%M:%S")
+
+    def csv_row(self, sample_time, utc_offset, values, location):
+        """
+        Row of the raw data CSV, identical to the one datacollection writes.
+        """
+        row = [self.local_time(sample_time, utc_offset), location] + values
+        for index, formatter in self.formatters:
+            if values[index] != self.error_value:
+                row[index + 2] = formatter(values[index])
+        return row
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def encode_block(records, count, size, location):
+    """
+    Block of a binary raw data file.
+
+    Args:
+        records (bytes): count packed records.
+        count (int): Records of the block.
+        size (int): Bytes of a record.
+        location (str): Location string of the samples.
+
+    Returns:
+        bytes: Block header, location, compressed byte planes of the records
+        and CRC32 of all of them.
+    """
+    payload = zlib.compress(shuffle(bytes(records), size), COMPRESSION_LEVEL)
+    location = location.encode()
+    data = BLOCK_HEADER.pack(BLOCK_MAGIC, count, len(location), len(payload)) + location + payload
+    return data + CRC.pack(zlib.crc32(data))
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class BlockReader:
+    """
+    Streaming reader of the blocks of a binary raw data file.
+
+    Blocks are read one at a time. A block whose CRC does not match is counted
+    in bad_blocks and skipped by looking for the next block signature; a block
+    cut by a power loss at the end of the file is counted in truncated.
+
+    Args:
+        file (file): Binary file positioned at its start.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.record_format = RecordFormat.read_header(file)
+        self.bad_blocks = 0
+        self.truncated = 0
+
+    def __iter__(self):
+        """
+        Yields:
+            tuple: (location, packed records) of each valid block.
+        """
+        size = self.record_format.size
+        while True:
+            start = self.file.tell()
+            head = self.file.read(BLOCK_HEADER.size)
+            if not head:
+                return
+            if len(head) == BLOCK_HEADER.size:
+                magic, count, location_length, payload_length = BLOCK_HEADER.unpack(head)
+                if magic == BLOCK_MAGIC:
+                    body = self.file.read(location_length + payload_length + CRC.size)
+                    if len(body) < location_length + payload_length + CRC.size:
+                        if self.resync(start + 1):
+                            self.bad_blocks += 1
+                            continue
+                        self.truncated += 1
+                        return
+                    crc, = CRC.unpack_from(body, location_length + payload_length)
+                    if crc == zlib.crc32(head + body[:-CRC.size]):
+                        try:
+                            records = unshuffle(zlib.decompress(body[location_length:-CRC.size]), size)
+                        except zlib.error:
+                            records = b''
+                        if len(records) == count * size:
+                            yield body[:location_length].decode(errors='replace'), records
+                            continue
+            self.bad_blocks += 1
+            if not self.resync(start + 1):
+                return
+
+    def resync(self, position):
+        """
+        Move to the next block signature after position, False if there is none.
+        """
+        self.file.seek(position)
+        tail = b''
+        while True:
+            chunk = self.file.read(SCAN_CHUNK)
+            if not chunk:
+                return False
+            data = tail + chunk
+            found = data.find(BLOCK_MAGIC)
+            if found >= 0:
+                self.file.seek(position - len(tail) + found)
+                return True
+            position += len(chunk)
+            tail = data[-(len(BLOCK_MAGIC) - 1):]
+
+    def samples(self):
+        """
+        Yields:
+            tuple: (location, sample time, UTC offset in minutes, values) of every record.
+        """
+        for location, records in self:
+            for sample_time, utc_offset, values in self.record_format.unpack(records):
+                yield location, sample_time, utc_offset, values
+
+    def csv_rows(self):
+        """
+        Yields:
+            list: Rows of the raw data CSV, header first.
+        """
+        yield self.record_format.csv_header()
+        for location, sample_time, utc_offset, values in self.samples():
+            yield self.record_format.csv_row(sample_time, utc_offset, values, location)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def file_format(path):
+    """
+    RecordFormat of an existing binary raw data file, None if it is empty or missing.
+
+    Raises:
+        ValueError: The file exists but has no valid header.
+    """
+    try:
+        if os.path.getsize(path) == 0:
+            return None
+        with open(path, 'rb') as file:
+            return RecordFormat.read_header(file)
+    except FileNotFoundError:
+        return None
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def last_sample_time(path, offset=0):
+    """
+    Unix time of the last sample of a binary raw data file, None without samples.
+
+    Args:
+        path (str): Binary raw data file.
+        offset (int): Start of a block near the end of the file (the last entry
+            of its index), where reading begins; 0 or an offset which is not
+            a block start reads the whole file.
+    """
+    last = None
+    try:
+        with open(path, 'rb') as file:
+            reader = BlockReader(file)
+            if offset:
+                file.seek(offset)
+                if file.read(len(BLOCK_MAGIC)) == BLOCK_MAGIC:
+                    file.seek(offset)
+                else:
+                    # Stale index: every block from the first one
+                    file.seek(0)
+                    reader = BlockReader(file)
+            for _, records in reader:
+                last = reader.record_format.struct.unpack_from(records, len(records) - reader.record_format.size)[0]
+    except (FileNotFoundError, ValueError):
+        pass
+    return last
+#------------------------------------------------------------------------------
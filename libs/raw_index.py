@@ -0,0 +1,223 @@
+import io
+import os
+import csv
+import mmap
+import struct
+import bisect
+import datetime
+
+import libs.raw_binary as rb
+
+# Sidecar index of a raw data file: <raw data file><INDEX_SUFFIX>
+INDEX_SUFFIX = ".idx"
+
+# Local time key (YYYYMMDDHHMMSS) of a row, byte offset of the row (or block) in the data file
+INDEX_ENTRY = struct.Struct('<QQ')
+
+# Raw data rows between two index entries when raw_data.index_every is not set
+DEFAULT_INDEX_EVERY = 60
+
+#------------------------------------------------------------------------------
+def index_path(path):
+    return path + INDEX_SUFFIX
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def time_key(timestamp):
+    """
+    Integer key of a raw data timestamp "YYYY-MM-DDTHH:MM:SS", ordered like the timestamps.
+    """
+    return int(timestamp[0:4] + timestamp[5:7] + timestamp[8:10] + timestamp[11:13] + timestamp[14:16] + timestamp[17:19])
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def parse_time(text):
+    """
+    Raw data timestamp of a user given local time ("2024-09-17 10:00", "2024-09-17T10:00:00"...).
+    """
+    return datetime.datetime.fromisoformat(text).strftime("%Y-%m-%dT%H:%M:%S")
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def write_index(path, entries, truncate=False):
+    """
+    Append entries to the index of a data file.
+
+    Args:
+        path (str): Raw data file.
+        entries (list): (time key, byte offset) tuples, in file order.
+        truncate (bool): Start the index again, the data file was empty.
+    """
+    with open(index_path(path), 'wb' if truncate else 'ab') as file:
+        file.write(b''.join(INDEX_ENTRY.pack(key, offset) for key, offset in entries))
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def read_index(path, size):
+    """
+    Entries of the index of a data file pointing inside its first size bytes.
+
+    Returns:
+        tuple: (list of time keys, list of byte offsets), empty without index.
+    """
+    try:
+        with open(index_path(path), 'rb') as file:
+            data = file.read()
+    except FileNotFoundError:
+        return [], []
+    keys, offsets = [], []
+    # A cut last entry is ignored
+    for key, offset in INDEX_ENTRY.iter_unpack(data[:len(data) - len(data) % INDEX_ENTRY.size]):
+        if offset >= size or (offsets and (key < keys[-1] or offset <= offsets[-1])):
+            # Stale or out of order entries: keep what precedes them
+            break
+        keys.append(key)
+        offsets.append(offset)
+    return keys, offsets
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def last_offset(path):
+    """
+    Offset of the last indexed row (or block) of a data file, 0 without index.
+    """
+    try:
+        _, offsets = read_index(path, os.path.getsize(path))
+    except FileNotFoundError:
+        return 0
+    return offsets[-1] if offsets else 0
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def start_offset(keys, offsets, key):
+    """
+    Offset of the last indexed row before key, 0 when key precedes the index.
+    """
+    position = bisect.bisect_left(keys, key) - 1
+    return offsets[position] if position >= 0 else 0
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def csv_range(path, start, end, use_index=True):
+    """
+    Rows of a raw data CSV file with a timestamp in [start, end].
+
+    The file is memory-mapped, the index gives the offset of a row shortly
+    before start and rows are read from there until one is after end. Without
+    a usable index the file is read from its first row.
+
+    Args:
+        path (str): Raw data CSV file.
+        start (str): First timestamp, "YYYY-MM-DDTHH:MM:SS".
+        end (str): Last timestamp.
+        use_index (bool): False to scan the whole file.
+
+    Yields:
+        bytes: Rows of the range, with their line end.
+    """
+    start_key, end_key = time_key(start), time_key(end)
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = 0
+            if use_index:
+                keys, offsets = read_index(path, size)
+                offset = start_offset(keys, offsets, start_key)
+                # An offset which is not the start of a row means a stale index
+                if offset and data[offset - 1:offset] != b'\n':
+                    offset = 0
+            while offset < size:
+                line_end = data.find(b'\n', offset)
+                line_end = size if line_end < 0 else line_end + 1
+                timestamp = data[offset:offset + 19]
+                offset, line_start = line_end, offset
+                # Header and rows cut by a power loss have no timestamp
+                if timestamp[4:5] != b'-' or not timestamp[:4].isdigit():
+                    continue
+                try:
+                    key = time_key(timestamp.decode())
+                except ValueError:
+                    continue
+                if key > end_key:
+                    return
+                if key >= start_key:
+                    yield data[line_start:line_end]
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def binary_range(path, start, end, use_index=True):
+    """
+    Rows of a binary raw data file with a timestamp in [start, end], as CSV text.
+
+    The index points to blocks: decoding starts at the last block beginning
+    before start.
+
+    Yields:
+        bytes: CSV rows of the range, with their line end.
+    """
+    start_key, end_key = time_key(start), time_key(end)
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            reader = rb.BlockReader(data)
+            if use_index:
+                keys, offsets = read_index(path, size)
+                offset = start_offset(keys, offsets, start_key)
+                if offset and data[offset:offset + len(rb.BLOCK_MAGIC)] == rb.BLOCK_MAGIC:
+                    data.seek(offset)
+            record_format = reader.record_format
+            text = io.StringIO()
+            writer = csv.writer(text)
+            for location, sample_time, utc_offset, values in reader.samples():
+                row = record_format.csv_row(sample_time, utc_offset, values, location)
+                key = time_key(row[0])
+                if key > end_key:
+                    return
+                if key >= start_key:
+                    text.seek(0)
+                    text.truncate()
+                    writer.writerow(row)
+                    yield text.getvalue().encode()
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def file_range(path, start, end, use_index=True):
+    """
+    Rows of a raw data file (CSV or binary) with a timestamp in [start, end].
+    """
+    with open(path, 'rb') as file:
+        binary = file.read(len(rb.FILE_MAGIC)) == rb.FILE_MAGIC
+    if binary:
+        return binary_range(path, start, end, use_index)
+    return csv_range(path, start, end, use_index)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def file_header(path):
+    """
+    Header row of the raw data CSV of a file (CSV or binary), with its line end.
+    """
+    with open(path, 'rb') as file:
+        if file.read(len(rb.FILE_MAGIC)) != rb.FILE_MAGIC:
+            file.seek(0)
+            return file.readline()
+        file.seek(0)
+        text = io.StringIO()
+        csv.writer(text, quoting=csv.QUOTE_NONE).writerow(rb.RecordFormat.read_header(file).csv_header())
+        return text.getvalue().encode()
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def file_date(path):
+    """
+    Date of a daily raw data file from its YYYYMMDD_ name prefix, None for other names.
+    """
+    try:
+        return datetime.datetime.strptime(os.path.basename(path)[:8], "%Y%m%d").date()
+    except ValueError:
+        return None
+#------------------------------------------------------------------------------
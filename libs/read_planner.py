@@ -0,0 +1,54 @@
+#------------------------------------------------------------------------------
+def plan_block_reads(registers, block_size, max_gap=0, unit_bytes=1):
+    """
+    Group register definitions into the fewest contiguous block reads.
+
+    Registers are sorted by address and merged greedily into blocks. A register
+    joins the current block if the hole between it and the end of the block is
+    not larger than max_gap and the whole block still fits into block_size.
+    Holes are read together with the data and simply ignored when slicing.
+
+    Args:
+        registers (dict): Register name -> register definition from settings.json
+            (uses 'address' as hex string and 'data_length_bytes').
+        block_size (int): Maximum length of a single read, in register units.
+        max_gap (int): Maximum number of unused register units allowed between
+            two neighbouring registers of the same block.
+        unit_bytes (int): Size of one register unit in the response, in bytes
+            (1 for K96 RAM/EPROM, 2 for Modbus holding/input registers).
+
+    Returns:
+        list: One dict per block with the keys:
+            'address' (int): First register address of the block.
+            'length' (int): Quantity of register units to request.
+            'registers' (list): (name, byte offset, byte length) tuples used to
+                slice every register out of the block response.
+    """
+    items = []
+    for name, value in registers.items():
+        address = int(value.get('address'), 16)
+        length = int(value.get('data_length_bytes'))
+        items.append((address, length, name))
+    items.sort()
+
+    blocks = []
+    block = None
+    for address, length, name in items:
+        end = address + length
+        if block is not None:
+            block_end = block['address'] + block['length']
+            fits = max(end, block_end) - block['address'] <= block_size
+            if address - block_end <= max_gap and fits:
+                block['length'] = max(end, block_end) - block['address']
+                block['members'].append((name, address, length))
+                continue
+        block = {'address': address, 'length': length, 'members': [(name, address, length)]}
+        blocks.append(block)
+
+    plan = []
+    for block in blocks:
+        members = [(name, (address - block['address']) * unit_bytes, length * unit_bytes)
+                   for name, address, length in block['members']]
+        plan.append({'address': block['address'], 'length': block['length'], 'registers': members})
+    return plan
+#------------------------------------------------------------------------------
@@ -0,0 +1,415 @@
+import struct
+import operator
+
+import libs.sensor_data_exchange as sde
+import libs.read_planner as rp
+
+# Value written to the raw data row when a register cannot be read
+ERROR_VALUE = -999.99
+
+# struct codes of big-endian signed integers by byte length
+STRUCT_CODES = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+
+# Modbus limit for the quantity of registers in one read request
+MODBUS_MAX_READ_REGISTERS = 125
+
+#------------------------------------------------------------------------------
+def make_decoder(keep_in, data_type):
+    """
+    Build the function converting register bytes into the stored value.
+
+    Args:
+        keep_in (str): "hex" or "decimal" representation.
+        data_type (str): "signed" or "unsigned" for decimal values.
+
+    Returns:
+        callable: Function taking the register bytes and returning a hex string
+        like "0x00A1" or an integer.
+    """
+    if keep_in == "hex":
+        return lambda data: f"0x{data.hex().upper()}"
+    signed = data_type != "unsigned"
+    return lambda data: int.from_bytes(data, 'big', signed=signed)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class Register:
+    """
+    One register definition from settings.json, parsed once.
+    """
+    __slots__ = ('name', 'measurement', 'address', 'length', 'byte_length', 'keep_in',
+                 'data_type', 'signed', 'register_type', 'type', 'multiplier', 'error_code',
+                 'sample_period', 'request', 'decode')
+
+    def __init__(self, name, definition, slave_address, function_code, unit_bytes):
+        self.name = name
+        self.measurement = definition.get('measurement', name)
+        self.address = int(definition.get('address'), 16)
+        self.length = int(definition.get('data_length_bytes'))
+        self.byte_length = self.length * unit_bytes
+        self.keep_in = definition.get('keep_in')
+        self.data_type = definition.get('data_type')
+        # Hex values are shown as raw bytes, so they are always decoded unsigned
+        self.signed = self.keep_in != "hex" and self.data_type != "unsigned"
+        self.register_type = definition.get('register_type', '')
+        self.type = definition.get('type')
+        self.multiplier = definition.get('multiplier', 0)
+        self.error_code = definition.get('error_code')
+        # Seconds between two reads of the register, 0 to read it on every sample
+        self.sample_period = float(definition.get('sample_period') or 0)
+        # Request reading this register alone, used by the status readers
+        self.request = bytes(sde.generate_modbus_request(slave_address, function_code,
+                                                         definition.get('address'), self.length))
+        self.decode = make_decoder(self.keep_in, self.data_type)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class ReadBlock:
+    """
+    One block read covering several neighbouring registers.
+    """
+    __slots__ = ('slave_address', 'function_code', 'address', 'length', 'unit_bytes', 'request', 'registers')
+
+    def __init__(self, slave_address, function_code, address, length, registers, unit_bytes=1):
+        self.slave_address = slave_address
+        self.function_code = function_code
+        self.address = address
+        self.length = length
+        self.unit_bytes = unit_bytes
+        self.request = bytes(sde.generate_modbus_request(slave_address, function_code, hex(address), length))
+        # (Register, byte offset, byte length) inside the block response
+        self.registers = registers
+
+    def subset(self, names):
+        """
+        Block reading only some of the registers of this block.
+
+        The block is trimmed to the span of the selected registers, so reading a
+        subset never takes more requests than reading the whole block.
+
+        Args:
+            names (set): Names of the registers to keep.
+
+        Returns:
+            ReadBlock or None: The trimmed block, None if no register is kept.
+        """
+        members = [member for member in self.registers if member[0].name in names]
+        if not members:
+            return None
+        start = min(offset for _, offset, _ in members)
+        end = max(offset + length for _, offset, length in members)
+        first_unit = start // self.unit_bytes
+        units = -(-end // self.unit_bytes) - first_unit
+        members = [(register, offset - first_unit * self.unit_bytes, length) for register, offset, length in members]
+        return ReadBlock(self.slave_address, self.function_code, self.address + first_unit, units, members, self.unit_bytes)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class BlockDecoder:
+    """
+    Decoder extracting every register of a block response in one struct call.
+
+    The struct format covers the whole block: registers of 1, 2, 4 and 8 bytes
+    are unpacked as integers, holes are skipped with pad bytes and registers of
+    other lengths (24 bit values) are unpacked as bytes and converted afterwards.
+    Blocks with overlapping registers and truncated answers are decoded field
+    by field.
+    """
+    __slots__ = ('struct', 'converts', 'fields', 'errors')
+
+    def __init__(self, block):
+        fields = [(offset, length, register.signed) for register, offset, length in block.registers]
+        overlap = any(fields[i + 1][0] < fields[i][0] + fields[i][1] for i in range(len(fields) - 1))
+
+        self.fields = fields
+        self.errors = (ERROR_VALUE,) * len(fields)
+        self.converts = []
+        self.struct = None
+        if overlap:
+            return
+
+        layout = '>'
+        position = 0
+        for index, (offset, length, signed) in enumerate(fields):
+            if offset > position:
+                layout += f'{offset - position}x'
+            code = STRUCT_CODES.get(length)
+            if code is None:
+                layout += f'{length}s'
+                self.converts.append((index, signed))
+            else:
+                layout += code if signed else code.upper()
+            position = offset + length
+        self.struct = struct.Struct(layout)
+
+    def decode(self, data):
+        """
+        Decode the registers of one block.
+
+        Args:
+            data (bytes or None): Data bytes of the block response, None if the read failed.
+
+        Returns:
+            tuple or list: Register values in block order, ERROR_VALUE for the
+            registers which are not in the answer.
+        """
+        if data is None:
+            return self.errors
+        if self.struct is not None and len(data) >= self.struct.size:
+            values = self.struct.unpack_from(data)
+            if not self.converts:
+                return values
+            values = list(values)
+            for index, signed in self.converts:
+                values[index] = int.from_bytes(values[index], 'big', signed=signed)
+            return values
+        return [int.from_bytes(data[offset:offset + length], 'big', signed=signed)
+                if offset + length <= len(data) else ERROR_VALUE
+                for offset, length, signed in self.fields]
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class SampleDecoder:
+    """
+    Decoder turning the block responses of one sample into a raw data row.
+
+    Values come out as integers in the column order of the raw data file, read
+    errors as ERROR_VALUE. Hex formatting is applied on demand; the register
+    multipliers are applied by the consumers of the values (WindowAggregator).
+    """
+    __slots__ = ('blocks', 'order', 'formatters')
+
+    def __init__(self, registers, blocks):
+        self.blocks = [BlockDecoder(block) for block in blocks]
+
+        positions = {}
+        for block in blocks:
+            for register, offset, length in block.registers:
+                positions[register.name] = len(positions)
+        order = [positions[register.name] for register in registers]
+        # itemgetter of a single index returns the value instead of a tuple
+        self.order = operator.itemgetter(*order) if len(order) > 1 else (lambda sample: (sample[order[0]],))
+
+        self.formatters = [(index, f"0x{{:0{register.byte_length * 2}X}}".format)
+                           for index, register in enumerate(registers) if register.keep_in == "hex"]
+
+    def decode(self, payloads):
+        """
+        Decode the responses of all raw data blocks.
+
+        Args:
+            payloads (list): Data bytes of each block response (None for failed reads),
+                in the order of RegisterMap.raw_blocks.
+
+        Returns:
+            list: Register values in raw data column order.
+        """
+        sample = []
+        for decoder, data in zip(self.blocks, payloads):
+            sample.extend(decoder.decode(data))
+        return list(self.order(sample))
+
+    def format(self, values):
+        """
+        Convert decoded values into raw data file fields (hex registers as "0x00A1").
+
+        Args:
+            values (list): Values returned by decode.
+
+        Returns:
+            list: Values ready to be written to the raw data CSV.
+        """
+        row = list(values)
+        for index, formatter in self.formatters:
+            if row[index] != ERROR_VALUE:
+                row[index] = formatter(row[index])
+        return row
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class RegisterMap:
+    """
+    Register definitions of settings.json compiled into request frames and decoders.
+
+    Attributes:
+        raw_registers (list): Registers of a raw data row in column order
+            (raw_data.registers followed by raw_data.arduino_registers).
+        raw_blocks (list): ReadBlock objects reading all raw_registers.
+        sample_decoder (SampleDecoder): Decoder of the raw_blocks responses.
+        user_data_names (list): Registers of raw_data.registers with "type": "meas",
+            the columns of the user_data file.
+        eprom_statuses, ram_statuses, arduino_statuses (list): Registers of
+            sensor_info, read one by one.
+    """
+    __slots__ = ('raw_registers', 'raw_blocks', 'sample_decoder', 'user_data_names',
+                 'eprom_statuses', 'ram_statuses', 'arduino_statuses')
+
+    def __init__(self, settings):
+        box = settings.get('box')
+        raw_data = settings.get('raw_data')
+        sensor_info = settings.get('sensor_info')
+        sensor_address = box.get('sensor_address')
+        arduino_address = box.get('arduino_address')
+        modbus_functions = box.get('modbus_functions')
+
+        registers = raw_data.get('registers') or {}
+        arduino_registers = raw_data.get('arduino_registers') or {}
+        block_size = raw_data.get('block_size', 64)
+        max_gap = raw_data.get('max_gap', 0)
+
+        read_ram = modbus_functions.get('READ_RAM')
+        sensor_registers = {name: Register(name, value, sensor_address, read_ram, 1)
+                            for name, value in registers.items()}
+        arduino_compiled = {name: Register(name, value, arduino_address, self.arduino_function(modbus_functions, value), 2)
+                            for name, value in arduino_registers.items()}
+        self.raw_registers = list(sensor_registers.values()) + list(arduino_compiled.values())
+
+        # K96 RAM is byte addressed, one READ_RAM request returns up to block_size bytes
+        self.raw_blocks = self.plan_blocks(registers, sensor_registers, sensor_address, read_ram, block_size, max_gap, 1)
+
+        # Arduino registers are 16 bit wide, input and holding registers are read separately
+        arduino_block_size = min(block_size, MODBUS_MAX_READ_REGISTERS)
+        input_registers = {name: value for name, value in arduino_registers.items() if value.get('register_type') == 'IR'}
+        holding_registers = {name: value for name, value in arduino_registers.items() if value.get('register_type') != 'IR'}
+        for function_name, selected in (('READ_MULTIPLE_IR', input_registers), ('READ_MULTIPLE_HR', holding_registers)):
+            if selected:
+                self.raw_blocks += self.plan_blocks(selected, arduino_compiled, arduino_address, modbus_functions.get(function_name),
+                                                    arduino_block_size, max_gap, 2)
+        self.sample_decoder = SampleDecoder(self.raw_registers, self.raw_blocks)
+        self.user_data_names = [name for name, value in registers.items() if value.get('type') == 'meas']
+
+        read_eprom = modbus_functions.get('READ_EPROM')
+        self.eprom_statuses = [Register(name, value, sensor_address, read_eprom, 1)
+                               for name, value in (sensor_info.get('EPROM_statuses') or {}).items()]
+        self.ram_statuses = [Register(name, value, sensor_address, read_ram, 1)
+                             for name, value in (sensor_info.get('RAM_statuses') or {}).items()]
+        self.arduino_statuses = [Register(name, value, arduino_address, self.arduino_function(modbus_functions, value), 2)
+                                 for name, value in (sensor_info.get('Arduino_Statuses') or {}).items()]
+
+    @staticmethod
+    def arduino_function(modbus_functions, definition):
+        if definition.get('register_type') == 'IR':
+            return modbus_functions.get('READ_MULTIPLE_IR')
+        return modbus_functions.get('READ_MULTIPLE_HR')
+
+    @staticmethod
+    def plan_blocks(definitions, compiled, slave_address, function_code, block_size, max_gap, unit_bytes):
+        blocks = []
+        for block in rp.plan_block_reads(definitions, block_size, max_gap, unit_bytes):
+            members = [(compiled[name], offset, length) for name, offset, length in block['registers']]
+            blocks.append(ReadBlock(slave_address, function_code, block['address'], block['length'], members, unit_bytes))
+        return blocks
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class SamplingSchedule:
+    """
+    Per-sample read plans of the raw data registers with a sample_period.
+
+    Registers without sample_period are read on every sample. A register with
+    a period is due when the sample time enters a new period slot
+    (floor(time / sample_period)), so registers sharing a period are read
+    together and only a few different plans exist. Plans are cached by due set
+    and made of the raw_blocks trimmed to the due registers. Registers which
+    are not due carry their last value forward in the row; a failed read is
+    retried on the next sample.
+    """
+    __slots__ = ('register_map', 'periods', 'always', 'periodic', 'last_slots', 'values', 'plans')
+
+    def __init__(self, register_map):
+        self.register_map = register_map
+        registers = register_map.raw_registers
+        self.periods = [register.sample_period for register in registers]
+        self.always = tuple(index for index, period in enumerate(self.periods) if not period)
+        self.periodic = [(index, period) for index, period in enumerate(self.periods) if period]
+        self.last_slots = [None] * len(registers)
+        self.values = [ERROR_VALUE] * len(registers)
+        self.plans = {}
+
+    def due(self, now):
+        """
+        Indexes in raw_registers of the registers to read at time now.
+        """
+        last_slots = self.last_slots
+        return self.always + tuple(index for index, period in self.periodic if last_slots[index] != now // period)
+
+    def plan(self, due):
+        """
+        Blocks and decoder reading the registers of a due set, built once per due set.
+        """
+        plan = self.plans.get(due)
+        if plan is None:
+            registers = [self.register_map.raw_registers[index] for index in due]
+            names = {register.name for register in registers}
+            blocks = [block for block in (block.subset(names) for block in self.register_map.raw_blocks) if block is not None]
+            plan = (blocks, SampleDecoder(registers, blocks))
+            self.plans[due] = plan
+        return plan
+
+    def read(self, settings, comm_port, now):
+        """
+        Read the registers due at time now.
+
+        Args:
+            settings (dict): A dictionary containing configuration settings.
+            comm_port (PortConnection): Connection to the sensor box serial port.
+            now (float): Sample time (unix time) deciding which registers are due.
+
+        Returns:
+            list: Values of all raw_registers in column order, as SampleDecoder.decode.
+        """
+        due = self.due(now)
+        if due:
+            blocks, decoder = self.plan(due)
+            values = decoder.decode(read_blocks(settings, comm_port, blocks))
+            for index, value in zip(due, values):
+                self.values[index] = value
+                if self.periods[index] and value != ERROR_VALUE:
+                    self.last_slots[index] = now // self.periods[index]
+        return list(self.values)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def read_blocks(settings, comm_port, blocks):
+    """
+    Read register blocks.
+
+    Args:
+        settings (dict): A dictionary containing configuration settings.
+        comm_port (PortConnection): Connection to the sensor box serial port.
+        blocks (list): ReadBlock objects to read.
+
+    Returns:
+        list: Data bytes of each block response, None for the failed reads.
+    """
+    payloads = []
+    for block in blocks:
+        response = comm_port.transact(settings, block.request)
+        payloads.append(response[3:-2] if response is not None else None)
+    return payloads
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def read_registers(settings, comm_port, registers, values, incorrect_value, missing_value):
+    """
+    Read registers one by one with their precomputed requests.
+
+    Args:
+        settings (dict): A dictionary containing configuration settings.
+        comm_port (PortConnection or None): Connection to the sensor box serial port.
+        registers (list): Register objects to read.
+        values (dict): Register name -> decoded value, filled in place.
+        incorrect_value: Value stored when the answer carries no data.
+        missing_value: Value stored when there is no answer.
+
+    Returns:
+        None
+    """
+    for register in registers:
+        response = comm_port.transact(settings, register.request) if comm_port is not None else None
+        if response is None:
+            values[register.name] = missing_value
+            continue
+        data = response[3:-2]
+        values[register.name] = register.decode(data) if data else incorrect_value
+#------------------------------------------------------------------------------
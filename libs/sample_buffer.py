@@ -0,0 +1,202 @@
+import math
+import datetime
+from array import array
+
+import libs.raw_binary as rb
+from libs.register_map import ERROR_VALUE
+
+# Integer array type codes, smallest first
+INTEGER_TYPES = ('b', 'h', 'i', 'q')
+
+#------------------------------------------------------------------------------
+def column_type(register):
+    """
+    Smallest array type code holding the decoded values of a register.
+    """
+    for code in INTEGER_TYPES:
+        if array(code).itemsize >= register.byte_length:
+            return code if register.signed else code.upper()
+    return 'd'
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def buffer_layout(register_map):
+    """
+    Column names and smallest array type codes of the decoded values of a register map.
+    """
+    return tuple((register.name, column_type(register)) for register in register_map.raw_registers)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def window_capacity(timeframe, sample_period):
+    """
+    Samples of a window of timeframe seconds, with one more for a late tick.
+    """
+    return math.ceil(timeframe / sample_period) + 1
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def record_format(register_map):
+    """
+    RecordFormat of the binary raw data file of a register map, with the column types of buffer_layout.
+    """
+    columns = [{'name': register.name, 'measurement': register.measurement, 'type': code,
+                'hex_width': register.byte_length * 2 if register.keep_in == "hex" else 0}
+               for register, (_, code) in zip(register_map.raw_registers, buffer_layout(register_map))]
+    return rb.RecordFormat(columns, ERROR_VALUE)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def raw_row(decoder, sample_time, values, location):
+    """
+    Row of the raw data CSV: Timestamp, Location and the formatted values.
+    """
+    timestamp = datetime.datetime.fromtimestamp(sample_time).strftime("%Y-%m-%dT%H:%M:%S")
+    return [timestamp, location] + decoder.format(values)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class SampleBuffer:
+    """
+    Raw data samples of one window stored by column.
+
+    Each register has a typed array sized for its decoded values, next to a
+    timestamp column and a validity bitmap (one bit per value, cleared for
+    registers which could not be read, stored as 0). Columns are allocated for
+    capacity samples up front and only grow if a window holds more samples;
+    clear() keeps the memory for the next window.
+
+    Args:
+        register_map (RegisterMap): Compiled registers of the raw data row.
+        capacity (int): Samples of a window.
+    """
+
+    def __init__(self, register_map, capacity):
+        self.registers = register_map.raw_registers
+        self.decoder = register_map.sample_decoder
+        self.layout = buffer_layout(register_map)
+        self.width = len(self.registers)
+        self.row_bytes = (self.width + 7) // 8
+        self.all_valid = ((1 << self.width) - 1).to_bytes(self.row_bytes, 'little')
+        self.capacity = 0
+        self.count = 0
+        self.timestamps = array('d')
+        self.columns = [array(code) for _, code in self.layout]
+        self.validity = bytearray()
+        self.reserve(capacity)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        """
+        Bytes allocated for the columns, timestamps and validity bitmap.
+        """
+        columns = sum(column.itemsize * len(column) for column in self.columns)
+        return columns + self.timestamps.itemsize * len(self.timestamps) + len(self.validity)
+
+    def reserve(self, capacity):
+        """
+        Grow the columns to hold at least capacity samples.
+        """
+        extra = capacity - self.capacity
+        if extra <= 0:
+            return
+        self.timestamps.frombytes(bytes(extra * self.timestamps.itemsize))
+        for column in self.columns:
+            column.frombytes(bytes(extra * column.itemsize))
+        self.validity.extend(bytes(extra * self.row_bytes))
+        self.capacity = capacity
+
+    def clear(self):
+        self.count = 0
+
+    def append(self, sample_time, values):
+        """
+        Add one sample.
+
+        Args:
+            sample_time (float): Unix time of the sample.
+            values (list): Decoded values of the raw data row, as SampleDecoder.decode.
+        """
+        index = self.count
+        if index == self.capacity:
+            self.reserve(max(1, self.capacity * 2))
+        self.timestamps[index] = sample_time
+
+        bitmap, values = rb.split_validity(values, self.row_bytes, self.all_valid, ERROR_VALUE)
+        start = index * self.row_bytes
+        self.validity[start:start + self.row_bytes] = bitmap
+
+        for column, value in zip(self.columns, values):
+            column[index] = value
+        self.count = index + 1
+
+    def values(self, index):
+        """
+        Decoded values of one sample, ERROR_VALUE for the registers not read.
+        """
+        values = [column[index] for column in self.columns]
+        start = index * self.row_bytes
+        return rb.join_validity(values, self.validity[start:start + self.row_bytes], self.all_valid, ERROR_VALUE)
+
+    def invalid_samples(self):
+        """
+        Indexes of the samples with registers which could not be read.
+        """
+        size = self.row_bytes
+        return [index for index in range(self.count)
+                if self.validity[index * size:(index + 1) * size] != self.all_valid]
+
+    def row(self, index, location):
+        """
+        Row of the raw data CSV for one sample: Timestamp, Location and the formatted values.
+
+        Args:
+            index (int): Sample index in the buffer.
+            location (str): Location string of the box.
+        """
+        return raw_row(self.decoder, self.timestamps[index], self.values(index), location)
+
+    def rows(self, location):
+        """
+        Rows of the raw data CSV of all samples, in sample order.
+        """
+        for index in range(self.count):
+            yield self.row(index, location)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class DoubleBuffer:
+    """
+    Active and spare SampleBuffer of the raw data.
+
+    Samples go to the active buffer. When a window closes, swap() exchanges the
+    buffers instead of copying the samples: the full buffer is handed over to
+    the window computations while the next window fills the other one.
+
+    Args:
+        register_map (RegisterMap): Compiled registers of the raw data row.
+        timeframe (float): Window length in seconds.
+        sample_period (float): Seconds between two samples.
+    """
+
+    def __init__(self, register_map, timeframe, sample_period):
+        capacity = window_capacity(timeframe, sample_period)
+        self.capacity = capacity
+        self.active = SampleBuffer(register_map, capacity)
+        self.spare = SampleBuffer(register_map, capacity)
+        self.layout = self.active.layout
+
+    def swap(self):
+        """
+        Start a new window in the spare buffer.
+
+        Returns:
+            SampleBuffer: The buffer of the closed window, valid until the next swap.
+        """
+        self.active, self.spare = self.spare, self.active
+        self.active.clear()
+        return self.spare
+#------------------------------------------------------------------------------
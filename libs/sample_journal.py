@@ -0,0 +1,140 @@
+import os
+import mmap
+import time
+import zlib
+import struct
+
+import libs.raw_binary as rb
+import libs.sample_buffer as sb
+from libs.register_map import ERROR_VALUE
+
+# Journal of the datacollection samples, relative to the installation directory
+JOURNAL_PATH = "data/datacollection.journal"
+
+JOURNAL_MAGIC = b'K96JRNL1'
+
+# magic, layout CRC32, record size, capacity, sequence of the first sample of the window
+HEADER = struct.Struct('<8sIIIQ')
+HEADER_SIZE = 64
+
+# Seconds between two msync of the journal when not set in the settings
+DEFAULT_SYNC_INTERVAL = 10.0
+
+#------------------------------------------------------------------------------
+class SampleJournal:
+    """
+    Crash-safe ring of the last samples, in a memory-mapped file.
+
+    Every sample is copied into a fixed-size record of the mapping: sequence
+    number, timestamp, validity bitmap, the values packed with the column
+    types of sb.buffer_layout, and a CRC32 of the record. The copy costs a
+    struct pack and a memcpy; the page cache keeps it when the service is
+    killed, and the mapping is msynced every sync_interval seconds against
+    power cuts. The header keeps the sequence of the first sample of the
+    current window, so after a restart the in-flight window can be rebuilt.
+
+    Records left by the previous run are read when the journal is opened
+    (recovered). A journal written with another register layout or capacity
+    is started again empty.
+
+    Args:
+        path (str): Journal file.
+        register_map (RegisterMap): Compiled registers of the raw data row.
+        capacity (int): Records of the ring, at least two windows of samples and,
+            for the binary raw data format, the samples of an unfinished block.
+        sync_interval (float): Seconds between two msync.
+    """
+
+    def __init__(self, path, register_map, capacity, sync_interval=DEFAULT_SYNC_INTERVAL):
+        self.path = path
+        self.capacity = capacity
+        self.sync_interval = sync_interval
+        self.layout = sb.buffer_layout(register_map)
+        self.width = len(self.layout)
+        self.row_bytes = (self.width + 7) // 8
+        self.all_valid = ((1 << self.width) - 1).to_bytes(self.row_bytes, 'little')
+        # Standard sizes: the journal format does not depend on the platform
+        self.body = struct.Struct('<Qd' + f'{self.row_bytes}s' + ''.join(code for _, code in self.layout))
+        self.record_size = self.body.size + 4
+        self.layout_crc = zlib.crc32(repr(self.layout).encode())
+
+        size = HEADER_SIZE + capacity * self.record_size
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o664)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        magic, layout_crc, record_size, capacity_stored, window_start = HEADER.unpack_from(self.map, 0)
+        if (magic, layout_crc, record_size, capacity_stored) != (JOURNAL_MAGIC, self.layout_crc, self.record_size, capacity):
+            self.map[:] = bytes(size)
+            window_start = 0
+            HEADER.pack_into(self.map, 0, JOURNAL_MAGIC, self.layout_crc, self.record_size, capacity, window_start)
+            self.map.flush()
+        self.window_start = window_start
+        self.recovered = self.read_records()
+        self.next_sequence = self.recovered[-1][0] + 1 if self.recovered else 1
+        if not self.window_start:
+            self.window_start = self.next_sequence
+        self.last_sync = time.monotonic()
+
+    def read_records(self):
+        """
+        Valid records of the ring, oldest first.
+
+        Returns:
+            list: (sequence, sample time, values) tuples, ERROR_VALUE for the
+            registers which were not read.
+        """
+        records = []
+        for slot in range(self.capacity):
+            offset = HEADER_SIZE + slot * self.record_size
+            data = self.map[offset:offset + self.record_size]
+            crc, = struct.unpack_from('<I', data, self.body.size)
+            if crc != zlib.crc32(data[:self.body.size]):
+                continue
+            fields = self.body.unpack_from(data)
+            sequence, sample_time, bitmap = fields[:3]
+            if sequence:
+                records.append((sequence, sample_time, rb.join_validity(list(fields[3:]), bitmap, self.all_valid, ERROR_VALUE)))
+        records.sort(key=lambda record: record[0])
+        return records
+
+    def append(self, sample_time, values):
+        """
+        Record one sample.
+
+        Args:
+            sample_time (float): Unix time of the sample.
+            values (list): Decoded values of the raw data row, as SampleDecoder.decode.
+        """
+        sequence = self.next_sequence
+        bitmap, values = rb.split_validity(values, self.row_bytes, self.all_valid, ERROR_VALUE)
+        body = self.body.pack(sequence, sample_time, bitmap, *values)
+        offset = HEADER_SIZE + (sequence % self.capacity) * self.record_size
+        self.map[offset:offset + self.record_size] = body + struct.pack('<I', zlib.crc32(body))
+        self.next_sequence = sequence + 1
+        if time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def start_window(self):
+        """
+        Mark the next sample as the first one of a new window.
+        """
+        self.window_start = self.next_sequence
+        HEADER.pack_into(self.map, 0, JOURNAL_MAGIC, self.layout_crc, self.record_size, self.capacity, self.window_start)
+
+    def sync(self):
+        self.map.flush()
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if not self.map.closed:
+            self.sync()
+            self.map.close()
+#------------------------------------------------------------------------------
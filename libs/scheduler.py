@@ -0,0 +1,129 @@
+import math
+import time
+import collections
+
+# Largest sleep in one call, so a wall clock step during a long wait is noticed
+MAX_SLEEP = 1.0
+
+# Width in ms of the jitter histogram buckets, the resolution of the reported percentiles
+JITTER_RESOLUTION_MS = 0.1
+
+#------------------------------------------------------------------------------
+class Tick:
+    """
+    One scheduled sample.
+
+    Attributes:
+        time (float): Scheduled start of the tick (unix time, multiple of the period).
+        jitter (float): Seconds between the scheduled and the actual start.
+        missed (int): Ticks skipped just before this one because of an overrun.
+    """
+    __slots__ = ('time', 'jitter', 'missed')
+
+    def __init__(self, time, jitter, missed):
+        self.time = time
+        self.jitter = jitter
+        self.missed = missed
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class TickScheduler:
+    """
+    Fixed-rate scheduler firing on wall clock boundaries (multiples of the period).
+
+    The deadline of the next tick is a monotonic instant and the sleeps are
+    measured against it; the wall clock only maps the monotonic clock onto the
+    grid of tick times (clock_offset), so the rate does not drift and the sample
+    times stay round (e.g. every second on the second). If a sample overruns the
+    next tick, the missed ticks are skipped instead of fired in a burst and
+    reported in the next Tick. A wall clock step (time synchronization) is seen
+    as a change of the offset and restarts the grid on its next boundary.
+    Jitter (in a histogram of fixed size) and missed ticks are accumulated
+    until report() is called.
+
+    Args:
+        period (float): Seconds between two ticks.
+    """
+
+    def __init__(self, period):
+        self.period = float(period)
+        # Ticks are numbered from the epoch, tick n starts at n * period
+        self.next_index = math.ceil(time.time() / self.period)
+        # Clock offset (wall - monotonic) at the last tick, to detect wall clock steps
+        self.clock_offset = time.time() - time.monotonic()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.ticks = 0
+        self.missed = 0
+        self.clock_steps = 0
+        # Jitter bucket (multiple of JITTER_RESOLUTION_MS) -> ticks
+        self.jitters = collections.Counter()
+        self.jitter_max = 0.0
+
+    def follow_clock(self, monotonic_now):
+        """
+        Update the wall clock offset, restarting the grid after a wall clock step.
+        """
+        clock_offset = time.time() - monotonic_now
+        if abs(clock_offset - self.clock_offset) > MAX_SLEEP:
+            # Ticks were neither missed nor due: the grid moved with the clock
+            self.clock_steps += 1
+            self.next_index = math.ceil((monotonic_now + clock_offset) / self.period)
+        self.clock_offset = clock_offset
+
+    def wait(self):
+        """
+        Sleep until the next tick.
+
+        Returns:
+            Tick: The tick which starts now.
+        """
+        while True:
+            now = time.monotonic()
+            self.follow_clock(now)
+            remaining = self.next_index * self.period - self.clock_offset - now
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, MAX_SLEEP))
+
+        # Monotonic instant on the wall clock grid, for the tick time
+        wall_now = now + self.clock_offset
+        missed = int((wall_now - self.next_index * self.period) // self.period)
+        index = self.next_index + missed
+        tick = Tick(index * self.period, wall_now - index * self.period, missed)
+        self.next_index = index + 1
+
+        self.ticks += 1
+        self.missed += missed
+        self.jitters[int(tick.jitter * 1000 / JITTER_RESOLUTION_MS)] += 1
+        self.jitter_max = max(self.jitter_max, tick.jitter)
+        return tick
+
+    def jitter_percentile(self, fraction):
+        """
+        Upper bound in ms of the jitter bucket holding the given fraction of the ticks.
+        """
+        rank = min(self.ticks - 1, int(self.ticks * fraction))
+        for bucket in sorted(self.jitters):
+            rank -= self.jitters[bucket]
+            if rank < 0:
+                return min((bucket + 1) * JITTER_RESOLUTION_MS, self.jitter_max * 1000)
+        return self.jitter_max * 1000
+
+    def report(self):
+        """
+        Statistics of the ticks since the last report.
+
+        Returns:
+            dict: 'ticks', 'missed', 'clock_steps', and 'jitter_p50', 'jitter_p99'
+            (to JITTER_RESOLUTION_MS), 'jitter_max' in ms.
+        """
+        stats = {'ticks': self.ticks, 'missed': self.missed, 'clock_steps': self.clock_steps}
+        if self.ticks:
+            stats['jitter_p50'] = self.jitter_percentile(0.5)
+            stats['jitter_p99'] = self.jitter_percentile(0.99)
+            stats['jitter_max'] = self.jitter_max * 1000
+        self.reset_stats()
+        return stats
+#------------------------------------------------------------------------------
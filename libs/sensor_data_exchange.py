@@ -2,6 +2,104 @@ import time
 import serial
 import sys
 
+# Bits on the wire for one character: start bit, 8 data bits, 2 stop bits
+BITS_PER_CHAR = 11
+
+# Default floor of the inter-frame silence in seconds, overridden by
+# box.min_frame_silence. USB-CDC adapters deliver data in 1 ms frames and the
+# Pi scheduler adds a few ms of jitter, so the 1.75 ms of Modbus RTU above
+# 19200 baud would split responses in the middle.
+MIN_FRAME_SILENCE = 0.005
+
+# Functions answering with <address><function><byte count><data...><CRC>
+BYTE_COUNT_FUNCTIONS = (0x01, 0x02, 0x03, 0x04, 0x44, 0x45, 0x46)
+# Functions answering with an echo of address, register and value or quantity
+ECHO_FUNCTIONS = (0x05, 0x06, 0x0F, 0x10)
+# K96 write functions answering with <address><function><CRC> only
+SHORT_ACK_FUNCTIONS = (0x41, 0x43)
+
+#------------------------------------------------------------------------------
+def frame_silence(baudrate, minimum=MIN_FRAME_SILENCE):
+    """
+    Calculate the Modbus RTU inter-frame silence (3.5 character times).
+
+    Args:
+        baudrate (int): Serial port baudrate.
+        minimum (float): Floor of the silence in seconds.
+
+    Returns:
+        float: Silence interval in seconds.
+    """
+    return max(3.5 * BITS_PER_CHAR / baudrate, minimum)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def expected_response_length(header):
+    """
+    Calculate the full length of a Modbus RTU response from its first bytes.
+
+    Args:
+        header (bytes): At least the first 3 bytes of the response (address,
+            function code and byte count or first data byte).
+
+    Returns:
+        int or None: Expected frame length including the CRC, or None if the
+        function code is unknown.
+    """
+    function_code = header[1]
+    if function_code & 0x80:
+        # Exception: <address><function | 0x80><exception code><CRC>
+        return 5
+    if function_code in SHORT_ACK_FUNCTIONS:
+        return 4
+    if function_code in ECHO_FUNCTIONS:
+        return 8
+    if function_code in BYTE_COUNT_FUNCTIONS:
+        return 5 + header[2]
+    return None
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def read_modbus_response(serial_port):
+    """
+    Read one Modbus RTU response frame from the serial port.
+
+    The frame length is derived from the function code and byte count, so the
+    function returns as soon as the last byte is received instead of waiting
+    for the port timeout. The port timeout bounds the wait for the first byte,
+    the inter-byte timeout set by open_port aborts truncated frames. Frames with
+    an unknown function code are read until the line goes silent.
+
+    Args:
+        serial_port (serial.Serial): The serial port object for communication.
+
+    Returns:
+        bytes: The received frame, possibly truncated or empty on timeout.
+    """
+    response = serial_port.read(2)
+    if len(response) < 2:
+        return response
+
+    function_code = response[1]
+    if function_code in SHORT_ACK_FUNCTIONS:
+        return response + serial_port.read(2)
+
+    response += serial_port.read(1)
+    if len(response) < 3:
+        return response
+
+    expected_length = expected_response_length(response)
+    if expected_length is None:
+        # Unknown layout, collect bytes until the inter-byte timeout expires
+        while True:
+            chunk = serial_port.read(serial_port.in_waiting or 1)
+            if not chunk:
+                return response
+            response += chunk
+
+    return response + serial_port.read(expected_length - len(response))
+#------------------------------------------------------------------------------
+
 #------------------------------------------------------------------------------
 def send_modbus_request(serial_port, request):
     """
@@ -14,16 +112,16 @@ def send_modbus_request(serial_port, request):
     Returns:
         bool: True if the request was sent successfully, False otherwise.
     """
-    # Flush input and output buffers, introduce a small delay
+    # Drop leftovers of a previous frame and keep the inter-frame silence
     serial_port.flushOutput()
     serial_port.flushInput()
-    time.sleep(0.1)
+    time.sleep(serial_port.inter_byte_timeout or frame_silence(serial_port.baudrate))
 
-    # Send the Modbus request frame
+    # Send the Modbus request frame and wait until it is transmitted
     check = serial_port.write(request)
     if check != len(request):
         return False
-    time.sleep(0.1)
+    serial_port.flush()
 
     # Request sent successfully
     return True
@@ -164,6 +262,59 @@ def check_crc(response):
     return False
 #------------------------------------------------------------------------------
 
+#------------------------------------------------------------------------------
+def check_response(request, response):
+    """
+    Check that a response frame is a complete, valid answer to a request.
+
+    Args:
+        request (bytes or bytearray): The Modbus request frame that was sent.
+        response (bytes or bytearray): The received response frame.
+
+    Returns:
+        bool: True if address, function code, frame length and CRC are valid.
+    """
+    if len(response) < 4 or response[0] != request[0] or response[1] != request[1]:
+        return False
+    if expected_response_length(response) != len(response):
+        return False
+    return check_crc(response)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def transact(settings, comm_port, request):
+    """
+    Send a prepared Modbus request frame and wait for a valid response.
+
+    The request is repeated up to 'tries' times (from 'settings') on timeouts,
+    truncated frames and CRC errors. Exception responses are not repeated.
+
+    Args:
+        settings (dict): A dictionary containing configuration settings.
+        comm_port (serial.Serial): The serial communication port object.
+        request (bytes or bytearray): Complete Modbus request frame including CRC.
+
+    Returns:
+        bytes or None: The response frame if successful, or None if unsuccessful.
+    """
+    tries_left = settings.get('box').get('tries')
+
+    while tries_left > 0:
+        tries_left -= 1
+        if not send_modbus_request(comm_port, request):
+            continue
+
+        response = read_modbus_response(comm_port)
+
+        if check_response(request, response):
+            return response
+        if len(response) == 5 and response[1] == (request[1] | 0x80) and check_crc(response):
+            # Exception response, the device will answer the same way again
+            return None
+
+    return None
+#------------------------------------------------------------------------------
+
 #------------------------------------------------------------------------------
 def data_exchange(settings, comm_port, address, function_code, register_address, registers_qty, data_to_write=None):
     """
@@ -185,26 +336,8 @@ def data_exchange(settings, comm_port, address, function_code, register_address,
     Returns:
         bytes or None: The response data from the device if successful, or None if unsuccessful.
     """
-    response = []
-    tries_left = settings.get('box').get('tries')
-
-    while tries_left > 0:
-        if not response or response[1] == (int(function_code, 16) | 0x80) or not check_crc(response):
-            request = generate_modbus_request(address, function_code, register_address, registers_qty, data_to_write)
-    
-            if not send_modbus_request(comm_port, request) and tries_left > 0:
-                continue
-
-            response = comm_port.readall()
-
-            tries_left -= 1
-        else:
-            break
-    
-        if tries_left == 0:
-            return None
-        else:    
-            return response
+    request = generate_modbus_request(address, function_code, register_address, registers_qty, data_to_write)
+    return transact(settings, comm_port, request)
 #------------------------------------------------------------------------------
 
 #------------------------------------------------------------------------------
@@ -228,6 +361,7 @@ def open_port(settings):
     port = settings.get('box').get('port')
     baudrate = settings.get('box').get('baudrate')
     tries_left = settings.get('box').get('tries')
+    silence = frame_silence(baudrate, settings.get('box').get('min_frame_silence', MIN_FRAME_SILENCE))
 
     while (tries_left > 0):
         try:
@@ -236,7 +370,8 @@ def open_port(settings):
                 baudrate,
                 parity=serial.PARITY_NONE,
                 stopbits=serial.STOPBITS_TWO,
-                timeout=.1
+                timeout=.1,
+                inter_byte_timeout=silence
             )
             if ser is not None:
                 break
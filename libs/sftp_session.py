@@ -0,0 +1,104 @@
+import time
+import socket
+
+import paramiko
+
+# Seconds between two SSH keepalive messages on an idle session
+DEFAULT_KEEPALIVE = 30
+
+# Seconds without answer from the server before a request is abandoned
+DEFAULT_TIMEOUT = 30
+
+#------------------------------------------------------------------------------
+class SFTPSession:
+    """
+    Long-lived SFTP session to the data server.
+
+    The TCP connection, SSH handshake, key exchange and authentication are
+    done once and the session is kept between push cycles, with SSH keepalives
+    so idle NAT mappings and firewalls do not drop it. client() checks the
+    transport and reconnects when the server or the link closed it.
+
+    Args:
+        host (str): Server address.
+        port (int): SSH port.
+        username (str): SFTP user.
+        password (str): Password of the user.
+        keepalive (int): Seconds between two keepalives, 0 to disable.
+        timeout (float): Seconds of the connection and of every request.
+    """
+
+    def __init__(self, host, port, username, password, keepalive=DEFAULT_KEEPALIVE, timeout=DEFAULT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.transport = None
+        self.sftp = None
+        self.connects = 0
+        self.connect_time = 0.0
+
+    @classmethod
+    def from_settings(cls, settings):
+        server_settings = settings.get('server')
+        return cls(server_settings.get('host'), server_settings.get('port'), server_settings.get('username'),
+                   server_settings.get('password'), server_settings.get('keepalive', DEFAULT_KEEPALIVE))
+
+    def matches(self, settings):
+        """
+        True when the session was opened with the server settings of settings.
+        """
+        server_settings = settings.get('server')
+        return ((self.host, self.port, self.username, self.password)
+                == (server_settings.get('host'), server_settings.get('port'),
+                    server_settings.get('username'), server_settings.get('password')))
+
+    @property
+    def active(self):
+        return self.transport is not None and self.transport.is_active()
+
+    def connect(self):
+        self.close()
+        start = time.monotonic()
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        transport = paramiko.Transport(sock)
+        try:
+            transport.banner_timeout = self.timeout
+            transport.auth_timeout = self.timeout
+            transport.connect(username=self.username, password=self.password)
+            if self.keepalive:
+                transport.set_keepalive(self.keepalive)
+            sftp = paramiko.SFTPClient.from_transport(transport)
+            sftp.get_channel().settimeout(self.timeout)
+        except Exception:
+            transport.close()
+            raise
+        self.transport = transport
+        self.sftp = sftp
+        self.connects += 1
+        self.connect_time += time.monotonic() - start
+
+    def client(self):
+        """
+        SFTP client of the session, reconnected if needed.
+
+        Raises:
+            OSError, paramiko.SSHException: The server cannot be reached or refuses the credentials.
+        """
+        if not self.active:
+            self.connect()
+        return self.sftp
+
+    def close(self):
+        if self.sftp is not None:
+            try:
+                self.sftp.close()
+            except Exception:
+                pass
+            self.sftp = None
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+#------------------------------------------------------------------------------
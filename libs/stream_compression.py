@@ -0,0 +1,135 @@
+import lzma
+import zlib
+import queue
+import threading
+
+# Compression methods of the uploads and the suffix of the remote files
+COMPRESSIONS = {
+    'gzip': '.gz',
+    'lzma': '.xz',
+}
+
+# Compression level of each method when none is set (lzma presets above 3 need tens of MB on the Pi)
+DEFAULT_LEVELS = {
+    'gzip': 6,
+    'lzma': 3,
+}
+
+# Compressed chunks waiting for the uploader
+QUEUE_CHUNKS = 8
+
+# Seconds between two checks of the stop request by a compressor blocked on a full queue
+STOP_POLL = 0.5
+
+# End of the compressed chunks in the queue
+END = None
+
+#------------------------------------------------------------------------------
+def compressor(method, level=None):
+    """
+    Compressor object of a method, whose output is one complete gzip member or xz stream.
+
+    Concatenated gzip members and xz streams decompress to the concatenation
+    of their data (gzip -d, xz -d, gzip.decompress, lzma.decompress), so a
+    grown file is uploaded by appending the compressed tail to the remote file.
+
+    Raises:
+        ValueError: Unknown method.
+    """
+    if level is None:
+        level = DEFAULT_LEVELS.get(method)
+    if method == 'gzip':
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if method == 'lzma':
+        return lzma.LZMACompressor(lzma.FORMAT_XZ, preset=level)
+    raise ValueError(f"Unknown compression {method}, expected one of {', '.join(COMPRESSIONS)}")
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class CompressedStream:
+    """
+    Bytes [start, end) of a file, compressed by a worker thread while they are consumed.
+
+    The file is read and compressed chunk by chunk, never whole and without a
+    temporary copy. zlib and lzma release the GIL while they compress, so the
+    worker compresses the next chunks while the consumer thread waits for the
+    network. A bounded queue keeps at most QUEUE_CHUNKS compressed chunks in
+    memory. An error of the worker is raised again by the iteration.
+
+    Args:
+        path (str): Local file.
+        start (int): First byte compressed.
+        end (int): Byte after the last one compressed.
+        method (str): A key of COMPRESSIONS.
+        level (int): Compression level, None for the default of the method.
+        chunk_size (int): Bytes read from the file at once.
+
+    Attributes:
+        input_bytes (int): Bytes of the file compressed so far.
+        output_bytes (int): Compressed bytes handed to the consumer so far.
+    """
+
+    def __init__(self, path, start, end, method, level=None, chunk_size=32768):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.compressor = compressor(method, level)
+        self.chunk_size = chunk_size
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.queue = queue.Queue(QUEUE_CHUNKS)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.compress, daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        """
+        Queue an item, False when the consumer stopped meanwhile.
+        """
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=STOP_POLL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def compress(self):
+        try:
+            with open(self.path, 'rb') as file:
+                file.seek(self.start)
+                remaining = self.end - self.start
+                while remaining:
+                    data = file.read(min(self.chunk_size, remaining))
+                    if not data:
+                        raise IOError(f"{self.path} ended {remaining} bytes before offset {self.end}")
+                    remaining -= len(data)
+                    self.input_bytes += len(data)
+                    compressed = self.compressor.compress(data)
+                    if compressed and not self.put(compressed):
+                        return
+            self.put(self.compressor.flush())
+            self.put(END)
+        except Exception as e:
+            self.put(e)
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            self.output_bytes += len(item)
+            yield item
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+#------------------------------------------------------------------------------
@@ -0,0 +1,131 @@
+import os
+import json
+import hashlib
+
+# Manifest of the files pushed to the server, relative to the installation directory
+MANIFEST_PATH = "data/datapush_manifest.json"
+
+# Leading bytes of a file whose hash tells a grown file from a rewritten one
+ANCHOR_BYTES = 4096
+
+#------------------------------------------------------------------------------
+def anchor_hash(path, length):
+    """
+    SHA-256 of the first min(length, ANCHOR_BYTES) bytes of a file, hex encoded.
+    """
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read(min(length, ANCHOR_BYTES))).hexdigest()
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class UploadManifest:
+    """
+    What the server already holds of each local file.
+
+    Every pushed file has an entry with the size and mtime seen at the last
+    upload, the anchor hash of its first bytes and the remote offset confirmed
+    by the server. A file whose size and mtime did not change is skipped
+    without being read. A file which grew with the same anchor only needs its
+    tail from the remote offset; a smaller file, another anchor or another
+    remote path (the compression changed) means the file is sent again from 0.
+    The remote offset counts bytes of the local file; the remote size is the
+    size of the server copy, smaller when the uploads are compressed.
+
+    The manifest is saved by writing a temporary file, fsyncing it and renaming
+    it over the previous one, so a power cut leaves the old or the new manifest.
+    An unreadable manifest is started again empty: files are then sent again.
+
+    Args:
+        path (str): Manifest file.
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.files = {}
+        self.load_error = None
+        try:
+            with open(path, 'r') as file:
+                self.files = json.load(file).get('files', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            self.load_error = e
+
+    def pending(self, local_path, remote_path=None):
+        """
+        Bytes of a local file the server does not hold yet.
+
+        Args:
+            local_path (str): Local file.
+            remote_path (str): Where the file goes now, None to accept any remote path.
+
+        Returns:
+            tuple or None: (start offset, size) of the data to send, None when
+            the file is unchanged since its last upload.
+        """
+        stat = os.stat(local_path)
+        entry = self.files.get(local_path)
+        if entry is None or (remote_path is not None and entry['remote_path'] != remote_path):
+            return 0, stat.st_size
+        if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime and entry['remote_offset'] == stat.st_size:
+            return None
+        offset = entry['remote_offset']
+        if stat.st_size < offset or anchor_hash(local_path, offset) != entry['hash']:
+            return 0, stat.st_size
+        if offset == stat.st_size:
+            return None
+        return offset, stat.st_size
+
+    def remote_offset(self, local_path):
+        entry = self.files.get(local_path)
+        return entry['remote_offset'] if entry else 0
+
+    def remote_size(self, local_path):
+        """
+        Size of the server copy of a local file at its last upload.
+        """
+        entry = self.files.get(local_path)
+        if not entry:
+            return 0
+        # Entries written before compression existed: the copy is the file itself
+        return entry.get('remote_size', entry['remote_offset'])
+
+    def confirm(self, local_path, remote_path, remote_offset, remote_size=None):
+        """
+        Record the upload of a local file confirmed by the server.
+
+        Args:
+            local_path (str): Local file.
+            remote_path (str): Server copy of the file.
+            remote_offset (int): Bytes of the local file the server holds.
+            remote_size (int): Size of the server copy, None when it is remote_offset (no compression).
+        """
+        stat = os.stat(local_path)
+        self.files[local_path] = {
+            'remote_path': remote_path,
+            # The size and mtime only mean "unchanged" when the whole file was sent
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'hash': anchor_hash(local_path, remote_offset),
+            'remote_offset': remote_offset,
+            'remote_size': remote_offset if remote_size is None else remote_size,
+        }
+
+    def forget_missing(self):
+        """
+        Drop the entries of files deleted locally (fsm frees disk space).
+        """
+        for local_path in [path for path in self.files if not os.path.exists(path)]:
+            del self.files[local_path]
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = self.path + ".tmp"
+        with open(temporary, 'w') as file:
+            json.dump({'files': self.files}, file, indent=1)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.path)
+#------------------------------------------------------------------------------
@@ -0,0 +1,77 @@
+import time
+import random
+
+# Seconds before the first retry after a failed push
+DEFAULT_RETRY_INITIAL = 5
+
+# Longest wait in seconds between two retries during an outage
+DEFAULT_RETRY_MAX = 600
+
+# Upload rate in bytes per second while the backlog drains, 0 for no limit
+DEFAULT_MAX_UPLOAD_RATE = 131072
+
+#------------------------------------------------------------------------------
+class Backoff:
+    """
+    Jittered exponential backoff between the retries of a failing push.
+
+    The n-th consecutive failure waits between half and all of
+    initial * 2^(n-1) seconds, capped at maximum. The random half spreads
+    the retries of devices which lost the server at the same moment, so they
+    do not all come back at once.
+
+    Args:
+        initial (float): Seconds of the first wait.
+        maximum (float): Longest wait in seconds.
+    """
+
+    def __init__(self, initial=DEFAULT_RETRY_INITIAL, maximum=DEFAULT_RETRY_MAX):
+        self.initial = initial
+        self.maximum = maximum
+        self.failures = 0
+
+    def next_delay(self):
+        """
+        Record a failure and return the seconds to wait before the next attempt.
+        """
+        self.failures += 1
+        ceiling = min(self.maximum, self.initial * 2 ** min(self.failures - 1, 32))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def reset(self):
+        self.failures = 0
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class RateLimiter:
+    """
+    Token bucket holding uploads to a rate in bytes per second.
+
+    Up to one second of rate can go at once after an idle time, then consume()
+    sleeps as long as needed to stay at the rate. A small push cycle never
+    waits; a backlog left by an outage drains at the rate instead of taking
+    the whole link.
+
+    Args:
+        rate (float): Bytes per second, 0 for no limit.
+    """
+
+    def __init__(self, rate=DEFAULT_MAX_UPLOAD_RATE):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.waited = 0.0
+
+    def consume(self, size):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate) - size
+        self.last = now
+        if self.tokens < 0:
+            delay = -self.tokens / self.rate
+            time.sleep(delay)
+            self.waited += delay
+            self.last = time.monotonic()
+            self.tokens = 0
+#------------------------------------------------------------------------------
@@ -0,0 +1,254 @@
+import os
+import sys
+import signal
+import time
+import queue
+import itertools
+import threading
+import collections
+import socketserver
+from datetime import datetime
+
+os.chdir("/home/pi/K96Rpi")
+sys.path.append("/home/pi/K96Rpi")
+
+import libs.sensor_data_exchange as sde
+import libs.port_client as pc
+import libs.local as ll
+
+current_date = datetime.now().strftime("%Y%m%d")
+logger = ll.setup_logger(f"{current_date}-portbroker.log")
+
+# Seconds between two queue delay reports in the log
+QUEUE_STATS_INTERVAL = 300
+
+# Queue delays kept per priority class for the percentiles of one report
+QUEUE_DELAY_SAMPLES = 10000
+
+# Seconds the bus worker waits for the port lock held by a client in direct-port fallback mode
+PORT_LOCK_TIMEOUT = 5
+
+#------------------------------------------------------------------------------
+def sigterm_handler(signum, frame):
+    logger.critical(f'PORT BROKER: Sigterm recieved:\n {signum}\n {frame}')
+    sys.exit(0)
+
+signal.signal(signal.SIGTERM, sigterm_handler)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class BusRequest:
+    """
+    One Modbus transaction waiting in the bus queue.
+    """
+    __slots__ = ('request', 'priority', 'queued', 'response', 'done')
+
+    def __init__(self, request, priority):
+        self.request = request
+        self.priority = priority
+        self.queued = time.monotonic()
+        self.response = None
+        self.done = threading.Event()
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class SerialBus:
+    """
+    Owner of the sensor box serial port.
+
+    A single worker thread takes requests from the bus queue one by one, so
+    every transaction on the port is serialized. The port stays open between
+    requests and is reopened after an error or when box settings change.
+    The "port" lock is held as long as the port is open: a client which fell
+    back to opening the port directly while the broker was restarting keeps
+    the broker off the tty until it closes its connection, and no fallback
+    client can open it while the broker owns it.
+
+    The queue is ordered by priority class, then by arrival. A transaction on
+    the bus is never interrupted, so an URGENT request waits at most for the
+    transaction in progress (box.tries answer timeouts in the worst case) and
+    the URGENT requests queued before it. Queue delays are logged per class
+    every QUEUE_STATS_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.requests = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.delays = {priority: collections.deque(maxlen=QUEUE_DELAY_SAMPLES) for priority in pc.PRIORITY_NAMES}
+        self.max_delays = dict.fromkeys(pc.PRIORITY_NAMES, 0.0)
+        self.counts = dict.fromkeys(pc.PRIORITY_NAMES, 0)
+        self.last_report = time.monotonic()
+        self.settings = None
+        self.settings_mtime = 0
+        self.comm_port = None
+        self.port_config = None
+
+    def reload_settings(self):
+        try:
+            mtime = os.path.getmtime('settings.json')
+        except FileNotFoundError:
+            return
+        if mtime <= self.settings_mtime:
+            return
+
+        settings = ll.load_settings()
+        if settings is None:
+            return
+        self.settings = settings
+        self.settings_mtime = mtime
+
+        box = settings.get('box')
+        port_config = (box.get('port'), box.get('baudrate'), box.get('min_frame_silence'))
+        if port_config != self.port_config:
+            self.close_port()
+            self.port_config = port_config
+
+    def close_port(self):
+        if self.comm_port is not None:
+            try:
+                self.comm_port.close()
+            finally:
+                self.comm_port = None
+                ll.release_lock("port", "portbroker")
+
+    def execute(self, request):
+        """
+        Run one transaction on the serial port.
+
+        Args:
+            request (bytes): Complete Modbus request frame including CRC.
+
+        Returns:
+            bytes or None: The validated response frame, or None.
+        """
+        self.reload_settings()
+        if self.settings is None:
+            return None
+
+        if self.comm_port is None:
+            if not ll.acquire_lock("port", "portbroker", PORT_LOCK_TIMEOUT):
+                logger.error(f"PORT BROKER: Port is held by {ll.lock_holder('port')}")
+                return None
+            self.comm_port = sde.open_port(self.settings)
+            if self.comm_port is None:
+                ll.release_lock("port", "portbroker")
+                logger.error("PORT BROKER: Port is not oppened")
+                return None
+            logger.info(f"PORT BROKER: Port {self.port_config[0]} opened")
+
+        try:
+            return sde.transact(self.settings, self.comm_port, request)
+        except Exception as e:
+            logger.error(f"PORT BROKER: Port error, reopening: {e}")
+            self.close_port()
+            return None
+
+    def record_delay(self, job):
+        delay = time.monotonic() - job.queued
+        self.delays[job.priority].append(delay)
+        self.counts[job.priority] += 1
+        self.max_delays[job.priority] = max(self.max_delays[job.priority], delay)
+
+    def report_delays(self):
+        """
+        Log the queue delay percentiles of every priority class and start a new period.
+        """
+        for priority, name in pc.PRIORITY_NAMES.items():
+            delays = sorted(self.delays[priority])
+            if not delays:
+                continue
+            p50 = delays[len(delays) // 2] * 1000
+            p99 = delays[min(len(delays) - 1, int(len(delays) * 0.99))] * 1000
+            logger.info(f"PORT BROKER: Queue delay {name}: {self.counts[priority]} requests, "
+                        f"p50 {p50:.1f} ms, p99 {p99:.1f} ms, max {self.max_delays[priority] * 1000:.1f} ms")
+            self.delays[priority].clear()
+            self.counts[priority] = 0
+            self.max_delays[priority] = 0.0
+        self.last_report = time.monotonic()
+
+    def run(self):
+        while True:
+            _, _, job = self.requests.get()
+            self.record_delay(job)
+            job.response = self.execute(job.request)
+            job.done.set()
+            if time.monotonic() - self.last_report >= QUEUE_STATS_INTERVAL:
+                self.report_delays()
+
+    def submit(self, request, priority=pc.NORMAL):
+        """
+        Queue a request for the bus worker and wait for its response.
+
+        Args:
+            request (bytes): Complete Modbus request frame including CRC.
+            priority (int): pc.URGENT, pc.NORMAL or pc.BULK.
+
+        Returns:
+            bytes or None: The validated response frame, or None.
+        """
+        if priority not in pc.PRIORITY_NAMES:
+            priority = pc.NORMAL
+        job = BusRequest(request, priority)
+        # The sequence number keeps arrival order inside a class and avoids comparing jobs
+        self.requests.put((priority, next(self.sequence), job))
+        job.done.wait()
+        return job.response
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class BrokerRequestHandler(socketserver.BaseRequestHandler):
+    """
+    Serve requests of one client connection until the client disconnects.
+    """
+
+    def handle(self):
+        while True:
+            try:
+                received = pc.recv_request(self.request)
+                if received is None:
+                    return
+                priority, request = received
+                response = self.server.bus.submit(request, priority)
+                pc.send_frame(self.request, response or b'')
+            except OSError:
+                return
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, bus):
+        self.bus = bus
+        super().__init__(socket_path, BrokerRequestHandler)
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def main():
+    settings = ll.load_settings()
+    if settings is None:
+        logger.critical('PORT BROKER: Settings file corrupted.')
+        sys.exit(1)
+
+    socket_path = settings.get('box').get('broker_socket', pc.DEFAULT_BROKER_SOCKET)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    bus = SerialBus()
+    threading.Thread(target=bus.run, daemon=True).start()
+
+    try:
+        with BrokerServer(socket_path, bus) as server:
+            os.chmod(socket_path, 0o660)
+            logger.info(f"PORT BROKER: Listening on {socket_path}")
+            server.serve_forever()
+    except Exception as e:
+        logger.critical(f"PORT BROKER: {e}")
+    finally:
+        bus.close_port()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+#------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
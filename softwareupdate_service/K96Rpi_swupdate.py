@@ -21,11 +21,6 @@ def sigterm_handler(signum, frame):
 signal.signal(signal.SIGTERM, sigterm_handler)
 #------------------------------------------------------------------------------
 
-files = [f for f in os.listdir('locks') if f.endswith('-swupdate.lock')]
-for file in files:
-    file_path = os.path.join('locks', file)
-    os.remove(file_path)
-
 current_date = datetime.now().strftime("%Y%m%d")
 logger = ll.setup_logger(f"{current_date}-swupdate.log")
 
@@ -55,3 +55,8 @@ echo -e "\033[1;33mStop K96Rpi usb connection manager service...\033[0m"
 sudo systemctl stop K96Rpi_usb_manager.timer
 sudo systemctl stop K96Rpi_usb_manager.service
 echo -e "\033[1;32mK96Rpi usb connection manager service stopped.\033[0m"
+
+#stop serial port broker service
+echo -e "\033[1;33mStop K96Rpi serial port broker service...\033[0m"
+sudo systemctl stop K96Rpi_portbroker.service
+echo -e "\033[1;32mK96Rpi serial port broker service stopped.\033[0m"
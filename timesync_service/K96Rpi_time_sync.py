@@ -8,7 +8,7 @@ import signal
 os.chdir("/home/pi/K96Rpi")
 sys.path.append("/home/pi/K96Rpi")
 
-import libs.sensor_data_exchange as sde
+import libs.port_client as pc
 import libs.local as ll
 
 current_date = datetime.datetime.now().strftime("%Y%m%d")
@@ -21,11 +21,6 @@ def sigterm_handler(signum, frame):
 
 signal.signal(signal.SIGTERM, sigterm_handler)
 
-files = [f for f in os.listdir('locks') if f.endswith('-timesync.lock')]
-for file in files:
-    file_path = os.path.join('locks', file)
-    os.remove(file_path)
-
 #------------------------------------------------------------------------------
 def update_RTC_time(settings, comm_port, server_datetime_24h, arduino_address, time_register_address):
     write_time = settings.get('box').get('modbus_functions').get('WRITE_MULTIPLE_HR')
@@ -33,7 +28,7 @@ def update_RTC_time(settings, comm_port, server_datetime_24h, arduino_address, t
     unix_time = int(server_datetime_24h.timestamp())
     unix_time_to_RTC = hex(unix_time)
         
-    write_to_RTC = sde.data_exchange(settings, comm_port, arduino_address, write_time, time_register_address, 4, unix_time_to_RTC)
+    write_to_RTC = pc.data_exchange(settings, comm_port, arduino_address, write_time, time_register_address, 4, unix_time_to_RTC, priority=pc.URGENT)
     
     if write_to_RTC is not None:
         logger.info("TIMESYNC: RTC time updated to server time")
@@ -44,7 +39,7 @@ def update_RTC_time(settings, comm_port, server_datetime_24h, arduino_address, t
 #------------------------------------------------------------------------------
 def sync_with_RTC(settings, comm_port, arduino_address, time_register_address):
     read_time = settings.get('box').get('modbus_functions').get('READ_MULTIPLE_HR')
-    values = sde.data_exchange(settings, comm_port, arduino_address, read_time, time_register_address, 2)
+    values = pc.data_exchange(settings, comm_port, arduino_address, read_time, time_register_address, 2)
 
     if values is None or len(values[3:-2]) != 2:
         logger.fatal("TIMESYNC: Error reading registers")
@@ -92,7 +87,7 @@ def synchronize_time(settings, comm_port):
     
     Args:
         settings (dict): A dictionary containing configuration settings.
-        comm_port (str): The communication port for the device.
+        comm_port (PortConnection): Connection to the sensor box serial port.
     
     Returns:
         int: A status code (999 indicates success, None indicates an error).
@@ -144,8 +139,7 @@ def main():
             logger.critical('TIMESYNC: Settings file corrupted.')
             sys.exit(1)
         
-        ll.acquire_lock("port", "timesync")
-        comm_port = sde.open_port(settings)
+        comm_port = pc.open_port(settings, "timesync")
         if comm_port is not None:
             time_sync_complete = synchronize_time(settings, comm_port)
             if not time_sync_complete:
@@ -156,10 +150,12 @@ def main():
             comm_port = None
         else:
             logger.critical('TIMESYNC: Finised with error. Port not open')
-        ll.release_lock("port", "timesync")
 
     except Exception as e:
         logger.critical(f'TIMESYNC: Unknown error. {e}')
+    finally:
+        if comm_port is not None:
+            comm_port.close()
 #------------------------------------------------------------------------------
 
 if __name__ == "__main__":
@@ -0,0 +1,73 @@
+"""
+Show the lock wait and hold time histograms recorded by libs/local.py.
+
+Every service merges its statistics into logs/lock_stats/<resource>-<service>.json
+once a minute and at exit. Long "wait" tails on the port lock show a service
+starved by the others, long "hold" times show who keeps the port busy.
+
+Usage:
+    python3 tools/K96Rpi_lock_stats.py [--resource port] [--directory logs/lock_stats]
+"""
+import os
+import sys
+import json
+import glob
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Width of the longest histogram bar
+BAR_WIDTH = 40
+
+#------------------------------------------------------------------------------
+def bucket_label(bound):
+    lower = bound // 2
+    if lower == 0:
+        return f"{'< 1 ':>11}ms"
+    return f"{lower:>5}-{bound:<5}ms"
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def print_histogram(name, histogram):
+    count = histogram.get('count', 0)
+    if count == 0:
+        print(f"  {name}: no samples")
+        return
+    print(f"  {name}: {count} samples, mean {histogram['total_ms'] / count:.2f} ms, max {histogram['max_ms']:.2f} ms")
+    buckets = sorted((int(bound), value) for bound, value in histogram.get('buckets', {}).items())
+    largest = max(value for _, value in buckets)
+    for bound, value in buckets:
+        bar = '#' * max(1, round(value / largest * BAR_WIDTH))
+        print(f"    {bucket_label(bound)} {value:>9} {value / count * 100:6.2f}% {bar}")
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Lock wait/hold time histograms")
+    parser.add_argument('--directory', default=os.path.join(ROOT, 'logs', 'lock_stats'), help="lock statistics directory")
+    parser.add_argument('--resource', default=None, help="only show this resource (port, rawdata, userdata, settings...)")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.directory, '*.json')))
+    if not paths:
+        print(f"No lock statistics in {args.directory}")
+        sys.exit(1)
+
+    for path in paths:
+        try:
+            with open(path, 'r') as file:
+                stats = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"{path}: cannot be read ({e})")
+            continue
+        if args.resource is not None and stats.get('resource') != args.resource:
+            continue
+
+        print(f"{stats.get('resource')} / {stats.get('service')} (updated {stats.get('updated')}, timeouts {stats.get('timeouts', 0)})")
+        print_histogram('wait', stats.get('wait', {}))
+        print_histogram('hold', stats.get('hold', {}))
+        print()
+#------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
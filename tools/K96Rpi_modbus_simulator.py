@@ -0,0 +1,307 @@
+"""
+Software stand-in for the K96 sensor and the Arduino box on a pseudo-terminal.
+
+The simulator opens a pty pair and answers the Modbus RTU requests the services
+send, as slave 0x68 (K96 sensor: READ_RAM, READ_EPROM, WRITE_RAM) and slave 0x69
+(Arduino: READ_MULTIPLE_HR, READ_MULTIPLE_IR, WRITE_SINGLE_HR, WRITE_MULTIPLE_HR).
+Memory is seeded from the register maps of settings.json. Pointing box.port to
+the printed pty path lets sde.open_port, the port broker and every service run
+against it on a plain Linux box.
+
+Usage:
+    python3 tools/K96Rpi_modbus_simulator.py [--settings settings.json] [--update-settings]
+        [--latency 0.002] [--crc-error-rate 0.01] [--exception-rate 0.01]
+"""
+import os
+import sys
+import tty
+import json
+import time
+import random
+import select
+import argparse
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import libs.sensor_data_exchange as sde
+
+SENSOR_ADDRESS = 0x68
+ARDUINO_ADDRESS = 0x69
+
+# Memory sizes: K96 RAM and EPROM in bytes, Arduino registers in 16 bit words
+RAM_SIZE = 0x800
+EPROM_SIZE = 0x800
+REGISTERS_QTY = 0x200
+
+# Arduino holding register of the RTC unix time (2 words)
+RTC_REGISTER = 0x0010
+
+# Modbus exception codes
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+SLAVE_DEVICE_FAILURE = 0x04
+
+#------------------------------------------------------------------------------
+class ModbusSimulator:
+    """
+    K96 sensor and Arduino box answering Modbus RTU requests on a pty.
+
+    Args:
+        settings (dict): Settings used to seed the register contents.
+        latency (float): Delay in seconds before every answer.
+        crc_error_rate (float): Probability of an answer with a corrupted CRC.
+        exception_rate (float): Probability of a SLAVE_DEVICE_FAILURE exception answer.
+        seed (int): Random generator seed, for reproducible runs.
+    """
+
+    def __init__(self, settings, latency=0.0, crc_error_rate=0.0, exception_rate=0.0, seed=None):
+        self.settings = settings
+        self.latency = latency
+        self.crc_error_rate = crc_error_rate
+        self.exception_rate = exception_rate
+        self.random = random.Random(seed)
+
+        self.ram = bytearray(RAM_SIZE)
+        self.eprom = bytearray(EPROM_SIZE)
+        self.holding_registers = [0] * REGISTERS_QTY
+        self.input_registers = [0] * REGISTERS_QTY
+
+        self.requests = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+        self.master_fd = None
+        self.slave_fd = None
+        self.port_name = None
+        self.thread = None
+        self.running = False
+        self.silence = sde.frame_silence(settings.get('box').get('baudrate', 115200),
+                                         settings.get('box').get('min_frame_silence', sde.MIN_FRAME_SILENCE))
+
+        self.seed_memory()
+
+    def seed_memory(self):
+        """
+        Fill RAM, EPROM and Arduino registers with plausible values for every
+        register defined in settings.json.
+        """
+        raw_data = self.settings.get('raw_data')
+        sensor_info = self.settings.get('sensor_info')
+        box = self.settings.get('box')
+
+        for name, value in raw_data.get('registers').items():
+            address = int(value.get('address'), 16)
+            length = value.get('data_length_bytes')
+            if value.get('type') == 'meas':
+                number = self.random.randint(100, 1000)
+            elif value.get('keep_in') == 'hex':
+                number = 0
+            else:
+                number = self.random.randint(0, 0x7F)
+            self.ram[address:address + length] = number.to_bytes(length, 'big')
+
+        for value in sensor_info.get('RAM_statuses').values():
+            address = int(value.get('address'), 16)
+            length = value.get('data_length_bytes')
+            self.ram[address:address + length] = self.random.getrandbits(8 * length).to_bytes(length, 'big')
+
+        for value in sensor_info.get('EPROM_statuses').values():
+            address = int(value.get('address'), 16)
+            length = value.get('data_length_bytes')
+            self.eprom[address:address + length] = self.random.getrandbits(8 * length).to_bytes(length, 'big')
+
+        sensor_id_address = int(box.get('sensor_id_address'), 16)
+        self.eprom[sensor_id_address:sensor_id_address + 4] = int(box.get('sensor_id')).to_bytes(4, 'big')
+
+        for value in raw_data.get('arduino_registers').values():
+            registers = self.input_registers if value.get('register_type') == 'IR' else self.holding_registers
+            registers[int(value.get('address'), 16)] = self.random.randint(0, 1000)
+        for value in sensor_info.get('Arduino_Statuses').values():
+            registers = self.input_registers if value.get('register_type') == 'IR' else self.holding_registers
+            registers[int(value.get('address'), 16)] = self.random.randint(0, 1000)
+
+        # Ambient temperature below the hwmonitor overheat threshold, pump running
+        self.input_registers[int(raw_data.get('arduino_registers').get('ntc_airambient_temp').get('address'), 16)] = 2500
+        self.input_registers[int(self.settings.get('pid1_output_address'), 16)] = 120
+        self.set_rtc(int(time.time()))
+
+    def set_rtc(self, unix_time):
+        self.holding_registers[RTC_REGISTER] = (unix_time >> 16) & 0xFFFF
+        self.holding_registers[RTC_REGISTER + 1] = unix_time & 0xFFFF
+
+    def start(self):
+        """
+        Open the pty pair and start answering requests in a background thread.
+
+        Returns:
+            str: Path of the pty to open as the serial port.
+        """
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.master_fd)
+        tty.setraw(self.slave_fd)
+        self.port_name = os.ttyname(self.slave_fd)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.port_name
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        for fd in (self.master_fd, self.slave_fd):
+            if fd is not None:
+                os.close(fd)
+        self.master_fd = None
+        self.slave_fd = None
+
+    def read_frame(self):
+        """
+        Read one request: bytes received until the line is silent for 3.5 characters.
+
+        Returns:
+            bytes or None: The request frame, or None if nothing was received.
+        """
+        ready, _, _ = select.select([self.master_fd], [], [], 0.1)
+        if not ready:
+            return None
+        frame = os.read(self.master_fd, 512)
+        while True:
+            ready, _, _ = select.select([self.master_fd], [], [], self.silence)
+            if not ready:
+                return frame
+            frame += os.read(self.master_fd, 512)
+
+    def run(self):
+        while self.running:
+            try:
+                request = self.read_frame()
+            except OSError:
+                return
+            if not request:
+                continue
+            self.requests += 1
+            self.bytes_in += len(request)
+
+            response = self.answer(request)
+            if response is None:
+                continue
+            if self.latency:
+                time.sleep(self.latency)
+            if self.crc_error_rate and self.random.random() < self.crc_error_rate:
+                response = response[:-1] + bytes([response[-1] ^ 0xFF])
+            self.bytes_out += len(response)
+            os.write(self.master_fd, response)
+
+    def answer(self, request):
+        """
+        Build the answer to one request frame.
+
+        Args:
+            request (bytes): Request frame including CRC.
+
+        Returns:
+            bytes or None: Answer frame including CRC, None if the request is not
+            for the box or its CRC is invalid (a real slave stays silent).
+        """
+        if len(request) < 4 or not sde.check_crc(request):
+            return None
+        slave, function = request[0], request[1]
+        if slave not in (SENSOR_ADDRESS, ARDUINO_ADDRESS):
+            return None
+
+        if self.exception_rate and self.random.random() < self.exception_rate:
+            return self.exception(slave, function, SLAVE_DEVICE_FAILURE)
+
+        address = int.from_bytes(request[2:4], 'big')
+        try:
+            if slave == SENSOR_ADDRESS:
+                return self.answer_sensor(slave, function, address, request)
+            return self.answer_arduino(slave, function, address, request)
+        except IndexError:
+            return self.exception(slave, function, ILLEGAL_DATA_ADDRESS)
+
+    def answer_sensor(self, slave, function, address, request):
+        if function in (0x44, 0x46):
+            memory = self.ram if function == 0x44 else self.eprom
+            qty = request[4]
+            if address + qty > len(memory):
+                raise IndexError
+            return self.frame(bytes([slave, function, qty]) + bytes(memory[address:address + qty]))
+        if function == 0x41:
+            qty = request[4]
+            data = request[5:5 + qty]
+            if address + qty > len(self.ram):
+                raise IndexError
+            self.ram[address:address + qty] = data
+            return self.frame(bytes([slave, function]))
+        return self.exception(slave, function, ILLEGAL_FUNCTION)
+
+    def answer_arduino(self, slave, function, address, request):
+        if function in (0x03, 0x04):
+            registers = self.holding_registers if function == 0x03 else self.input_registers
+            qty = int.from_bytes(request[4:6], 'big')
+            if address + qty > len(registers):
+                raise IndexError
+            data = b''.join(value.to_bytes(2, 'big') for value in registers[address:address + qty])
+            return self.frame(bytes([slave, function, len(data)]) + data)
+        if function == 0x06:
+            self.holding_registers[address] = int.from_bytes(request[4:6], 'big')
+            return bytes(request)
+        if function == 0x10:
+            # Services send <address><qty in bytes><data>, stored as 16 bit words
+            qty = request[4]
+            data = request[5:5 + qty]
+            words = [int.from_bytes(data[i:i + 2].rjust(2, b'\x00'), 'big') for i in range(0, len(data), 2)]
+            if address + len(words) > len(self.holding_registers):
+                raise IndexError
+            self.holding_registers[address:address + len(words)] = words
+            return self.frame(bytes([slave, function]) + address.to_bytes(2, 'big') + len(words).to_bytes(2, 'big'))
+        return self.exception(slave, function, ILLEGAL_FUNCTION)
+
+    def exception(self, slave, function, code):
+        return self.frame(bytes([slave, function | 0x80, code]))
+
+    @staticmethod
+    def frame(payload):
+        return payload + bytes(sde.calculate_crc(payload))
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="K96 sensor and Arduino box Modbus simulator")
+    parser.add_argument('--settings', default=os.path.join(ROOT, 'settings.json'), help="settings file to seed registers from")
+    parser.add_argument('--update-settings', action='store_true', help="write the pty path to box.port of the settings file")
+    parser.add_argument('--latency', type=float, default=0.0, help="answer delay in seconds")
+    parser.add_argument('--crc-error-rate', type=float, default=0.0, help="probability of a corrupted CRC")
+    parser.add_argument('--exception-rate', type=float, default=0.0, help="probability of an exception answer")
+    parser.add_argument('--seed', type=int, default=None, help="random seed")
+    args = parser.parse_args()
+
+    with open(args.settings, 'r') as file:
+        settings = json.load(file)
+
+    simulator = ModbusSimulator(settings, args.latency, args.crc_error_rate, args.exception_rate, args.seed)
+    port_name = simulator.start()
+    print(f"Simulator listening on {port_name}", flush=True)
+
+    if args.update_settings:
+        settings['box']['port'] = port_name
+        with open(args.settings, 'w') as file:
+            json.dump(settings, file, indent=4)
+
+    try:
+        while True:
+            time.sleep(10)
+            print(f"requests: {simulator.requests}, bytes in: {simulator.bytes_in}, bytes out: {simulator.bytes_out}", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+#------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
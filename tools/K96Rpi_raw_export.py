@@ -0,0 +1,77 @@
+"""
+Convert binary raw data files (raw_data.format "binary") to the raw data CSV.
+
+The CSV is the one datacollection writes in the "csv" format: fsm header row,
+then one row per sample with local timestamps, location, hex registers as
+"0x00A1" and -999.99 for the registers which could not be read. Files are read
+block by block, so the tool runs on the box or on the server receiving the
+files without the settings: the register layout is stored in each file.
+
+Usage:
+    python3 tools/K96Rpi_raw_export.py FILE.bin [FILE.bin ...] [--output DIR | -]
+"""
+import os
+import sys
+import csv
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import libs.raw_binary as rb
+
+#------------------------------------------------------------------------------
+def export_file(path, output):
+    """
+    Write the CSV rows of a binary raw data file.
+
+    Args:
+        path (str): Binary raw data file.
+        output (file): Text file the CSV is written to.
+
+    Returns:
+        BlockReader: Reader of the file, with its bad_blocks and truncated counts.
+    """
+    with open(path, 'rb') as file:
+        reader = rb.BlockReader(file)
+        rows = reader.csv_rows()
+        # Same quoting as the fsm header and the datacollection rows
+        csv.writer(output, quoting=csv.QUOTE_NONE).writerow(next(rows))
+        csv.writer(output).writerows(rows)
+    return reader
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Convert binary raw data files to CSV")
+    parser.add_argument('files', nargs='+', help="binary raw data files")
+    parser.add_argument('--output', default=None,
+                        help="directory of the CSV files (default: next to each file), - for stdout")
+    args = parser.parse_args()
+
+    failed = False
+    for path in args.files:
+        try:
+            if args.output == '-':
+                reader = export_file(path, sys.stdout)
+                target = "stdout"
+            else:
+                directory = args.output or os.path.dirname(path)
+                target = os.path.join(directory, os.path.splitext(os.path.basename(path))[0] + '.csv')
+                with open(target, 'w', newline='') as output:
+                    reader = export_file(path, output)
+        except (OSError, ValueError) as e:
+            print(f"{path}: {str(e)}", file=sys.stderr)
+            failed = True
+            continue
+        if reader.bad_blocks or reader.truncated:
+            print(f"{path}: {reader.bad_blocks} corrupted block(s) skipped, {reader.truncated} truncated block(s) at the end",
+                  file=sys.stderr)
+        if args.output != '-':
+            print(f"{path} -> {target}", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+#------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Extract a time range of raw data samples from daily raw data files.
+
+Files named YYYYMMDD_..._raw_data.csv/.bin outside the range are skipped
+(with one day of margin, a file holds the samples until fsm rotates it). In
+the other files the sidecar index written by datacollection (libs/raw_index.py)
+gives the offset of a row or block shortly before the start of the range, the
+file is memory-mapped and read from there until the end of the range. Files
+without an index are read from their start. Binary files are converted to the
+CSV layout.
+
+Usage:
+    python3 tools/K96Rpi_raw_query.py --start "2024-09-17 10:00" --end "2024-09-17 11:00"
+        [--directory data/raw_data | FILE ...] [--output FILE] [--no-index] [--no-header]
+"""
+import os
+import sys
+import glob
+import datetime
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import libs.raw_index as ri
+
+#------------------------------------------------------------------------------
+def select_files(paths, start, end):
+    """
+    Raw data files which may hold samples between start and end, in date order.
+    """
+    first = datetime.date.fromisoformat(start[:10]) - datetime.timedelta(days=1)
+    last = datetime.date.fromisoformat(end[:10])
+    selected = []
+    for path in paths:
+        if path.endswith(ri.INDEX_SUFFIX):
+            continue
+        date = ri.file_date(path)
+        if date is None or first <= date <= last:
+            selected.append(path)
+    return sorted(selected, key=lambda path: (ri.file_date(path) or datetime.date.min, path))
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def query(paths, start, end, output, use_index=True, header=True):
+    """
+    Write the rows of the files with a timestamp in [start, end].
+
+    Returns:
+        int: Rows written.
+    """
+    rows = 0
+    for path in paths:
+        if header and os.path.getsize(path):
+            output.write(ri.file_header(path))
+            header = False
+        for row in ri.file_range(path, start, end, use_index):
+            output.write(row)
+            rows += 1
+    return rows
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Extract a time range of raw data samples")
+    parser.add_argument('files', nargs='*', help="raw data files (default: all files of --directory)")
+    parser.add_argument('--directory', default=os.path.join(ROOT, 'data', 'raw_data'), help="raw data directory")
+    parser.add_argument('--start', required=True, help="first local time of the range, ISO format")
+    parser.add_argument('--end', required=True, help="last local time of the range, ISO format")
+    parser.add_argument('--output', default=None, help="CSV file of the rows (default: stdout)")
+    parser.add_argument('--no-index', action='store_true', help="scan the files instead of using their index")
+    parser.add_argument('--no-header', action='store_true', help="do not write the CSV header row")
+    args = parser.parse_args()
+
+    try:
+        start, end = ri.parse_time(args.start), ri.parse_time(args.end)
+    except ValueError as e:
+        parser.error(str(e))
+    # fsm names the daily files ..._raw_data.csv (or .bin), sensor_data files share the directory
+    paths = args.files or glob.glob(os.path.join(args.directory, '*_raw_data*'))
+    paths = select_files([path for path in paths if os.path.isfile(path)], start, end)
+
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        rows = query(paths, start, end, output, not args.no_index, not args.no_header)
+    finally:
+        if args.output:
+            output.close()
+    print(f"{rows} rows from {len(paths)} file(s)", file=sys.stderr)
+#------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
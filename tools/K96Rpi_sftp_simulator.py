@@ -0,0 +1,303 @@
+"""
+Software stand-in for the data server: an SFTP server on localhost.
+
+Accepts the username and password of the server section of settings.json and
+stores the uploaded files under a local root directory. A Windows style remote
+path like "c:/SUEZ_collected_data/user_data/x.csv" is stored as
+<root>/SUEZ_collected_data/user_data/x.csv. With --latency, the connections go
+through a delay line adding that many seconds in each direction, to look like
+a slow link without slowing down the server itself; --bandwidth also limits
+the bytes per second of each direction, like a cellular uplink.
+
+Usage:
+    python3 tools/K96Rpi_sftp_simulator.py --root /tmp/server [--port 2222] [--latency 0.05]
+        [--bandwidth 100000] [--settings settings.json] [--update-settings]
+"""
+import os
+import sys
+import json
+import time
+import heapq
+import socket
+import argparse
+import threading
+
+import paramiko
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+# Bytes read from a socket at once by the delay line
+RELAY_CHUNK = 65536
+
+#------------------------------------------------------------------------------
+class SFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return paramiko.SFTP_OK
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class SFTPServerInterface(paramiko.SFTPServerInterface):
+    """
+    Files of the SFTP server, under the root directory.
+    """
+
+    def __init__(self, server, root, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = root
+
+    def local_path(self, path):
+        path = path.replace('\\', '/')
+        # Drive letter of the Windows server
+        if len(path) >= 2 and path[1] == ':':
+            path = path[2:]
+        return os.path.join(self.root, os.path.normpath('/' + path).lstrip('/'))
+
+    def canonicalize(self, path):
+        return paramiko.SFTPServer.canonicalize_path('/' + path.lstrip('/'))
+
+    def list_folder(self, path):
+        local_path = self.local_path(path)
+        try:
+            return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(local_path, name)), name)
+                    for name in os.listdir(local_path)]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.local_path(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        local_path = self.local_path(path)
+        try:
+            fd = os.open(local_path, flags | getattr(os, 'O_BINARY', 0), 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+        handle = SFTPHandle(flags)
+        handle.filename = local_path
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self.local_path(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.replace(self.local_path(oldpath), self.local_path(newpath))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    posix_rename = rename
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self.local_path(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self.local_path(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def chattr(self, path, attr):
+        return paramiko.SFTP_OK
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class ServerInterface(paramiko.ServerInterface):
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (self.username, self.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def relay(source, destination, latency, bandwidth=0):
+    """
+    Copy a socket to another one, each chunk delivered latency seconds after it was read.
+
+    With a bandwidth (bytes per second), a chunk is also delayed until the
+    chunks before it had time to go through the link.
+    """
+    pending = []
+    condition = threading.Condition()
+    closed = []
+
+    def deliver():
+        while True:
+            with condition:
+                while not pending and not closed:
+                    condition.wait()
+                if not pending:
+                    break
+                due, _, data = pending[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    condition.wait(delay)
+                    continue
+                heapq.heappop(pending)
+            try:
+                destination.sendall(data)
+            except OSError:
+                break
+        try:
+            destination.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    thread = threading.Thread(target=deliver, daemon=True)
+    thread.start()
+    sequence = 0
+    # Time at which the link has sent the chunks read so far
+    link_free = 0.0
+    while True:
+        try:
+            data = source.recv(RELAY_CHUNK)
+        except OSError:
+            data = b''
+        with condition:
+            if not data:
+                closed.append(True)
+                condition.notify()
+                break
+            sequence += 1
+            due = time.monotonic()
+            if bandwidth:
+                link_free = max(link_free, due) + len(data) / bandwidth
+                due = link_free
+            heapq.heappush(pending, (due + latency, sequence, data))
+            condition.notify()
+    thread.join()
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+class SFTPSimulator:
+    """
+    SFTP server storing the uploads under root.
+
+    Args:
+        root (str): Directory of the server files.
+        username (str): Accepted username.
+        password (str): Accepted password.
+        port (int): Listening port, 0 for any free port.
+        latency (float): Delay in seconds added in each direction.
+        bandwidth (float): Bytes per second of each direction, 0 for no limit.
+    """
+
+    def __init__(self, root, username, password, port=0, latency=0.0, bandwidth=0):
+        self.root = root
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.connections = 0
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', port))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+        self.transports = []
+        os.makedirs(root, exist_ok=True)
+
+    def serve(self, client):
+        if self.latency or self.bandwidth:
+            # The server end of a socket pair, the delay line between it and the client
+            server_side, relay_side = socket.socketpair()
+            threading.Thread(target=relay, args=(client, relay_side, self.latency, self.bandwidth), daemon=True).start()
+            threading.Thread(target=relay, args=(relay_side, client, self.latency, self.bandwidth), daemon=True).start()
+            client = server_side
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
+        transport.set_subsystem_handler('sftp', paramiko.SFTPServer, SFTPServerInterface, self.root)
+        transport.start_server(server=ServerInterface(self.username, self.password))
+        self.transports.append(transport)
+
+    def run(self):
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                break
+            self.connections += 1
+            threading.Thread(target=self.serve, args=(client,), daemon=True).start()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+    def close(self):
+        self.listener.close()
+        for transport in self.transports:
+            transport.close()
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="SFTP stand-in for the data server")
+    parser.add_argument('--root', required=True, help="directory of the server files")
+    parser.add_argument('--port', type=int, default=2222, help="listening port on 127.0.0.1")
+    parser.add_argument('--latency', type=float, default=0.0, help="delay in seconds added in each direction")
+    parser.add_argument('--bandwidth', type=float, default=0, help="bytes per second in each direction, 0 for no limit")
+    parser.add_argument('--settings', default=os.path.join(ROOT, 'settings.json'), help="settings file of the credentials")
+    parser.add_argument('--update-settings', action='store_true', help="point server.host and server.port of the settings to the simulator")
+    args = parser.parse_args()
+
+    with open(args.settings, 'r') as file:
+        settings = json.load(file)
+    server_settings = settings.get('server')
+    simulator = SFTPSimulator(args.root, server_settings.get('username'), server_settings.get('password'),
+                              args.port, args.latency, args.bandwidth).start()
+    if args.update_settings:
+        server_settings['host'] = '127.0.0.1'
+        server_settings['port'] = simulator.port
+        with open(args.settings, 'w') as file:
+            json.dump(settings, file, indent=4)
+    print(f"SFTP simulator on 127.0.0.1:{simulator.port}, files in {args.root}", flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.close()
+#------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
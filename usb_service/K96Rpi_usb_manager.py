@@ -7,7 +7,7 @@ import datetime
 os.chdir("/home/pi/K96Rpi")
 sys.path.append("/home/pi/K96Rpi")
 
-import libs.sensor_data_exchange as sde
+import libs.port_client as pc
 import libs.local as ll
 
 current_date = datetime.datetime.now().strftime("%Y%m%d")
@@ -20,11 +20,6 @@ def sigterm_handler(signum, frame):
 
 signal.signal(signal.SIGTERM, sigterm_handler)
 
-files = [f for f in os.listdir('locks') if f.endswith('-usb.lock')]
-for file in files:
-    file_path = os.path.join('locks', file)
-    os.remove(file_path)
-
 #------------------------------------------------------------------------------
 def find_usb_port(box_id):
     """
@@ -70,11 +65,12 @@ def main():
                 if settings['box']['port'] != port:
                     settings['box']['port'] = port
                     logger.info(f'USB CONNECTION SERVICE: Device was found on {port}')
+                    # The port broker reopens the port when settings change
+                    ll.save_settings(settings)
                     
-                ll.acquire_lock("port", "usb")
-                comm_port = sde.open_port(settings)
+                comm_port = pc.open_port(settings, "usb")
                 if comm_port is not None:
-                    sensor_id_raw = sde.data_exchange(settings, comm_port, sensor_address, function, sensor_id_address, 4)
+                    sensor_id_raw = pc.data_exchange(settings, comm_port, sensor_address, function, sensor_id_address, 4)
                     if sensor_id_raw is not None:
                         sensor_id_new = sensor_id_raw[3:-2]
                         if sensor_id_new is not None:
@@ -88,7 +84,6 @@ def main():
                     comm_port = None
                 else:
                     logger.critical("USB CONNECTION SERVICE: Cannot get sensor ID, comm port not opened")
-                ll.release_lock("port", "usb")
                     
                 ll.save_settings(settings)
                 break